@@ -13,6 +13,7 @@ from tornado import gen, ioloop, web
 from tornado.iostream import StreamClosedError
 from tornado.websocket import WebSocketHandler, WebSocketClosedError
 
+from jupyter_client import protocol_version
 from jupyter_client.session import Session
 from jupyter_client.jsonutil import date_default, extract_dates
 from ipython_genutils.py3compat import cast_unicode
@@ -41,6 +42,53 @@ def serialize_binary_message(msg):
     msg = msg.copy()
     buffers = list(msg.pop('buffers'))
     bmsg = json.dumps(msg, default=date_default).encode('utf8')
+    return _pack_binary_message(bmsg, buffers)
+
+
+def serialize_msg_frames(msg_list, header, channel=None):
+    """serialize the frames of a zmq message for a websocket without unpacking them
+
+    The JSON encoded header, parent_header, metadata and content frames are
+    spliced into the websocket message as-is.
+
+    Parameters
+    ----------
+
+    msg_list : list of bytes
+        The zmq message without identities: [HMAC, p_header, p_parent,
+        p_metadata, p_content, buffer1, buffer2, ...]
+    header : dict
+        The unpacked header of the message.
+    channel : str, optional
+        The channel on which the message was received.
+
+    Returns
+    -------
+
+    The message as a str, or as bytes in the binary format if it has buffers.
+
+    """
+    parts = [
+        b'{"header": ', msg_list[1],
+        b', "msg_id": ', json.dumps(header['msg_id']).encode('utf8'),
+        b', "msg_type": ', json.dumps(header['msg_type']).encode('utf8'),
+        b', "parent_header": ', msg_list[2],
+        b', "metadata": ', msg_list[3],
+        b', "content": ', msg_list[4],
+    ]
+    if channel:
+        parts.extend([b', "channel": ', json.dumps(channel).encode('utf8')])
+    buffers = msg_list[5:]
+    if buffers:
+        parts.append(b'}')
+        return _pack_binary_message(b''.join(parts), list(buffers))
+    parts.append(b', "buffers": []}')
+    # as Session.unpack does, rather than failing on invalid UTF-8
+    return b''.join(parts).decode('utf8', 'replace')
+
+
+def _pack_binary_message(bmsg, buffers):
+    """pack a JSON encoded message and its buffers into the binary format"""
     buffers.insert(0, bmsg)
     nbufs = len(buffers)
     offsets = [4 * (nbufs + 1)]
@@ -207,11 +255,13 @@ class ZMQStreamHandler(WebSocketMixin, WebSocketHandler):
                 self.stream.close()
 
     
-    def _reserialize_reply(self, msg_or_list, channel=None):
+    def _reserialize_reply(self, msg_or_list, channel=None, header=None):
         """Reserialize a reply message using JSON.
 
         msg_or_list can be an already-deserialized msg dict or the zmq buffer list.
         If it is the zmq list, it will be deserialized with self.session.
+        If the header of the zmq list was already unpacked by _unpack_header,
+        it can be passed as header, with msg_or_list stripped of its identities.
         
         This takes the msg list from the ZMQ socket and serializes the result for the websocket.
         This method should be used by self._on_zmq_reply to build messages that can
@@ -222,7 +272,18 @@ class ZMQStreamHandler(WebSocketMixin, WebSocketHandler):
             # already unpacked
             msg = msg_or_list
         else:
-            idents, msg_list = self.session.feed_identities(msg_or_list)
+            if header is None:
+                idents, msg_list = self.session.feed_identities(msg_or_list)
+                header = self._unpack_header(msg_list)
+            else:
+                msg_list = msg_or_list
+            if header is not None:
+                # checks the signature, without unpacking the content
+                self.session.deserialize(msg_list, content=False)
+                # which Session only records against replays when unpacking the content
+                if self.session.auth is not None:
+                    self.session._add_digest(msg_list[0])
+                return serialize_msg_frames(msg_list, header, channel=channel)
             msg = self.session.deserialize(msg_list)
         if channel:
             msg['channel'] = channel
@@ -233,7 +294,23 @@ class ZMQStreamHandler(WebSocketMixin, WebSocketHandler):
             smsg = json.dumps(msg, default=date_default)
             return cast_unicode(smsg)
 
-    def _on_zmq_reply(self, stream, msg_list):
+    def _unpack_header(self, msg_list):
+        """Unpack only the header of a zmq message, if its frames can be passed through
+
+        msg_list is the message without identities.
+        Returns None if the message has to be fully deserialized instead,
+        because it isn't JSON encoded or uses another protocol version.
+        """
+        session = self.session
+        if session.packer != 'json' or session.unpacker != 'json' or len(msg_list) < 5:
+            return None
+        header = session.unpack(msg_list[1])
+        version = header.get('version', '5.0')
+        if version.split('.')[0] != protocol_version.split('.')[0]:
+            return None
+        return header
+
+    def _on_zmq_reply(self, stream, msg_list, header=None):
         # Sometimes this gets triggered when the on_close method is scheduled in the
         # eventloop but hasn't been called.
         if self.ws_connection is None or stream.closed():
@@ -242,7 +319,7 @@ class ZMQStreamHandler(WebSocketMixin, WebSocketHandler):
             return
         channel = getattr(stream, 'channel', None)
         try:
-            msg = self._reserialize_reply(msg_list, channel=channel)
+            msg = self._reserialize_reply(msg_list, channel=channel, header=header)
         except Exception:
             self.log.critical("Malformed message: %r" % msg_list, exc_info=True)
             return
@@ -0,0 +1,142 @@
+"""Culling of idle kernels and terminals at their deadlines.
+
+Rather than checking every kernel or terminal at a fixed interval, IdleCuller
+keeps them in a heap, ordered by the time at which each may have been idle
+long enough to be culled, and runs a single timer for the earliest of them.
+"""
+
+# Copyright (c) Jupyter Development Team.
+# Distributed under the terms of the Modified BSD License.
+
+from datetime import timedelta
+import heapq
+import itertools
+import logging
+
+from tornado.ioloop import IOLoop
+
+from notebook._tz import utcnow
+
+
+class IdleCuller(object):
+    """Calls `cull` with the keys of objects whose idle deadline passed
+
+    Activity doesn't need to be reported: when the deadline of a key comes,
+    `cull_time(key)` is called again, and the key is only culled if the
+    returned time has passed. Otherwise, it is checked again at that time.
+
+    Parameters
+    ----------
+    cull_time : callable
+        Returns the time (a UTC datetime) from which a key may be culled,
+        or None to forget the key, e.g. if its object is gone.
+    cull : coroutine function
+        Culls a list of keys.
+    retry_interval : float
+        The number of seconds after which keys that `cull` failed to
+        remove are checked again.
+    """
+
+    def __init__(self, cull_time, cull, retry_interval, log=None):
+        self.cull_time = cull_time
+        self.cull = cull
+        self.retry_interval = retry_interval
+        self.log = log or logging.getLogger(__name__)
+        self.loop = IOLoop.current()
+        # (deadline, count, key), with stale entries for rescheduled keys
+        self._heap = []
+        # key -> its current deadline
+        self._deadlines = {}
+        self._counter = itertools.count()
+        self._timer = None
+        self._timer_deadline = None
+        self._running = False
+
+    def __len__(self):
+        return len(self._deadlines)
+
+    def __contains__(self, key):
+        return key in self._deadlines
+
+    def add(self, key, deadline):
+        """Check a key at `deadline`, unless it is already checked sooner"""
+        current = self._deadlines.get(key)
+        if current is not None and current <= deadline:
+            return
+        self._deadlines[key] = deadline
+        heapq.heappush(self._heap, (deadline, next(self._counter), key))
+        self._schedule()
+
+    def discard(self, key):
+        """Stop checking a key"""
+        self._deadlines.pop(key, None)
+
+    def stop(self):
+        if self._timer is not None:
+            self.loop.remove_timeout(self._timer)
+        self._timer = self._timer_deadline = None
+        self._heap = []
+        self._deadlines.clear()
+
+    def _is_current(self, entry):
+        return self._deadlines.get(entry[2]) == entry[0]
+
+    def _schedule(self):
+        while self._heap and not self._is_current(self._heap[0]):
+            heapq.heappop(self._heap)
+        if self._running:
+            # rescheduled once the current run is done
+            return
+        if self._timer is not None:
+            if self._heap and self._timer_deadline <= self._heap[0][0]:
+                return
+            self.loop.remove_timeout(self._timer)
+            self._timer = self._timer_deadline = None
+        if not self._heap:
+            return
+        deadline = self._heap[0][0]
+        delay = max((deadline - utcnow()).total_seconds(), 0)
+        self._timer = self.loop.call_later(delay, self._run)
+        self._timer_deadline = deadline
+
+    async def _run(self):
+        self._timer = self._timer_deadline = None
+        self._running = True
+        try:
+            await self._cull_due()
+        finally:
+            self._running = False
+            self._schedule()
+
+    async def _cull_due(self):
+        now = utcnow()
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            entry = heapq.heappop(self._heap)
+            if self._is_current(entry):
+                del self._deadlines[entry[2]]
+                due.append(entry[2])
+
+        retry = now + timedelta(seconds=self.retry_interval)
+        keys = []
+        for key in due:
+            try:
+                deadline = self.cull_time(key)
+            except Exception:
+                self.log.exception("Failed to check the activity of %s", key)
+                deadline = retry
+            if deadline is None:
+                continue
+            if deadline <= utcnow():
+                keys.append(key)
+            else:
+                self.add(key, deadline)
+        if not keys:
+            return
+        try:
+            await self.cull(keys)
+        except Exception:
+            self.log.exception("Failed to cull %s", ', '.join(map(str, keys)))
+        # forgotten then, if they were culled
+        for key in keys:
+            self.add(key, retry)
@@ -3,16 +3,66 @@
 # Copyright (c) Jupyter Development Team.
 # Distributed under the terms of the Modified BSD License.
 
+import codecs
 import mimetypes
-import json
-from base64 import decodebytes
 
-from tornado import  gen, web
+from tornado import web
 
 from notebook.base.handlers import IPythonHandler
 from notebook.utils import maybe_future
 
 
+async def _iterate(chunks):
+    """Iterate over an iterator or async iterator of chunks"""
+    if hasattr(chunks, '__aiter__'):
+        try:
+            async for chunk in chunks:
+                yield chunk
+        finally:
+            await chunks.aclose()
+    else:
+        try:
+            for chunk in chunks:
+                yield chunk
+        finally:
+            if hasattr(chunks, 'close'):
+                chunks.close()
+
+
+def _parse_range(range_header):
+    """Parse a single byte range of a Range header, like tornado does
+
+    Returns (start, end), as slice indices, with a negative start for
+    suffix ranges and None for omitted bounds. Returns None for
+    unsupported ranges, e.g. multiple ranges.
+    """
+    unit, _, value = range_header.partition('=')
+    if unit.strip() != 'bytes':
+        return None
+    start, _, end = value.strip().partition('-')
+    try:
+        start = int(start.strip()) if start.strip() else None
+        end = int(end.strip()) if end.strip() else None
+    except ValueError:
+        return None
+    if end is not None:
+        if start is None:
+            if end != 0:
+                start, end = -end, None
+        else:
+            end += 1
+    return start, end
+
+
+def _looks_like_text(chunk, final):
+    """Whether a chunk of a file can be decoded as UTF-8"""
+    try:
+        codecs.getincrementaldecoder('utf-8')().decode(chunk, final=final)
+    except UnicodeDecodeError:
+        return False
+    return True
+
+
 class FilesHandler(IPythonHandler):
     """serve files via ContentsManager
 
@@ -20,6 +70,9 @@ class FilesHandler(IPythonHandler):
 
     FileContentsManager subclasses use AuthenticatedFilesHandler by default,
     a subclass of StaticFileHandler.
+
+    Files are streamed with ContentsManager.read_file_chunks, flushing each
+    chunk, and single byte ranges can be requested with a Range header.
     """
 
     @property
@@ -33,9 +86,36 @@ class FilesHandler(IPythonHandler):
         self.check_xsrf_cookie()
         return self.get(path, include_body=False)
 
+    def _get_range(self, size):
+        """Return the (start, end) range requested by the Range header
+
+        end is None for the end of the file. Returns None if the range
+        cannot be satisfied.
+        """
+        range_header = self.request.headers.get('Range')
+        if not range_header or size is None:
+            return 0, None
+        request_range = _parse_range(range_header)
+        if request_range is None:
+            # ignore unsupported ranges, e.g. multiple ranges
+            return 0, None
+        start, end = request_range
+        if (start is not None and start >= size) or end == 0:
+            return None
+        if start is None:
+            start = 0
+        elif start < 0:
+            start = max(start + size, 0)
+        if end is not None and end > size:
+            end = size
+        if start == 0 and end in (None, size):
+            return 0, None
+        self.set_status(206)
+        self.set_header('Content-Range', 'bytes %s-%s/%s' % (start, (end or size) - 1, size))
+        return start, end
+
     @web.authenticated
-    @gen.coroutine
-    def get(self, path, include_body=True):
+    async def get(self, path, include_body=True):
         # /files/ requests must originate from the same site
         self.check_xsrf_cookie()
         cm = self.contents_manager
@@ -49,36 +129,49 @@ class FilesHandler(IPythonHandler):
             _, name = path.rsplit('/', 1)
         else:
             name = path
-        
-        model = yield maybe_future(cm.get(path, type='file', content=include_body))
-        
+
+        model = await maybe_future(cm.get(path, type='file', content=False))
+
         if self.get_argument("download", False):
             self.set_attachment_header(name)
-        
+
+        size = model.get('size')
+        if size is not None:
+            self.set_header('Accept-Ranges', 'bytes')
+        if model.get('last_modified') is not None:
+            self.set_header('Last-Modified', model['last_modified'])
+
+        byte_range = self._get_range(size)
+        if byte_range is None:
+            self.set_status(416)
+            self.set_header('Content-Type', 'text/plain')
+            self.set_header('Content-Range', 'bytes */%s' % size)
+            return
+
         # get mimetype from filename
+        sniff = False
         if name.lower().endswith('.ipynb'):
             self.set_header('Content-Type', 'application/x-ipynb+json')
         else:
             cur_mime = mimetypes.guess_type(name)[0]
-            if cur_mime == 'text/plain':
-                self.set_header('Content-Type', 'text/plain; charset=UTF-8')
-            elif cur_mime is not None:
+            if cur_mime is not None and cur_mime != 'text/plain':
                 self.set_header('Content-Type', cur_mime)
             else:
-                if model['format'] == 'base64':
+                self.set_header('Content-Type', 'text/plain; charset=UTF-8')
+                # binary files of unknown type are sent as octet-stream
+                sniff = cur_mime is None
+
+        if not include_body:
+            return
+
+        start, end = byte_range
+        async for chunk in _iterate(cm.read_file_chunks(path, start, end)):
+            if sniff:
+                sniff = False
+                if not _looks_like_text(chunk, final=len(chunk) < cm.stream_chunk_size):
                     self.set_header('Content-Type', 'application/octet-stream')
-                else:
-                    self.set_header('Content-Type', 'text/plain; charset=UTF-8')
-
-        if include_body:
-            if model['format'] == 'base64':
-                b64_bytes = model['content'].encode('ascii')
-                self.write(decodebytes(b64_bytes))
-            elif model['format'] == 'json':
-                self.write(json.dumps(model['content']))
-            else:
-                self.write(model['content'])
-            self.flush()
+            self.write(chunk)
+            await self.flush()
 
 
 default_handlers = []
@@ -2,11 +2,15 @@
 # Distributed under the terms of the Modified BSD License.
 
 import os
+import json
 import logging
 import mimetypes
 import random
+import struct
 
 from ..base.handlers import APIHandler, IPythonHandler
+from ..base.zmqhandlers import deserialize_binary_message
+from ..services.kernels.ratelimit import IOPubRateLimiter
 from ..utils import url_path_join
 
 from tornado import gen, web
@@ -17,6 +21,7 @@ from tornado.httpclient import HTTPRequest
 from tornado.escape import url_escape, json_decode, utf8
 
 from ipython_genutils.py3compat import cast_unicode
+from jupyter_client.jsonutil import date_default
 from jupyter_client.session import Session
 from traitlets.config.configurable import LoggingConfigurable
 
@@ -25,6 +30,39 @@ from .managers import GatewayClient
 # Keepalive ping interval (default: 30 seconds)
 GATEWAY_WS_PING_INTERVAL_SECS = int(os.getenv('GATEWAY_WS_PING_INTERVAL_SECS', 30))
 
+_json_decoder = json.JSONDecoder()
+_header_prefix = '{"header": '
+_channel_key = '"channel": '
+
+
+def _peek_message(message):
+    """Return the channel and header of a websocket message from the gateway
+
+    Only the part of the message holding them is decoded where possible, so that
+    large outputs are not decoded just to be passed on.  Messages are serialized
+    by the gateway with the header first and the channel last.
+    """
+    if isinstance(message, bytes):
+        # the first part is the message without its buffers
+        nbufs = struct.unpack('!i', message[:4])[0]
+        offsets = struct.unpack('!' + 'I' * min(nbufs, 2), message[4:4 * (min(nbufs, 2) + 1)])
+        stop = offsets[1] if nbufs > 1 else None
+        msg = json.loads(message[offsets[0]:stop].decode('utf8'))
+        return msg.get('channel'), msg['header']
+    if message.startswith(_header_prefix):
+        try:
+            header, _ = _json_decoder.raw_decode(message, len(_header_prefix))
+            index = message.rfind(_channel_key)
+            if index >= 0:
+                channel, end = _json_decoder.raw_decode(message, index + len(_channel_key))
+                # a nested "channel" key would be followed by more than one closing brace
+                if message[end:].strip() == '}':
+                    return channel, header
+        except ValueError:
+            pass
+    msg = json_decode(message)
+    return msg.get('channel'), msg['header']
+
 
 class WebSocketChannelsHandler(WebSocketHandler, IPythonHandler):
 
@@ -32,6 +70,7 @@ class WebSocketChannelsHandler(WebSocketHandler, IPythonHandler):
     gateway = None
     kernel_id = None
     ping_callback = None
+    rate_limiter = None
 
     def check_origin(self, origin=None):
         return IPythonHandler.check_origin(self, origin)
@@ -83,12 +122,55 @@ class WebSocketChannelsHandler(WebSocketHandler, IPythonHandler):
         self.ping_callback = PeriodicCallback(self.send_ping, GATEWAY_WS_PING_INTERVAL_SECS * 1000)
         self.ping_callback.start()
 
+        self.rate_limiter = IOPubRateLimiter(
+            kernel_id,
+            msg_rate_limit=self.settings.get('iopub_msg_rate_limit', 0),
+            data_rate_limit=self.settings.get('iopub_data_rate_limit', 0),
+            window=self.settings.get('rate_limit_window', 1.0),
+            on_exceeded=self._write_rate_limit_error,
+            log=self.log,
+        )
         self.gateway.on_open(
             kernel_id=kernel_id,
-            message_callback=self.write_message,
+            message_callback=self._on_gateway_message,
             compression_options=self.get_compression_options()
         )
 
+    def _on_gateway_message(self, message):
+        """Apply the iopub rate limits to a message from the gateway, then send it to the client.
+
+        Messages are only decoded if a rate limit is set, and then only their
+        channel and header, except for status messages.
+        """
+        limiter = self.rate_limiter
+        if limiter.msg_rate_limit > 0 or limiter.data_rate_limit > 0:
+            channel, header = _peek_message(message)
+            if channel == 'iopub':
+                msg_type = header['msg_type']
+                if msg_type == 'status' and \
+                        self._decode(message)['content'].get('execution_state') == 'idle':
+                    limiter.reset()
+                # the limits are in bytes, not characters
+                if not limiter.check(msg_type, len(utf8(message)), message):
+                    return
+        self.write_message(message)
+
+    @staticmethod
+    def _decode(message):
+        if isinstance(message, bytes):
+            return deserialize_binary_message(message)
+        return json_decode(message)
+
+    def _write_rate_limit_error(self, error_message, message):
+        """Tell the client that the output of a gateway message was dropped by the iopub rate limits"""
+        self.log.warning(error_message)
+        err_msg = self.session.msg("stream",
+            content={"text": error_message + '\n', "name": "stderr"},
+            parent=self._decode(message)['parent_header']
+        )
+        err_msg['channel'] = 'iopub'
+        self.write_message(json.dumps(err_msg, default=date_default))
+
     def on_message(self, message):
         """Forward message to gateway web socket handler."""
         self.gateway.on_message(message)
@@ -105,6 +187,8 @@ class WebSocketChannelsHandler(WebSocketHandler, IPythonHandler):
 
     def on_close(self):
         self.log.debug("Closing websocket connection %s", self.request.path)
+        if self.rate_limiter is not None:
+            self.rate_limiter.close()
         self.gateway.on_close()
         super().on_close()
 
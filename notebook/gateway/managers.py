@@ -1,13 +1,22 @@
 # Copyright (c) Jupyter Development Team.
 # Distributed under the terms of the Modified BSD License.
 
+import asyncio
 import os
 import json
 
 from socket import gaierror
 from tornado import web
 from tornado.escape import json_encode, json_decode, url_escape
-from tornado.httpclient import HTTPClient, AsyncHTTPClient, HTTPError
+from tornado.httpclient import HTTPError
+from tornado.ioloop import IOLoop
+from tornado.simple_httpclient import SimpleAsyncHTTPClient
+
+try:
+    from tornado.curl_httpclient import CurlAsyncHTTPClient
+except ImportError:
+    # pycurl is not installed
+    CurlAsyncHTTPClient = None
 
 from ..services.kernels.kernelmanager import AsyncMappingKernelManager
 from ..services.sessions.sessionmanager import SessionManager
@@ -15,7 +24,7 @@ from ..services.sessions.sessionmanager import SessionManager
 from jupyter_client.kernelspec import KernelSpecManager
 from ..utils import url_path_join
 
-from traitlets import Instance, Unicode, Int, Float, Bool, default, validate, TraitError
+from traitlets import Instance, Unicode, Int, Float, Bool, Dict, default, validate, TraitError
 from traitlets.config import SingletonConfigurable
 
 
@@ -204,9 +213,37 @@ class GatewayClient(SingletonConfigurable):
     def validate_cert_default(self):
         return bool(os.environ.get(self.validate_cert_env, str(self.validate_cert_default_value)) not in ['no', 'false'])
 
+    request_timeouts = Dict(config=True,
+        help="""The time allowed for HTTP request completion, by type of request, e.g.
+        {"list": 5, "get": 5}, instead of request_timeout.  The types of requests are 'start',
+        'get', 'list', 'interrupt', 'restart' and 'shutdown' for kernels, and 'kernelspecs'.""")
+
+    max_connections_default_value = 10
+    max_connections_env = 'JUPYTER_GATEWAY_MAX_CONNECTIONS'
+    max_connections = Int(default_value=max_connections_default_value, config=True,
+        help="""The maximum number of concurrent requests to the Gateway server.  Further
+        requests are queued.  (JUPYTER_GATEWAY_MAX_CONNECTIONS env var)""")
+
+    @default('max_connections')
+    def _max_connections_default(self):
+        return int(os.environ.get(self.max_connections_env, self.max_connections_default_value))
+
+    keep_alive_default_value = True
+    keep_alive_env = 'JUPYTER_GATEWAY_KEEP_ALIVE'
+    keep_alive = Bool(default_value=keep_alive_default_value, config=True,
+        help="""Whether connections to the Gateway server are kept open and reused by later
+        requests, saving a TCP (and TLS) handshake per request.  This requires pycurl, installed by
+        the "gateway" extra; without it, every request opens a new connection.  (JUPYTER_GATEWAY_KEEP_ALIVE env var)""")
+
+    @default('keep_alive')
+    def _keep_alive_default(self):
+        return bool(os.environ.get(self.keep_alive_env, str(self.keep_alive_default_value)) not in ['no', 'false'])
+
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         self._static_args = {}  # initialized on first use
+        self._http_client = None
+        self._http_client_loop = None
 
     env_whitelist_default_value = ''
     env_whitelist_env = 'JUPYTER_GATEWAY_ENV_WHITELIST'
@@ -304,14 +341,48 @@ class GatewayClient(SingletonConfigurable):
                 given_value = kwargs.setdefault(arg, {})
                 if isinstance(given_value, dict):
                     given_value.update(static_value)
+            elif arg == 'request_timeout':
+                # see request_timeout_for
+                kwargs.setdefault(arg, static_value)
             else:
                 kwargs[arg] = static_value
         return kwargs
 
+    def check_keep_alive(self):
+        """Warn when keep_alive is on but pycurl, which it needs, is not installed"""
+        if self.keep_alive and CurlAsyncHTTPClient is None:
+            self.log.warning("Connections to the Gateway server are not kept alive, since pycurl is not "
+                             "installed.  Install notebook[gateway] to keep them alive.")
+
+    def request_timeout_for(self, request_type):
+        """The request timeout of a type of request, see request_timeouts"""
+        if len(self._static_args) == 0:
+            self.init_static_args()
+        return float(self.request_timeouts.get(request_type, self.request_timeout))
+
+    @property
+    def http_client(self):
+        """The HTTP client of requests to the Gateway server, for the current event loop
+
+        Its connections are pooled and kept alive when pycurl is installed,
+        and it makes up to max_connections requests at a time.
+        """
+        loop = IOLoop.current()
+        if self._http_client is None or self._http_client_loop is not loop:
+            if self.keep_alive and CurlAsyncHTTPClient is not None:
+                client_class = CurlAsyncHTTPClient
+            else:
+                client_class = SimpleAsyncHTTPClient
+            if self._http_client is not None:
+                self._http_client.close()
+            self._http_client = client_class(force_instance=True, max_clients=self.max_connections)
+            self._http_client_loop = loop
+        return self._http_client
+
 
 async def gateway_request(endpoint, **kwargs):
     """Make an async request to kernel gateway endpoint, returns a response """
-    client = AsyncHTTPClient()
+    client = GatewayClient.instance().http_client
     kwargs = GatewayClient.instance().load_connection_args(**kwargs)
     try:
         response = await client.fetch(endpoint, **kwargs)
@@ -408,7 +479,8 @@ class GatewayKernelManager(AsyncMappingKernelManager):
             json_body = json_encode({'name': kernel_name, 'env': kernel_env})
 
             response = await gateway_request(
-                kernel_url, method='POST', headers={'Content-Type': 'application/json'}, body=json_body
+                kernel_url, method='POST', headers={'Content-Type': 'application/json'}, body=json_body,
+                request_timeout=GatewayClient.instance().request_timeout_for('start'),
             )
             kernel = json_decode(response.body)
             kernel_id = kernel['id']
@@ -433,7 +505,9 @@ class GatewayKernelManager(AsyncMappingKernelManager):
         kernel_url = self._get_kernel_endpoint_url(kernel_id)
         self.log.debug("Request kernel at: %s" % kernel_url)
         try:
-            response = await gateway_request(kernel_url, method='GET')
+            response = await gateway_request(
+                kernel_url, method='GET', request_timeout=GatewayClient.instance().request_timeout_for('get'),
+            )
         except web.HTTPError as error:
             if error.status_code == 404:
                 self.log.warn("Kernel not found at: %s" % kernel_url)
@@ -469,12 +543,37 @@ class GatewayKernelManager(AsyncMappingKernelManager):
         """Get a list of kernels."""
         kernel_url = self._get_kernel_endpoint_url()
         self.log.debug("Request list kernels: %s", kernel_url)
-        response = await gateway_request(kernel_url, method='GET')
+        response = await gateway_request(
+            kernel_url, method='GET', request_timeout=GatewayClient.instance().request_timeout_for('list'),
+        )
         kernels = json_decode(response.body)
         # Only update our models if we already know about the kernels
         self._kernels = {x['id']: x for x in kernels if x['id'] in self._kernels}
         return list(self._kernels.values())
 
+    async def adopt_kernels(self, kernel_ids):
+        """Manage the kernels with these ids, if they are running on the gateway
+
+        For the kernels started by an earlier instance of the server, e.g.
+        the kernels of persisted sessions. Returns the ids of the kernels
+        which were found.
+        """
+        if not kernel_ids:
+            return []
+        kernel_url = self._get_kernel_endpoint_url()
+        response = await gateway_request(
+            kernel_url, method='GET', request_timeout=GatewayClient.instance().request_timeout_for('list'),
+        )
+        kernels = {x['id']: x for x in json_decode(response.body)}
+        adopted = []
+        for kernel_id in kernel_ids:
+            if kernel_id in kernels and kernel_id not in self._kernels:
+                self._kernels[kernel_id] = kernels[kernel_id]
+                adopted.append(kernel_id)
+        if adopted:
+            self.log.info("Adopted the kernels %s", ', '.join(adopted))
+        return adopted
+
     async def shutdown_kernel(self, kernel_id, now=False, restart=False):
         """Shutdown a kernel by its kernel uuid.
 
@@ -489,7 +588,9 @@ class GatewayKernelManager(AsyncMappingKernelManager):
         """
         kernel_url = self._get_kernel_endpoint_url(kernel_id)
         self.log.debug("Request shutdown kernel at: %s", kernel_url)
-        response = await gateway_request(kernel_url, method='DELETE')
+        response = await gateway_request(
+            kernel_url, method='DELETE', request_timeout=GatewayClient.instance().request_timeout_for('shutdown'),
+        )
         self.log.debug("Shutdown kernel response: %d %s", response.code, response.reason)
         self.remove_kernel(kernel_id)
 
@@ -504,7 +605,8 @@ class GatewayKernelManager(AsyncMappingKernelManager):
         kernel_url = self._get_kernel_endpoint_url(kernel_id) + '/restart'
         self.log.debug("Request restart kernel at: %s", kernel_url)
         response = await gateway_request(
-            kernel_url, method='POST', headers={'Content-Type': 'application/json'}, body=json_encode({})
+            kernel_url, method='POST', headers={'Content-Type': 'application/json'}, body=json_encode({}),
+            request_timeout=GatewayClient.instance().request_timeout_for('restart'),
         )
         self.log.debug("Restart kernel response: %d %s", response.code, response.reason)
 
@@ -519,31 +621,41 @@ class GatewayKernelManager(AsyncMappingKernelManager):
         kernel_url = self._get_kernel_endpoint_url(kernel_id) + '/interrupt'
         self.log.debug("Request interrupt kernel at: %s", kernel_url)
         response = await gateway_request(
-            kernel_url, method='POST', headers={'Content-Type': 'application/json'}, body=json_encode({})
+            kernel_url, method='POST', headers={'Content-Type': 'application/json'}, body=json_encode({}),
+            request_timeout=GatewayClient.instance().request_timeout_for('interrupt'),
         )
         self.log.debug("Interrupt kernel response: %d %s", response.code, response.reason)
 
-    def shutdown_all(self, now=False):
-        """Shutdown all kernels."""
-        # Note: We have to make this sync because the NotebookApp does not wait for async.
-        shutdown_kernels = []
-        kwargs = {'method': 'DELETE'}
-        kwargs = GatewayClient.instance().load_connection_args(**kwargs)
-        client = HTTPClient()
-        for kernel_id in self._kernels:
+    async def fill_kernel_pool(self):
+        """Kernels are started by the gateway, there is no pool."""
+        pass
+
+    async def shutdown_all(self, now=False):
+        """Shutdown all kernels, with up to max_connections concurrent requests."""
+        kernel_ids = list(self._kernels)  # avoid changing dict size during iteration
+        gateway_client = GatewayClient.instance()
+        request_timeout = gateway_client.request_timeout_for('shutdown')
+        # Requests beyond max_connections wait in the client's queue, where their time counts
+        # towards request_timeout, so only start as many as the client makes at a time.
+        semaphore = asyncio.Semaphore(gateway_client.max_connections)
+
+        async def shutdown(kernel_id):
             kernel_url = self._get_kernel_endpoint_url(kernel_id)
             self.log.debug("Request delete kernel at: %s", kernel_url)
             try:
-                response = client.fetch(kernel_url, **kwargs)
-            except HTTPError:
-                pass
+                async with semaphore:
+                    response = await gateway_request(kernel_url, method='DELETE', request_timeout=request_timeout)
+            except web.HTTPError as e:
+                if e.status_code == 599:
+                    # The kernel may still be running on the Gateway server, keep tracking it.
+                    self.log.warning("Timeout shutting down kernel %s: %s", kernel_id, e)
+                    return
             else:
                 self.log.debug("Delete kernel response: %d %s", response.code, response.reason)
-            shutdown_kernels.append(kernel_id)  # avoid changing dict size during iteration
-        client.close()
-        for kernel_id in shutdown_kernels:
             self.remove_kernel(kernel_id)
 
+        await asyncio.gather(*[shutdown(kernel_id) for kernel_id in kernel_ids])
+
 
 class GatewayKernelSpecManager(KernelSpecManager):
 
@@ -598,7 +710,9 @@ class GatewayKernelSpecManager(KernelSpecManager):
         """Get a list of kernel specs."""
         kernel_spec_url = self._get_kernelspecs_endpoint_url()
         self.log.debug("Request list kernel specs at: %s", kernel_spec_url)
-        response = await gateway_request(kernel_spec_url, method='GET')
+        response = await gateway_request(
+            kernel_spec_url, method='GET', request_timeout=GatewayClient.instance().request_timeout_for('kernelspecs'),
+        )
         kernel_specs = json_decode(response.body)
         return kernel_specs
 
@@ -613,7 +727,9 @@ class GatewayKernelSpecManager(KernelSpecManager):
         kernel_spec_url = self._get_kernelspecs_endpoint_url(kernel_name=str(kernel_name))
         self.log.debug("Request kernel spec at: %s" % kernel_spec_url)
         try:
-            response = await gateway_request(kernel_spec_url, method='GET')
+            response = await gateway_request(
+                kernel_spec_url, method='GET', request_timeout=GatewayClient.instance().request_timeout_for('kernelspecs'),
+            )
         except web.HTTPError as error:
             if error.status_code == 404:
                 # Convert not found to KeyError since that's what the Notebook handler expects
@@ -642,7 +758,9 @@ class GatewayKernelSpecManager(KernelSpecManager):
         kernel_spec_resource_url = url_path_join(self.base_resource_endpoint, str(kernel_name), str(path))
         self.log.debug("Request kernel spec resource '{}' at: {}".format(path, kernel_spec_resource_url))
         try:
-            response = await gateway_request(kernel_spec_resource_url, method='GET')
+            response = await gateway_request(
+                kernel_spec_resource_url, method='GET', request_timeout=GatewayClient.instance().request_timeout_for('kernelspecs'),
+            )
         except web.HTTPError as error:
             if error.status_code == 404:
                 kernel_spec_resource = None
@@ -656,7 +774,43 @@ class GatewayKernelSpecManager(KernelSpecManager):
 class GatewaySessionManager(SessionManager):
     kernel_manager = Instance('notebook.gateway.managers.GatewayKernelManager')
 
+    _adoption = None
+
+    async def _adopt_persisted_kernels(self):
+        """Adopt the running kernels of the sessions kept in the database file
+
+        Done once, before the kernels of sessions are first looked up, since
+        the gateway kernels of a previous instance aren't known otherwise.
+        """
+        if self.database_filepath == ':memory:':
+            return
+        if self._adoption is None:
+            kernel_ids = [
+                row['kernel_id'] for row in
+                self.connection.execute("SELECT DISTINCT kernel_id FROM session")
+                if row['kernel_id'] not in self.kernel_manager
+            ]
+            self._adoption = asyncio.ensure_future(self.kernel_manager.adopt_kernels(kernel_ids))
+        try:
+            await self._adoption
+        except Exception:
+            # tried again on the next lookup
+            self._adoption = None
+            raise
+
     async def kernel_culled(self, kernel_id):
         """Checks if the kernel is still considered alive and returns true if its not found. """
+        await self._adopt_persisted_kernels()
         kernel = await self.kernel_manager.get_kernel(kernel_id)
         return kernel is None
+
+    async def kernel_models(self, kernel_ids):
+        """Returns the models of kernels, by id
+
+        The kernels are listed with a single request to the gateway,
+        rather than one request per kernel.
+        """
+        await self._adopt_persisted_kernels()
+        kernels = await self.kernel_manager.list_kernels()
+        models = {kernel['id']: kernel for kernel in kernels}
+        return {kernel_id: models[kernel_id] for kernel_id in kernel_ids if kernel_id in models}
@@ -270,6 +270,7 @@ class NotebookWebApplication(web.Application):
             iopub_msg_rate_limit=jupyter_app.iopub_msg_rate_limit,
             iopub_data_rate_limit=jupyter_app.iopub_data_rate_limit,
             rate_limit_window=jupyter_app.rate_limit_window,
+            iopub_stream_coalesce_window=jupyter_app.iopub_stream_coalesce_window,
 
             # authentication
             cookie_secret=jupyter_app.cookie_secret,
@@ -1551,13 +1552,21 @@ class NotebookApp(JupyterApp):
         Maximum rate at which messages can be sent on iopub before they are
         limited."""))
 
-    iopub_data_rate_limit = Float(1000000, config=True, help=_("""(bytes/sec)
-        Maximum rate at which stream output can be sent on iopub before they are
-        limited."""))
+    iopub_data_rate_limit = Float(10000000, config=True, help=_("""(bytes/sec)
+        Maximum rate at which output can be sent on iopub before it is limited.
+        The limit covers every output type, not just stream output: rich
+        outputs, such as images and interactive plots, count towards it too.
+        The default was raised from 1000000 to 10000000 accordingly."""))
 
     rate_limit_window = Float(3, config=True, help=_("""(sec) Time window used to
         check the message and data rate limits."""))
 
+    iopub_stream_coalesce_window = Float(0, config=True, help=_("""(sec) Time window
+        during which consecutive iopub stream messages with the same parent and
+        stream name are merged into a single websocket message.
+        Any other message flushes the merged stream output first, so ordering is
+        preserved. A value of 0 (the default) disables coalescing."""))
+
     shutdown_no_activity_timeout = Integer(0, config=True,
         help=("Shut down the server after N seconds with no kernels or "
               "terminals running and no activity. "
@@ -1636,6 +1645,7 @@ class NotebookApp(JupyterApp):
         self.gateway_config = GatewayClient.instance(parent=self)
 
         if self.gateway_config.gateway_enabled:
+            self.gateway_config.check_keep_alive()
             self.kernel_manager_class = 'notebook.gateway.managers.GatewayKernelManager'
             self.session_manager_class = 'notebook.gateway.managers.GatewaySessionManager'
             self.kernel_spec_manager_class = 'notebook.gateway.managers.GatewayKernelSpecManager'
@@ -2154,6 +2164,17 @@ class NotebookApp(JupyterApp):
         self.log.info(terminal_msg % n_terminals)
         run_sync(terminal_manager.terminate_all())
 
+    def cleanup_contents(self):
+        """Write the notebook signatures buffered by the contents manager,
+        and stop its threads, if any."""
+        try:
+            self.contents_manager.flush_signatures()
+        except Exception:
+            self.log.exception("Failed to write notebook signatures")
+        shutdown_executors = getattr(self.contents_manager, 'shutdown_executors', None)
+        if shutdown_executors is not None:
+            shutdown_executors()
+
     def notebook_info(self, kernel_count=True):
         "Return the current working directory and the server url information"
         info = self.contents_manager.info_string() + "\n"
@@ -2346,6 +2367,7 @@ class NotebookApp(JupyterApp):
                     ]))
 
         self.io_loop = ioloop.IOLoop.current()
+        self.io_loop.add_callback(self.kernel_manager.fill_kernel_pool)
         if sys.platform.startswith('win'):
             # add no-op to wake every 5s
             # to handle signals that may be ignored by the inner loop
@@ -2360,6 +2382,7 @@ class NotebookApp(JupyterApp):
             self.remove_browser_open_file()
             self.cleanup_kernels()
             self.cleanup_terminals()
+            self.cleanup_contents()
 
     def stop(self):
         def _stop():
@@ -6,7 +6,7 @@ conventions for metrics & labels.
 """
 
 
-from prometheus_client import Histogram, Gauge
+from prometheus_client import Histogram, Gauge, Counter
 
 
 HTTP_REQUEST_DURATION_SECONDS = Histogram(
@@ -25,3 +25,39 @@ KERNEL_CURRENTLY_RUNNING_TOTAL = Gauge(
     'counter for how many kernels are running labeled by type',
     ['type']
 )
+
+KERNEL_BUFFERED_BYTES = Gauge(
+    'kernel_buffered_bytes',
+    'bytes of kernel messages buffered while no frontend is connected, labeled by kernel',
+    ['kernel_id']
+)
+
+KERNEL_BUFFER_DISCARDED_MESSAGES_TOTAL = Counter(
+    'kernel_buffer_discarded_messages_total',
+    'counter for buffered kernel messages discarded or merged by overflow policies, labeled by policy',
+    ['reason']
+)
+
+KERNEL_IOPUB_MESSAGE_RATE = Gauge(
+    'kernel_iopub_message_rate',
+    'current rate of iopub messages sent to websockets in messages/sec, labeled by kernel',
+    ['kernel_id']
+)
+
+KERNEL_IOPUB_DATA_RATE = Gauge(
+    'kernel_iopub_data_rate',
+    'current rate of iopub data sent to websockets in bytes/sec, labeled by kernel',
+    ['kernel_id']
+)
+
+NOTEBOOK_CACHE_REQUESTS_TOTAL = Counter(
+    'notebook_cache_requests_total',
+    'counter for lookups in the parsed notebook cache, labeled by hit or miss',
+    ['result']
+)
+
+KERNEL_SHUTDOWN_DURATION_SECONDS = Histogram(
+    'kernel_shutdown_duration_seconds',
+    'duration in seconds of the phases of shutting down kernels together, labeled by phase',
+    ['phase']
+)
@@ -5,11 +5,22 @@ Utilities for file-based Contents/Checkpoints managers.
 # Copyright (c) Jupyter Development Team.
 # Distributed under the terms of the Modified BSD License.
 
+from collections import OrderedDict
 from contextlib import contextmanager
 import errno
 import io
 import os
 import shutil
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
 from tornado.web import HTTPError
 
@@ -22,7 +33,7 @@ import nbformat
 from ipython_genutils.py3compat import str_to_unicode
 
 from traitlets.config import Configurable
-from traitlets import Bool
+from traitlets import Bool, Enum, Float
 
 from base64 import encodebytes, decodebytes
 
@@ -40,12 +51,90 @@ def replace_file(src, dst):
             os.remove(dst)
         os.rename(src, dst)
 
+# ioctl(2) cloning a file, from linux/fs.h
+FICLONE = 0x40049409
+
+# errors meaning a fast copy is not possible between two files
+_COPY_FALLBACK_ERRNOS = {
+    errno.EBADF, errno.EINVAL, errno.ENOSYS, errno.ENOTTY, errno.EOPNOTSUPP,
+    errno.EXDEV, errno.ETXTBSY, errno.EPERM,
+}
+if hasattr(errno, 'ENOTSUP'):
+    _COPY_FALLBACK_ERRNOS.add(errno.ENOTSUP)
+
+
+def _clone_file(fsrc, fdst):
+    """Make fdst a copy-on-write clone of fsrc, if the filesystem can"""
+    if fcntl is None or not sys.platform.startswith('linux'):
+        return False
+    try:
+        fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+    except OSError as e:
+        if e.errno in _COPY_FALLBACK_ERRNOS:
+            return False
+        raise
+    return True
+
+
+def _copy_in_kernel(fsrc, fdst):
+    """Copy a file with copy_file_range or sendfile, without reading it
+
+    Returns False if neither is supported for these files, or if they
+    didn't copy the whole file; the destination is then written again.
+    """
+    infd = fsrc.fileno()
+    outfd = fdst.fileno()
+    size = os.fstat(infd).st_size
+    blocksize = max(min(size, 2 ** 30), 2 ** 23)
+    for name in ('copy_file_range', 'sendfile'):
+        copy = getattr(os, name, None)
+        if copy is None:
+            continue
+        offset = 0
+        try:
+            while True:
+                if name == 'copy_file_range':
+                    sent = copy(infd, outfd, blocksize)
+                else:
+                    sent = copy(outfd, infd, offset, blocksize)
+                if sent == 0:
+                    break
+                offset += sent
+        except OSError as e:
+            if offset == 0 and e.errno in _COPY_FALLBACK_ERRNOS:
+                continue
+            raise
+        if offset == 0 and size > 0:
+            # some filesystems (procfs, some FUSE and network ones) report
+            # nothing to copy, rather than an error
+            continue
+        # otherwise the file changed, copy it again in user space
+        return offset == size
+    return False
+
+
+def copyfile(src, dst):
+    """Copy the contents of src to dst, like shutil.copyfile
+
+    Clones the file on filesystems supporting reflinks (btrfs, XFS...),
+    otherwise copies it in the kernel with copy_file_range or sendfile,
+    and falls back to shutil.copyfile.
+    """
+    if os.path.exists(dst) and os.path.samefile(src, dst):
+        raise shutil.SameFileError(
+            "{!r} and {!r} are the same file".format(src, dst))
+    with io.open(src, 'rb') as fsrc, io.open(dst, 'wb') as fdst:
+        if _clone_file(fsrc, fdst) or _copy_in_kernel(fsrc, fdst):
+            return dst
+    return shutil.copyfile(src, dst)
+
+
 def copy2_safe(src, dst, log=None):
     """copy src to dst
 
     like shutil.copy2, but log errors in copystat instead of raising
     """
-    shutil.copyfile(src, dst)
+    copyfile(src, dst)
     try:
         shutil.copystat(src, dst)
     except OSError:
@@ -65,7 +154,7 @@ def path_to_invalid(path):
     return os.path.join(dirname, basename+'.invalid')
 
 @contextmanager
-def atomic_writing(path, text=True, encoding='utf-8', log=None, **kwargs):
+def atomic_writing(path, text=True, encoding='utf-8', log=None, syncer=None, **kwargs):
     """Context manager to write to a file only if the entire write is successful.
 
     This works by copying the previous file contents to a temporary file in the
@@ -85,6 +174,10 @@ def atomic_writing(path, text=True, encoding='utf-8', log=None, **kwargs):
     encoding : str, optional
       The encoding to use for files opened in text mode. Default is UTF-8.
 
+    syncer : FsyncScheduler, optional
+      Syncs the file to disk, with other writes. By default, the file is
+      synced directly.
+
     **kwargs
       Passed to :func:`io.open`.
     """
@@ -116,8 +209,10 @@ def atomic_writing(path, text=True, encoding='utf-8', log=None, **kwargs):
 
     # Flush to disk
     fileobj.flush()
-    os.fsync(fileobj.fileno())
-    fileobj.close()
+    try:
+        (syncer.fsync if syncer else os.fsync)(fileobj.fileno())
+    finally:
+        fileobj.close()
 
     # Written successfully, now remove the backup copy
     if os.path.isfile(tmp_path):
@@ -125,6 +220,232 @@ def atomic_writing(path, text=True, encoding='utf-8', log=None, **kwargs):
 
 
 
+@contextmanager
+def replace_writing(path, text=True, encoding='utf-8', log=None, syncer=None, **kwargs):
+    """Context manager to write a file atomically, by replacing it
+
+    The content is written to a temporary file in the same directory, which
+    replaces the target if the context is successful. Unlike
+    :func:`atomic_writing`, the previous contents are not copied; but the
+    file gets a new inode, which breaks hard links to it.
+
+    Parameters
+    ----------
+    path : str
+      The target file to write to.
+
+    text : bool, optional
+      Whether to open the file in text mode (i.e. to write unicode). Default is
+      True.
+
+    encoding : str, optional
+      The encoding to use for files opened in text mode. Default is UTF-8.
+
+    syncer : FsyncScheduler, optional
+      Syncs the file and its directory to disk, with other writes. By
+      default, they are synced directly.
+
+    **kwargs
+      Passed to :func:`io.open`.
+    """
+    if os.path.islink(path):
+        path = os.path.join(os.path.dirname(path), os.readlink(path))
+
+    dirname, basename = os.path.split(path)
+    try:
+        mode = os.stat(path).st_mode & 0o7777
+    except FileNotFoundError:
+        # new files get the mode of open(), with the umask applied
+        mode = None
+    fd, tmp_path = _create_temp_file(dirname or '.', '.~' + basename + '.', mode)
+    try:
+        if mode is not None and hasattr(os, 'fchmod'):
+            os.fchmod(fd, mode)
+
+        if text:
+            # Make sure that text files have Unix linefeeds by default
+            kwargs.setdefault('newline', '\n')
+            fileobj = io.open(fd, 'w', encoding=encoding, **kwargs)
+        else:
+            fileobj = io.open(fd, 'wb', **kwargs)
+
+        with fileobj:
+            yield fileobj
+            fileobj.flush()
+            (syncer.fsync if syncer else os.fsync)(fileobj.fileno())
+        if mode is not None and not hasattr(os, 'fchmod'):
+            os.chmod(tmp_path, mode)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+    (syncer.fsync_directory if syncer else fsync_directory)(dirname or '.')
+
+
+def _create_temp_file(dirname, prefix, mode):
+    """Create a file with a unique name, like tempfile.mkstemp
+
+    Without a mode, the file is created like by open(), for the current
+    umask to apply without reading it, which would change it for all the
+    threads of the process.
+    """
+    if mode is not None:
+        return tempfile.mkstemp(dir=dirname, prefix=prefix)
+    flags = os.O_RDWR | os.O_CREAT | os.O_EXCL | getattr(os, 'O_NOFOLLOW', 0) | getattr(os, 'O_BINARY', 0)
+    for _ in range(100):
+        tmp_path = os.path.join(dirname, prefix + uuid.uuid4().hex[:12])
+        try:
+            return os.open(tmp_path, flags, 0o666), tmp_path
+        except FileExistsError:
+            continue
+    raise FileExistsError(errno.EEXIST, "No usable temporary file name found")
+
+
+def fsync_directory(dirname):
+    """Make the creation or renaming of files in a directory durable"""
+    if os.name != 'posix':
+        return
+    fd = os.open(dirname, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    except OSError as e:
+        # not supported for directories on some filesystems
+        if e.errno not in {errno.EINVAL, errno.EBADF}:
+            raise
+    finally:
+        os.close(fd)
+
+
+class _FsyncRequest(object):
+    def __init__(self, kind, target):
+        self.kind = kind
+        self.target = target
+        self.error = None
+        self.done = threading.Event()
+
+
+class FsyncScheduler(object):
+    """Syncs the files written by concurrent saves in batches
+
+    Threads writing files call :meth:`fsync` and :meth:`fsync_directory`,
+    which return once the file or directory is durable, like os.fsync. The
+    syncs are done by a background thread, in batches: while a batch is
+    synced, new requests queue up for the next one, and a batch waits up to
+    `max_delay` seconds for the writes still in progress (see
+    :meth:`writing`). Files and directories synced more than once in a batch
+    are only synced once.
+
+    The thread is started when needed, and stops after `idle_timeout`
+    seconds without requests.
+    """
+
+    def __init__(self, max_delay=0.002, max_batch=128, idle_timeout=60):
+        self.max_delay = max_delay
+        self.max_batch = max_batch
+        self.idle_timeout = idle_timeout
+        self.batches = 0
+        self.syncs = 0
+        self._cond = threading.Condition()
+        self._queue = []
+        self._writers = 0
+        self._waiting = 0
+        self._thread = None
+
+    @contextmanager
+    def writing(self):
+        """Mark a write in progress, which batches wait for"""
+        with self._cond:
+            self._writers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writers -= 1
+                self._cond.notify_all()
+
+    def fsync(self, fd):
+        """Sync the file open as fd, with the other files of its batch"""
+        self._sync(_FsyncRequest('file', fd))
+
+    def fsync_directory(self, dirname):
+        """Sync a directory, with the other files of its batch"""
+        self._sync(_FsyncRequest('directory', os.path.abspath(dirname)))
+
+    def _sync(self, request):
+        with self._cond:
+            self._queue.append(request)
+            self._waiting += 1
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name='fsync-scheduler', daemon=True,
+                )
+                self._thread.start()
+            self._cond.notify_all()
+        try:
+            request.done.wait()
+        finally:
+            with self._cond:
+                self._waiting -= 1
+        if request.error is not None:
+            raise request.error
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._queue:
+                    self._cond.wait(self.idle_timeout)
+                    if not self._queue:
+                        self._thread = None
+                        return
+                # wait for the writes in progress, which will sync soon
+                deadline = time.monotonic() + self.max_delay
+                while (len(self._queue) < self.max_batch
+                        and self._writers > self._waiting):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch = self._queue[:self.max_batch]
+                del self._queue[:self.max_batch]
+            self._sync_batch(batch)
+
+    def _sync_batch(self, batch):
+        groups = OrderedDict()
+        for request in batch:
+            key = (request.kind, request.target)
+            if request.kind == 'file':
+                try:
+                    st = os.fstat(request.target)
+                except OSError:
+                    pass
+                else:
+                    # fsync syncs the file, whichever descriptor is used
+                    key = ('file', st.st_dev, st.st_ino)
+            groups.setdefault(key, []).append(request)
+
+        for requests in groups.values():
+            request = requests[0]
+            error = None
+            try:
+                if request.kind == 'file':
+                    os.fsync(request.target)
+                else:
+                    fsync_directory(request.target)
+            except Exception as e:
+                error = e
+            for request in requests:
+                if error is not None:
+                    request.error = (
+                        OSError(*error.args) if isinstance(error, OSError) else error
+                    )
+                request.done.set()
+        self.batches += 1
+        self.syncs += len(groups)
+
+
 @contextmanager
 def _simple_writing(path, text=True, encoding='utf-8', log=None, **kwargs):
     """Context manager to write file without doing atomic writing
@@ -169,6 +490,9 @@ def _simple_writing(path, text=True, encoding='utf-8', log=None, **kwargs):
 
 
 
+_fsync_scheduler_lock = threading.Lock()
+
+
 class FileManagerMixin(Configurable):
     """
     Mixin for ContentsAPI classes that interact with the filesystem.
@@ -193,6 +517,34 @@ class FileManagerMixin(Configurable):
       This procedure, namely 'atomic_writing', causes some bugs on file system without operation order enforcement (like some networked fs).
       If set to False, the new notebook is written directly on the old one which could fail (eg: full filesystem or quota )""")
 
+    atomic_writing_strategy = Enum(('backup', 'replace'), 'backup', config=True, help=
+    """How files are written atomically, when use_atomic_writing is True.
+
+      'backup' copies the old file to a temporary file, which is restored if writing fails.
+      'replace' writes a temporary file which then replaces the old one, so that nothing is
+      copied; but the file gets a new inode, which breaks hard links to it, and loses
+      the owner and extended attributes of the old file.""")
+
+    fsync_batching = Bool(False, config=True, help=
+    """Whether files written atomically are synced to disk in batches, by a background thread.
+
+      Each save still returns once its file is durable, but concurrent saves share their syncs.
+      This only helps when saves run concurrently, and is enabled by default for
+      AsyncFileContentsManager: the saves of FileContentsManager run one at a time on the
+      event loop, so batching would only delay them.""")
+
+    fsync_batch_delay = Float(0.002, config=True, help=
+    """The maximum number of seconds a batch of syncs waits for the saves in progress.""")
+
+    _fsync_scheduler = None
+
+    @property
+    def fsync_scheduler(self):
+        with _fsync_scheduler_lock:
+            if self._fsync_scheduler is None:
+                self._fsync_scheduler = FsyncScheduler(max_delay=self.fsync_batch_delay)
+        return self._fsync_scheduler
+
     @contextmanager
     def open(self, os_path, *args, **kwargs):
         """wrapper around io.open that turns permission errors into 403"""
@@ -207,8 +559,19 @@ class FileManagerMixin(Configurable):
         simply writes the file (whatever an old exists or not)"""
         with self.perm_to_403(os_path):
             if self.use_atomic_writing:
-                with atomic_writing(os_path, *args, log=self.log, **kwargs) as f:
-                    yield f
+                writing = (
+                    replace_writing if self.atomic_writing_strategy == 'replace'
+                    else atomic_writing
+                )
+                if self.fsync_batching:
+                    scheduler = self.fsync_scheduler
+                    with scheduler.writing(), writing(
+                        os_path, *args, log=self.log, syncer=scheduler, **kwargs
+                    ) as f:
+                        yield f
+                else:
+                    with writing(os_path, *args, log=self.log, **kwargs) as f:
+                        yield f
             else:
                 with _simple_writing(os_path, *args, log=self.log, **kwargs) as f:
                     yield f
@@ -319,6 +682,21 @@ class FileManagerMixin(Configurable):
                     ) from e
         return encodebytes(bcontent).decode('ascii'), 'base64'
 
+    def _read_file_chunks(self, os_path, start, end, chunk_size):
+        """Iterate over chunks of the bytes start:end of a file."""
+        with self.open(os_path, 'rb', buffering=0) as f:
+            if start:
+                f.seek(start)
+            remaining = None if end is None else max(end - start, 0)
+            while remaining is None or remaining > 0:
+                size = chunk_size if remaining is None else min(chunk_size, remaining)
+                chunk = f.read(size)
+                if not chunk:
+                    break
+                if remaining is not None:
+                    remaining -= len(chunk)
+                yield chunk
+
     def _save_file(self, os_path, content, format):
         """Save content of a generic file."""
         if format not in {'text', 'base64'}:
@@ -3,6 +3,9 @@
 # Copyright (c) Jupyter Development Team.
 # Distributed under the terms of the Modified BSD License.
 
+import asyncio
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import errno
 import io
@@ -10,6 +13,7 @@ import os
 import shutil
 import stat
 import sys
+import threading
 import warnings
 import mimetypes
 import nbformat
@@ -20,11 +24,17 @@ from tornado import web
 
 from .filecheckpoints import FileCheckpoints
 from .fileio import FileManagerMixin
-from .manager import ContentsManager
+from .listingcache import DirectoryListingCache
+from .notebookcache import NotebookCache, notebook_cache_key
+from .manager import (
+    ContentsManager, apply_notebook_operations, paginate_listing,
+)
 from ...utils import exists
 
 from ipython_genutils.importstring import import_item
-from traitlets import Any, Unicode, Bool, TraitError, observe, default, validate
+from traitlets import (
+    Any, Unicode, Bool, Float, Integer, TraitError, observe, default, validate,
+)
 from ipython_genutils.py3compat import getcwd, string_types
 
 from notebook import _tz as tz
@@ -38,6 +48,7 @@ from notebook.transutils import _
 from os.path import samefile
 
 _script_exporter = None
+_validation_lock = threading.Lock()
 
 
 def _post_save_script(model, os_path, contents_manager, **kwargs):
@@ -155,6 +166,104 @@ class FileContentsManager(FileManagerMixin, ContentsManager):
         platform's trash/recycle bin, where they can be recovered. If False,
         deleting files really deletes them.""")
 
+    listing_cache_size = Integer(0, config=True,
+        help="""The maximum number of directory listings to cache in memory.
+
+        Cached listings are invalidated when the contents manager modifies a
+        directory, and by inotify on Linux. Elsewhere, they are revalidated
+        against the modification time of the directory, and rebuilt after
+        `listing_cache_poll_interval`. 0 disables the cache.""")
+
+    listing_cache_poll_interval = Float(5, config=True,
+        help="""The maximum age in seconds of a cached directory listing which
+        is not watched with inotify.""")
+
+    listing_cache_use_inotify = Bool(True, config=True,
+        help="""Whether to invalidate cached directory listings with inotify,
+        when it is available.""")
+
+    _listing_cache = None
+
+    @observe('listing_cache_size', 'listing_cache_poll_interval',
+             'listing_cache_use_inotify', 'allow_hidden', 'hide_globs')
+    def _reset_listing_cache(self, change):
+        if self._listing_cache is not None:
+            self._listing_cache.close()
+            self._listing_cache = None
+
+    @property
+    def listing_cache(self):
+        """The DirectoryListingCache, or None if listings are not cached"""
+        if self.listing_cache_size <= 0:
+            return None
+        if self._listing_cache is None:
+            self._listing_cache = DirectoryListingCache(
+                max_entries=self.listing_cache_size,
+                poll_interval=self.listing_cache_poll_interval,
+                use_inotify=self.listing_cache_use_inotify,
+                log=self.log,
+            )
+        return self._listing_cache
+
+    def _invalidate_listing(self, os_path, recursive=False):
+        if self._listing_cache is not None:
+            self._listing_cache.invalidate(os_path, recursive=recursive)
+
+    notebook_cache_max_bytes = Integer(0, config=True,
+        help="""The maximum total size in bytes of the notebook files whose
+        parsed, trust-checked and validated contents are cached in memory.
+
+        Cached notebooks are reused as long as the inode, modification time
+        and size of their file are unchanged. Parsed notebooks take a few
+        times the size of their file in memory. 0 disables the cache.""")
+
+    _notebook_cache = None
+
+    validate_unmodified_notebooks = Bool(True, config=True,
+        help="""Whether to validate notebooks every time they are opened.
+
+        If False, the result of the last validation of a notebook is reused
+        as long as the inode, modification time and size of its file are
+        unchanged.""")
+
+    # os_path -> (notebook_cache_key, validation message) of the last
+    # validated notebooks, when validate_unmodified_notebooks is False
+    _validated_files = None
+
+    def _remember_validation(self, os_path, message, key=None):
+        """Record the validation message of the current version of a notebook"""
+        if self.validate_unmodified_notebooks:
+            return
+        if key is None:
+            try:
+                key = notebook_cache_key(os_path)
+            except OSError:
+                return
+        with _validation_lock:
+            if self._validated_files is None:
+                self._validated_files = OrderedDict()
+            self._validated_files[os_path] = (key, message)
+            self._validated_files.move_to_end(os_path)
+            while len(self._validated_files) > 1024:
+                self._validated_files.popitem(last=False)
+
+    @observe('notebook_cache_max_bytes')
+    def _reset_notebook_cache(self, change):
+        self._notebook_cache = None
+
+    @property
+    def notebook_cache(self):
+        """The NotebookCache, or None if notebooks are not cached"""
+        if self.notebook_cache_max_bytes <= 0:
+            return None
+        if self._notebook_cache is None:
+            self._notebook_cache = NotebookCache(self.notebook_cache_max_bytes)
+        return self._notebook_cache
+
+    def _invalidate_notebook(self, os_path):
+        if self._notebook_cache is not None:
+            self._notebook_cache.invalidate(os_path)
+
     @default('files_handler_class')
     def _files_handler_class_default(self):
         return AuthenticatedFileHandler
@@ -243,7 +352,10 @@ class FileContentsManager(FileManagerMixin, ContentsManager):
         """Build the common base of a contents model"""
         os_path = self._get_os_path(path)
         info = os.lstat(os_path)
-        
+        return self._base_model_from_stat(path, os_path, info)
+
+    def _base_model_from_stat(self, path, os_path, info):
+        """Build the common base of a contents model from the result of lstat"""
         try:
             # size of file 
             size = info.st_size
@@ -306,50 +418,156 @@ class FileContentsManager(FileManagerMixin, ContentsManager):
         model['type'] = 'directory'
         model['size'] = None
         if content:
-            model['content'] = contents = []
-            os_dir = self._get_os_path(path)
-            for name in os.listdir(os_dir):
-                try:
-                    os_path = os.path.join(os_dir, name)
-                except UnicodeDecodeError as e:
-                    self.log.warning(
-                        "failed to decode filename '%s': %s", name, e)
-                    continue
+            cache = self.listing_cache
+            if cache is None:
+                model['content'] = self._list_dir(path, os_path)
+            else:
+                model['content'] = cache.get(
+                    os_path, lambda: self._list_dir(path, os_path)
+                )
+            model['format'] = 'json'
 
-                try:
-                    st = os.lstat(os_path)
-                except OSError as e:
-                    # skip over broken symlinks in listing
-                    if e.errno == errno.ENOENT:
-                        self.log.warning("%s doesn't exist", os_path)
-                    else:
-                        self.log.warning("Error stat-ing %s: %s", os_path, e)
-                    continue
+        return model
 
-                if (not stat.S_ISLNK(st.st_mode)
-                        and not stat.S_ISREG(st.st_mode)
-                        and not stat.S_ISDIR(st.st_mode)):
-                    self.log.debug("%s not a regular file", os_path)
-                    continue
+    def _list_dir(self, path, os_dir):
+        """Build the models of the entries of a directory"""
+        contents = []
+        with os.scandir(os_dir) as entries:
+            for entry in entries:
+                child = self._dir_entry_model(path, entry)
+                if child is not None:
+                    contents.append(child)
+        return contents
 
-                try:
-                    if self.should_list(name):
-                        if self.allow_hidden or not is_file_hidden(os_path, stat_res=st):
-                            contents.append(
-                                    self.get(path='%s/%s' % (path, name), content=False)
-                            )
-                except OSError as e:
-                    # ELOOP: recursive symlink
-                    if e.errno != errno.ELOOP:
-                        self.log.warning(
-                            "Unknown error checking if file %r is hidden",
-                            os_path,
-                            exc_info=True,
-                        )
-            model['format'] = 'json'
 
+    def _dir_entry_model(self, path, entry):
+        """Build a model without content for an entry of a directory listing
+
+        Reuses the stat result of the os.DirEntry, so that listing a directory
+        costs one lstat per entry (plus a stat for symlinks) instead of
+        calling get() on every child.
+
+        Returns None if the entry should not be listed.
+        """
+        name = entry.name
+        os_path = entry.path
+        try:
+            st = entry.stat(follow_symlinks=False)
+        except OSError as e:
+            # skip over broken symlinks in listing
+            if e.errno == errno.ENOENT:
+                self.log.warning("%s doesn't exist", os_path)
+            else:
+                self.log.warning("Error stat-ing %s: %s", os_path, e)
+            return None
+
+        if (not stat.S_ISLNK(st.st_mode)
+                and not stat.S_ISREG(st.st_mode)
+                and not stat.S_ISDIR(st.st_mode)):
+            self.log.debug("%s not a regular file", os_path)
+            return None
+
+        if not self.should_list(name):
+            return None
+
+        try:
+            if not self.allow_hidden and is_file_hidden(os_path, stat_res=st):
+                return None
+            if stat.S_ISLNK(st.st_mode):
+                is_dir = entry.is_dir()
+            else:
+                is_dir = stat.S_ISDIR(st.st_mode)
+        except OSError as e:
+            # ELOOP: recursive symlink
+            if e.errno != errno.ELOOP:
+                self.log.warning(
+                    "Unknown error checking if file %r is hidden",
+                    os_path,
+                    exc_info=True,
+                )
+            return None
+
+        model = self._base_model_from_stat(
+            '%s/%s' % (path, name) if path else name, os_path, st,
+        )
+        if is_dir:
+            model['type'] = 'directory'
+            model['size'] = None
+        elif name.endswith('.ipynb'):
+            model['type'] = 'notebook'
+        else:
+            model['type'] = 'file'
+            model['mimetype'] = mimetypes.guess_type(os_path)[0]
         return model
 
+    def get_directory_page(self, path, limit=None, offset=0, cursor=None,
+                           sort='name', reverse=False, filter_type=None):
+        """Get a directory model whose content is one page of its listing
+
+        Only the entries of the requested page get a full model. Sorting by
+        name needs no stat at all, and sorting by last_modified or size reuses
+        the lstat result cached by os.scandir.
+
+        Entries that are excluded by checks needing a stat (broken or recursive
+        symlinks, hidden file flags) are only dropped once the page is built,
+        so a page may be shorter than `limit`. Use the cursor rather than the
+        offset to page through such directories.
+        """
+        model = self.get(path, content=False, type='directory')
+        os_dir = self._get_os_path(path)
+        entries = []
+        with os.scandir(os_dir) as scan:
+            for entry in scan:
+                name = entry.name
+                if not self.should_list(name):
+                    continue
+                if not self.allow_hidden and name.startswith('.'):
+                    continue
+                if filter_type is not None:
+                    try:
+                        is_dir = entry.is_dir()
+                    except OSError:
+                        continue
+                    if is_dir:
+                        entry_type = 'directory'
+                    elif name.endswith('.ipynb'):
+                        entry_type = 'notebook'
+                    else:
+                        entry_type = 'file'
+                    if entry_type != filter_type:
+                        continue
+                if sort == 'name':
+                    key = (name,)
+                else:
+                    try:
+                        st = entry.stat(follow_symlinks=False)
+                    except OSError:
+                        continue
+                    if sort == 'last_modified':
+                        # at the precision of the last_modified of the models
+                        try:
+                            mtime = tz.utcfromtimestamp(st.st_mtime).timestamp()
+                        except (ValueError, OSError):
+                            mtime = 0
+                        key = (mtime, name)
+                    elif entry.is_dir():
+                        key = (-1, name)
+                    else:
+                        key = (st.st_size, name)
+                entries.append((key, entry))
+
+            page, next_cursor = paginate_listing(
+                entries, limit=limit, offset=offset, cursor=cursor, sort=sort,
+                reverse=reverse,
+            )
+            model['content'] = contents = []
+            for entry in page:
+                child = self._dir_entry_model(path, entry)
+                if child is not None:
+                    contents.append(child)
+        model['format'] = 'json'
+        model['next_cursor'] = next_cursor
+        return model
 
     def _file_model(self, path, content=True, format=None):
         """Build a model for a file
@@ -394,14 +612,59 @@ class FileContentsManager(FileManagerMixin, ContentsManager):
         os_path = self._get_os_path(path)
         
         if content:
-            nb = self._read_notebook(os_path, as_version=4)
-            self.mark_trusted_cells(nb, path)
-            model['content'] = nb
+            cache = self.notebook_cache
+            cached = key = None
+            if cache is not None:
+                try:
+                    key = notebook_cache_key(os_path)
+                except OSError:
+                    cache = None
+                else:
+                    cached = cache.get(os_path, key)
             model['format'] = 'json'
-            self.validate_notebook_model(model)
-            
+            if cached is not None:
+                nb, message, signature = cached
+                model['content'] = nb
+                if message:
+                    model['message'] = message
+                self._mark_trusted_cells_by_signature(nb, path, signature)
+            else:
+                if key is None and not self.validate_unmodified_notebooks:
+                    try:
+                        key = notebook_cache_key(os_path)
+                    except OSError:
+                        pass
+                nb = self._read_notebook(os_path, as_version=4)
+                model['content'] = nb
+                validated = (self._validated_files or {}).get(os_path)
+                if (not self.validate_unmodified_notebooks
+                        and validated is not None and validated[0] == key):
+                    if validated[1]:
+                        model['message'] = validated[1]
+                else:
+                    # before marking trust, which saving removes, so that the
+                    # cells are the same as when saving them
+                    self.validate_notebook_model(model)
+                    self._remember_validation(os_path, model.get('message'), key)
+                if cache is not None:
+                    signature = self.notary.compute_signature(nb)
+                    cache.put(os_path, key, nb, model.get('message'), signature)
+                    self._mark_trusted_cells_by_signature(nb, path, signature)
+                else:
+                    self.mark_trusted_cells(nb, path)
+
         return model
 
+    def _mark_trusted_cells_by_signature(self, nb, path, signature):
+        """Like mark_trusted_cells, for the known signature of a notebook
+
+        Checking a signature in the store is much cheaper than computing it.
+        """
+        trusted = self.notary.store.check_signature(signature, self.notary.algorithm)
+        if not trusted:
+            self.log.warning("Notebook %s is not trusted", path)
+        self.notary.mark_cells(nb, trusted)
+
     def get(self, path, content=True, type=None, format=None):
         """ Takes a path for an entity and returns its model
 
@@ -430,7 +693,14 @@ class FileContentsManager(FileManagerMixin, ContentsManager):
             raise web.HTTPError(404, u'No such file or directory: %s' % path)
 
         os_path = self._get_os_path(path)
-        if os.path.isdir(os_path):
+        try:
+            is_dir = stat.S_ISDIR(os.stat(os_path).st_mode)
+        except OSError:
+            # a broken symlink: listed, but without content
+            if content:
+                raise web.HTTPError(404, u'Broken symlink: %s' % path)
+            is_dir = False
+        if is_dir:
             if type not in (None, 'directory'):
                 raise web.HTTPError(400,
                                 u'%s is a directory, not a %s' % (path, type), reason='bad type')
@@ -444,6 +714,17 @@ class FileContentsManager(FileManagerMixin, ContentsManager):
             model = self._file_model(path, content=content, format=format)
         return model
 
+    def read_file_chunks(self, path, start=0, end=None):
+        """Iterate over the bytes of a file, in chunks
+
+        Only one chunk of the file is held in memory at a time.
+        """
+        path = path.strip('/')
+        os_path = self._get_os_path(path)
+        if not os.path.isfile(os_path):
+            raise web.HTTPError(404, u'No such file: %s' % path)
+        return self._read_file_chunks(os_path, start, end, self.stream_chunk_size)
+
     def _save_directory(self, os_path, model, path=''):
         """create a directory"""
         if is_hidden(os_path, self.root_dir) and not self.allow_hidden:
@@ -458,6 +739,22 @@ class FileContentsManager(FileManagerMixin, ContentsManager):
 
     def save(self, model, path=''):
         """Save the file model and return the model with no content."""
+        return self._save(model, path)
+
+    def patch_notebook(self, path, operations, last_modified=None):
+        """Apply cell-level changes to a notebook and save it
+
+        The notebook is taken from the notebook cache when it is enabled, and
+        cached again once saved.
+        """
+        path = path.strip('/')
+        model = self.get(path, content=True, type='notebook')
+        self._check_last_modified(model, last_modified)
+        apply_notebook_operations(model['content'], operations)
+        return self._save({'type': 'notebook', 'content': model['content']}, path, cache=True)
+
+    def _save(self, model, path='', cache=False):
+        """Save a model, and put a saved notebook in the notebook cache if `cache`"""
         path = path.strip('/')
 
         if 'type' not in model:
@@ -470,10 +767,11 @@ class FileContentsManager(FileManagerMixin, ContentsManager):
 
         self.run_pre_save_hook(model=model, path=path)
 
+        signed = None
         try:
             if model['type'] == 'notebook':
                 nb = nbformat.from_dict(model['content'])
-                self.check_and_sign(nb, path)
+                signed = self.check_and_sign(nb, path)
                 self._save_notebook(os_path, nb)
                 # One checkpoint should always exist for notebooks.
                 if not self.checkpoints.list_checkpoints(path):
@@ -491,11 +789,29 @@ class FileContentsManager(FileManagerMixin, ContentsManager):
             self.log.error(u'Error while saving file: %s %s', path, e, exc_info=True)
             raise web.HTTPError(500, u'Unexpected error while saving file: %s %s' %
                                 (path, e)) from e
+        finally:
+            self._invalidate_listing(os_path)
+            self._invalidate_notebook(os_path)
 
         validation_message = None
         if model['type'] == 'notebook':
-            self.validate_notebook_model(model)
-            validation_message = model.get('message', None)
+            # signed, without the trust marks of the cells
+            validation_message = self.validate_notebook_model(
+                {'content': nb, 'path': path},
+            ).get('message', None)
+            self._remember_validation(os_path, validation_message)
+
+            notebook_cache = self.notebook_cache
+            if cache and notebook_cache is not None and signed is not None:
+                # what reading the file back would give
+                nbformat.v4.rwbase.strip_transient(nb)
+                try:
+                    notebook_cache.put(
+                        os_path, notebook_cache_key(os_path), nb, validation_message,
+                        self.notary.compute_signature(nb),
+                    )
+                except OSError:
+                    pass
 
         model = self.get(path, content=False)
         if validation_message:
@@ -531,6 +847,8 @@ class FileContentsManager(FileManagerMixin, ContentsManager):
             try:
                 self.log.debug("Sending %s to trash", os_path)
                 send2trash(os_path)
+                self._invalidate_listing(os_path, recursive=True)
+                self._invalidate_notebook(os_path)
                 return
             except TrashPermissionError as e:
                 self.log.warning("Skipping trash for %s, %s", os_path, e)
@@ -546,6 +864,8 @@ class FileContentsManager(FileManagerMixin, ContentsManager):
             self.log.debug("Unlinking file %s", os_path)
             with self.perm_to_403():
                 rm(os_path)
+        self._invalidate_listing(os_path, recursive=True)
+        self._invalidate_notebook(os_path)
 
     def rename_file(self, old_path, new_path):
         """Rename a file."""
@@ -574,6 +894,15 @@ class FileContentsManager(FileManagerMixin, ContentsManager):
         except Exception as e:
             raise web.HTTPError(500, u'Unknown error renaming file: %s %s' %
                                 (old_path, e)) from e
+        finally:
+            self._invalidate_listing(old_os_path, recursive=True)
+            self._invalidate_listing(new_os_path)
+            self._invalidate_notebook(old_os_path)
+
+    def trust_notebook(self, path):
+        super().trust_notebook(path)
+        # the signature changed, not the file
+        self._invalidate_notebook(self._get_os_path(path.strip('/')))
 
     def info_string(self):
         return _("Serving notebooks from local directory: %s") % self.root_dir
@@ -607,3 +936,194 @@ class FileContentsManager(FileManagerMixin, ContentsManager):
                 raise web.HTTPError(400, "Path '{}' contains characters that are invalid for the filesystem. "
                                          "Path names on this filesystem cannot contain any of the following "
                                          "characters: {}".format(path, invalid_chars))
+
+
+# flags set on the threads of the pools of AsyncFileContentsManager
+_pool_thread = threading.local()
+_pool_lock = threading.Lock()
+
+
+def _run_in_pool_thread(notary, func, args, kwargs):
+    # set on each call, as ThreadPoolExecutor has no initializer on Python 3.6
+    if not getattr(_pool_thread, 'active', False):
+        _pool_thread.active = True
+        _pool_thread.notary = notary
+    return func(*args, **kwargs)
+
+
+class AsyncFileContentsManager(FileContentsManager):
+    """A FileContentsManager doing its file operations on a thread pool
+
+    The methods used by the contents API return awaitables, so that slow
+    filesystems don't block the event loop. Called from a thread of the pool,
+    e.g. when `new` saves the new file, they run synchronously.
+
+    The notary is only used from one dedicated thread, because the sqlite
+    connection of the default signature store can only be used from the
+    thread which created it.
+    """
+
+    max_workers = Integer(4, config=True,
+        help="""The number of threads doing file operations.""")
+
+    @validate('max_workers')
+    def _validate_max_workers(self, proposal):
+        if proposal['value'] < 1:
+            raise TraitError("max_workers must be at least 1")
+        return proposal['value']
+
+    @default('fsync_batching')
+    def _fsync_batching_default(self):
+        # saves run concurrently on the pool, and can share their syncs
+        return True
+
+    _executor = None
+    _notary_executor = None
+
+    @observe('max_workers')
+    def _reset_executor(self, change):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    @property
+    def executor(self):
+        with _pool_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers,
+                    thread_name_prefix='contents',
+                )
+        return self._executor
+
+    @property
+    def notary_executor(self):
+        with _pool_lock:
+            if self._notary_executor is None:
+                self._notary_executor = ThreadPoolExecutor(
+                    max_workers=1,
+                    thread_name_prefix='contents-notary',
+                )
+        return self._notary_executor
+
+    def shutdown_executors(self, wait=True):
+        """Stop the threads of the pools, e.g. when the server stops"""
+        with _pool_lock:
+            executors = [self._executor, self._notary_executor]
+            self._executor = self._notary_executor = None
+        for executor in executors:
+            if executor is not None:
+                executor.shutdown(wait=wait)
+
+    def _submit(self, executor, func, args, kwargs):
+        notary = executor is self._notary_executor
+        future = executor.submit(_run_in_pool_thread, notary, func, args, kwargs)
+        if getattr(_pool_thread, 'active', False):
+            # on the other pool: wait for it
+            return future.result()
+        return asyncio.wrap_future(future)
+
+    def run_in_pool(self, func, *args, **kwargs):
+        """Run func on the thread pool, returning an asyncio Future
+
+        Runs it synchronously if already on the pool.
+        """
+        if getattr(_pool_thread, 'active', False):
+            return func(*args, **kwargs)
+        return self._submit(self.executor, func, args, kwargs)
+
+    def run_in_notary_thread(self, func, *args, **kwargs):
+        """Run func on the thread using the notary
+
+        Returns an asyncio Future when called from the event loop, and
+        the result when called from the thread pool.
+        """
+        if getattr(_pool_thread, 'notary', False):
+            return func(*args, **kwargs)
+        return self._submit(self.notary_executor, func, args, kwargs)
+
+    def mark_trusted_cells(self, nb, path=''):
+        return self.run_in_notary_thread(super().mark_trusted_cells, nb, path)
+
+    def _mark_trusted_cells_by_signature(self, nb, path, signature):
+        return self.run_in_notary_thread(
+            super()._mark_trusted_cells_by_signature, nb, path, signature,
+        )
+
+    def check_and_sign(self, nb, path=''):
+        return self.run_in_notary_thread(super().check_and_sign, nb, path)
+
+    def flush_signatures(self):
+        # blocking, as it is called when the server stops
+        if self._notary_executor is None:
+            return super().flush_signatures()
+        return self.notary_executor.submit(
+            _run_in_pool_thread, True, super().flush_signatures, (), {},
+        ).result()
+
+    def get(self, path, content=True, type=None, format=None):
+        return self.run_in_pool(
+            super().get, path, content=content, type=type, format=format,
+        )
+
+    def get_directory_page(self, path, **kwargs):
+        return self.run_in_pool(super().get_directory_page, path, **kwargs)
+
+    def read_file_chunks(self, path, start=0, end=None):
+        """Asynchronously iterate over the bytes of a file, in chunks
+
+        Each chunk is read on the thread pool.
+        """
+        if getattr(_pool_thread, 'active', False):
+            return super().read_file_chunks(path, start, end)
+        return self._iterate_in_pool(super().read_file_chunks, path, start, end)
+
+    async def _iterate_in_pool(self, func, *args):
+        chunks = await self.run_in_pool(func, *args)
+        try:
+            while True:
+                chunk = await self.run_in_pool(next, chunks, None)
+                if chunk is None:
+                    break
+                yield chunk
+        finally:
+            chunks.close()
+
+    def save(self, model, path=''):
+        return self.run_in_pool(super().save, model, path)
+
+    def delete(self, path):
+        return self.run_in_pool(super().delete, path)
+
+    def rename(self, old_path, new_path):
+        return self.run_in_pool(super().rename, old_path, new_path)
+
+    def update(self, model, path):
+        return self.run_in_pool(super().update, model, path)
+
+    def patch_notebook(self, path, operations, last_modified=None):
+        return self.run_in_pool(super().patch_notebook, path, operations, last_modified)
+
+    def new_untitled(self, path='', type='', ext=''):
+        return self.run_in_pool(super().new_untitled, path=path, type=type, ext=ext)
+
+    def new(self, model=None, path=''):
+        return self.run_in_pool(super().new, model=model, path=path)
+
+    def copy(self, from_path, to_path=None):
+        return self.run_in_pool(super().copy, from_path, to_path)
+
+    def trust_notebook(self, path):
+        return self.run_in_notary_thread(super().trust_notebook, path)
+
+    def create_checkpoint(self, path):
+        return self.run_in_pool(super().create_checkpoint, path)
+
+    def list_checkpoints(self, path):
+        return self.run_in_pool(super().list_checkpoints, path)
+
+    def restore_checkpoint(self, checkpoint_id, path):
+        return self.run_in_pool(super().restore_checkpoint, checkpoint_id, path)
+
+    def delete_checkpoint(self, checkpoint_id, path):
+        return self.run_in_pool(super().delete_checkpoint, checkpoint_id, path)
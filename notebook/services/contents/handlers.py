@@ -16,6 +16,7 @@ from jupyter_client.jsonutil import date_default
 from notebook.base.handlers import (
     IPythonHandler, APIHandler, path_regex,
 )
+from .manager import LISTING_SORT_KEYS
 
 
 def validate_model(model, expect_content):
@@ -87,6 +88,45 @@ class ContentsHandler(APIHandler):
         self.set_header('Content-Type', 'application/json')
         self.finish(json.dumps(model, default=date_default))
 
+    def _get_page_arguments(self):
+        """Parse the arguments paginating a directory listing
+
+        Returns an empty dict if the listing is not paginated.
+        """
+        args = {}
+        limit = self.get_query_argument('limit', default=None)
+        if limit is not None:
+            try:
+                args['limit'] = int(limit)
+            except ValueError:
+                args['limit'] = 0
+            if args['limit'] < 1:
+                raise web.HTTPError(400, u'Limit %r is invalid' % limit)
+        offset = self.get_query_argument('offset', default=None)
+        if offset is not None:
+            try:
+                args['offset'] = int(offset)
+            except ValueError:
+                args['offset'] = -1
+            if args['offset'] < 0:
+                raise web.HTTPError(400, u'Offset %r is invalid' % offset)
+        cursor = self.get_query_argument('cursor', default=None)
+        if cursor is not None:
+            args['cursor'] = cursor
+        sort = self.get_query_argument('sort', default=None)
+        if sort is not None:
+            key = sort[1:] if sort.startswith('-') else sort
+            if key not in LISTING_SORT_KEYS:
+                raise web.HTTPError(400, u'Sort %r is invalid' % sort)
+            args['sort'] = key
+            args['reverse'] = sort.startswith('-')
+        filter_type = self.get_query_argument('filter_type', default=None)
+        if filter_type is not None:
+            if filter_type not in {'directory', 'file', 'notebook'}:
+                raise web.HTTPError(400, u'Filter type %r is invalid' % filter_type)
+            args['filter_type'] = filter_type
+        return args
+
     @web.authenticated
     @gen.coroutine
     def get(self, path=''):
@@ -94,6 +134,12 @@ class ContentsHandler(APIHandler):
 
         A directory model contains a list of models (without content)
         of the files and directories it contains.
+
+        Directory listings can be paginated with the ``limit``, ``offset``
+        and ``cursor`` query arguments, sorted with ``sort`` (``name``,
+        ``last_modified`` or ``size``, prefixed with ``-`` for descending
+        order) and filtered with ``filter_type``. Paginated models include
+        a ``next_cursor`` to request the following page.
         """
         path = path or ''
         type = self.get_query_argument('type', default=None)
@@ -107,22 +153,37 @@ class ContentsHandler(APIHandler):
         if content not in {'0', '1'}:
             raise web.HTTPError(400, u'Content %r is invalid' % content)
         content = int(content)
-        
-        model = yield maybe_future(self.contents_manager.get(
-            path=path, type=type, format=format, content=content,
-        ))
+
+        page_args = self._get_page_arguments()
+        if page_args and content:
+            model = yield maybe_future(self.contents_manager.get_directory_page(
+                path, **page_args
+            ))
+        else:
+            model = yield maybe_future(self.contents_manager.get(
+                path=path, type=type, format=format, content=content,
+            ))
         validate_model(model, expect_content=content)
         self._finish_model(model, location=False)
 
     @web.authenticated
     @gen.coroutine
     def patch(self, path=''):
-        """PATCH renames a file or directory without re-uploading content."""
+        """PATCH renames a file or directory without re-uploading content.
+
+        With a list of ``operations``, it applies cell-level changes to a
+        notebook instead, see ContentsManager.patch_notebook.
+        """
         cm = self.contents_manager
         model = self.get_json_body()
         if model is None:
             raise web.HTTPError(400, u'JSON body missing')
-        model = yield maybe_future(cm.update(model, path))
+        if 'operations' in model:
+            model = yield maybe_future(cm.patch_notebook(
+                path, model['operations'], last_modified=model.get('last_modified'),
+            ))
+        else:
+            model = yield maybe_future(cm.update(model, path))
         validate_model(model, expect_content=False)
         self._finish_model(model)
     
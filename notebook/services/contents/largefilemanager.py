@@ -1,19 +1,103 @@
-from notebook.services.contents.filemanager import FileContentsManager
+from notebook.services.contents.filemanager import (
+    AsyncFileContentsManager, FileContentsManager,
+)
 from contextlib import contextmanager
 from tornado import web
+from traitlets import Float
 import nbformat
 import base64
+import hashlib
 import os, io
+import re
+import threading
+import time
+
+# upload ids are used in the name of the temporary file
+_upload_id_re = re.compile(r'^[\w-]{1,64}$')
+
+
+class UploadSession(object):
+    """The state of a resumable upload into a temporary file.
+
+    Tracks the byte ranges received so far, as a sorted list of
+    non-overlapping [start, end) pairs.
+    """
+
+    def __init__(self, upload_id, path, os_path, tmp_path, fd, size):
+        self.upload_id = upload_id
+        self.path = path
+        self.os_path = os_path
+        self.tmp_path = tmp_path
+        self.fd = fd
+        self.size = size
+        self.received = []
+        self.committed = False
+        # abandoned, its file is closed and removed
+        self.expired = False
+        self.writers = 0
+        self.lock = threading.Lock()
+        self.last_active = time.monotonic()
+
+    def add_range(self, start, end):
+        if start >= end:
+            return
+        merged = []
+        for s, e in self.received:
+            if e < start or s > end:
+                merged.append([s, e])
+            else:
+                start, end = min(s, start), max(e, end)
+        merged.append([start, end])
+        merged.sort()
+        self.received = merged
+
+    def missing(self):
+        """The [start, end) ranges which have not been received yet"""
+        missing = []
+        position = 0
+        for start, end in self.received:
+            if start > position:
+                missing.append([position, start])
+            position = end
+        if position < self.size:
+            missing.append([position, self.size])
+        return missing
+
+    @property
+    def complete(self):
+        return self.received == [[0, self.size]] or self.size == 0
+
+    def status(self):
+        return {
+            'id': self.upload_id,
+            'size': self.size,
+            'received': sum(end - start for start, end in self.received),
+            'missing': self.missing(),
+            'complete': self.committed,
+        }
+
 
 class LargeFileManager(FileContentsManager):
     """Handle large file upload."""
 
+    upload_timeout = Float(3600, config=True,
+        help="""The number of seconds after which an interrupted resumable
+        upload is abandoned and its temporary file removed.""")
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._uploads = {}
+        self._uploads_lock = threading.Lock()
+
     def save(self, model, path=''):
         """Save the file model and return the model with no content."""
+        if model.get('upload_id') is not None:
+            return self._save_upload_chunk(model, path)
+
         chunk = model.get('chunk', None)
         if chunk is not None:
             path = path.strip('/')
-            
+
             if 'type' not in model:
                 raise web.HTTPError(400, u'No file type provided')
             if model['type'] != 'file':
@@ -45,8 +129,8 @@ class LargeFileManager(FileContentsManager):
         else:
             return super().save(model, path)
 
-    def _save_large_file(self, os_path, content, format):
-        """Save content of a generic file."""
+    def _decode_chunk(self, os_path, content, format):
+        """Return the bytes of the content of a chunk"""
         if format not in {'text', 'base64'}:
             raise web.HTTPError(
                 400,
@@ -54,17 +138,202 @@ class LargeFileManager(FileContentsManager):
             )
         try:
             if format == 'text':
-                bcontent = content.encode('utf8')
+                return content.encode('utf8')
             else:
                 b64_bytes = content.encode('ascii')
-                bcontent = base64.b64decode(b64_bytes)
+                return base64.b64decode(b64_bytes)
         except Exception as e:
             raise web.HTTPError(
                 400, u'Encoding error saving %s: %s' % (os_path, e)
             ) from e
 
+    def _save_large_file(self, os_path, content, format):
+        """Save content of a generic file."""
+        bcontent = self._decode_chunk(os_path, content, format)
+
         with self.perm_to_403(os_path):
             if os.path.islink(os_path):
                 os_path = os.path.join(os.path.dirname(os_path), os.readlink(os_path))
             with io.open(os_path, 'ab') as f:
                 f.write(bcontent)
+
+    # Resumable uploads
+
+    def _save_upload_chunk(self, model, path):
+        """Write a chunk of a resumable upload
+
+        The model has the following fields, in addition to ``content`` and
+        ``format``:
+
+        upload_id : str
+            Identifies the upload, chosen by the client.
+        upload_size : int
+            The size in bytes of the complete file.
+        offset : int
+            The position of the chunk in the file.
+        checksum : str, optional
+            ``<algorithm>:<hex digest>`` of the bytes of the chunk,
+            e.g. ``sha256:...``.
+
+        Chunks can be sent in any order, concurrently, and sent again.
+        Once all the bytes of the file have been received, the temporary
+        file it was written to replaces the file at path. Chunks received
+        for an upload id after that are ignored, until the upload expires.
+
+        Returns the model of the file, with an ``upload`` field giving the
+        status of the upload, including the ranges still ``missing``.
+        Send an empty chunk to get the status of an interrupted upload.
+        """
+        path = path.strip('/')
+        upload_id = model['upload_id']
+        if not isinstance(upload_id, str) or not _upload_id_re.match(upload_id):
+            raise web.HTTPError(400, u'Invalid upload id: %r' % upload_id)
+        if model.get('type', 'file') != 'file':
+            raise web.HTTPError(400, u'File type "{}" is not supported for large file transfer'.format(model['type']))
+        size = model.get('upload_size')
+        offset = model.get('offset', 0)
+        for name, value in (('upload_size', size), ('offset', offset)):
+            if not isinstance(value, int) or isinstance(value, bool) or value < 0:
+                raise web.HTTPError(400, u'Invalid %s: %r' % (name, value))
+
+        os_path = self._get_os_path(path)
+        data = self._decode_chunk(os_path, model.get('content', ''), model.get('format'))
+        if offset + len(data) > size:
+            raise web.HTTPError(400, u'Chunk at offset %i exceeds the upload size' % offset)
+        checksum = model.get('checksum')
+        if checksum:
+            algorithm, _, digest = checksum.partition(':')
+            if algorithm not in hashlib.algorithms_guaranteed:
+                raise web.HTTPError(400, u'Unsupported checksum algorithm: %r' % algorithm)
+            if hashlib.new(algorithm, data).hexdigest() != digest.lower():
+                raise web.HTTPError(400, u'Checksum mismatch for chunk at offset %i' % offset)
+
+        session = self._get_upload(upload_id, path, os_path, size, model)
+        with session.lock:
+            if session.committed:
+                return self._upload_model(session)
+            if session.expired:
+                raise web.HTTPError(410, u'Upload %s expired' % upload_id)
+            # the last chunk written commits the upload
+            session.writers += 1
+        written = False
+        try:
+            if data:
+                with self.perm_to_403(session.tmp_path):
+                    if hasattr(os, 'pwrite'):
+                        os.pwrite(session.fd, data, offset)
+                    else:
+                        with session.lock:
+                            os.lseek(session.fd, offset, os.SEEK_SET)
+                            os.write(session.fd, data)
+            written = True
+        finally:
+            with session.lock:
+                session.writers -= 1
+                if written:
+                    session.add_range(offset, offset + len(data))
+                    session.last_active = time.monotonic()
+                if session.complete and not session.committed and not session.writers:
+                    self._commit_upload(session)
+        with session.lock:
+            return self._upload_model(session)
+
+    def _get_upload(self, upload_id, path, os_path, size, model):
+        """Get the session of an upload, starting it if needed"""
+        self._expire_uploads()
+        with self._uploads_lock:
+            session = self._uploads.get(upload_id)
+            if session is not None:
+                if session.path != path or session.size != size:
+                    raise web.HTTPError(409, u'Upload %s is for another file' % upload_id)
+                return session
+
+            if not os.path.isdir(os.path.dirname(os_path)):
+                raise web.HTTPError(404, u'No such directory: %s' % path.rpartition('/')[0])
+            self.log.debug("Starting upload %s to %s", upload_id, os_path)
+            self.run_pre_save_hook(model=model, path=path)
+            # in the same directory, so that it can be renamed to os_path
+            tmp_path = os.path.join(
+                os.path.dirname(os_path),
+                '.~upload-%s-%s' % (upload_id, os.path.basename(os_path)),
+            )
+            with self.perm_to_403(tmp_path):
+                fd = os.open(tmp_path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o666)
+            try:
+                self._preallocate(fd, size)
+            except Exception:
+                os.close(fd)
+                os.unlink(tmp_path)
+                raise
+            session = self._uploads[upload_id] = UploadSession(
+                upload_id, path, os_path, tmp_path, fd, size,
+            )
+            return session
+
+    def _preallocate(self, fd, size):
+        if not size:
+            return
+        if hasattr(os, 'posix_fallocate'):
+            try:
+                os.posix_fallocate(fd, 0, size)
+                return
+            except OSError:
+                # not supported by the filesystem
+                pass
+        os.ftruncate(fd, size)
+
+    def _commit_upload(self, session):
+        """Replace the destination with the completely uploaded file"""
+        os_path = session.os_path
+        with self.perm_to_403(os_path):
+            os.fsync(session.fd)
+            os.close(session.fd)
+            session.fd = None
+            if os.path.islink(os_path):
+                os_path = os.path.join(os.path.dirname(os_path), os.readlink(os_path))
+            os.replace(session.tmp_path, os_path)
+        # keep the session until it expires, to answer retried chunks
+        session.committed = True
+        session.last_active = time.monotonic()
+        self._invalidate_listing(session.os_path)
+        self.log.debug("Completed upload %s to %s", session.upload_id, os_path)
+        model = self.get(session.path, content=False)
+        self.run_post_save_hook(model=model, os_path=session.os_path)
+
+    def _upload_model(self, session):
+        if session.committed:
+            model = self.get(session.path, content=False)
+        elif session.expired or session.fd is None:
+            raise web.HTTPError(410, u'Upload %s expired' % session.upload_id)
+        else:
+            model = self._base_model_from_stat(
+                session.path, session.tmp_path, os.fstat(session.fd),
+            )
+            model['type'] = 'file'
+        model['upload'] = session.status()
+        return model
+
+    def _expire_uploads(self):
+        """Abandon the uploads inactive for longer than upload_timeout"""
+        deadline = time.monotonic() - self.upload_timeout
+        with self._uploads_lock:
+            for session in list(self._uploads.values()):
+                # writers get the session before taking its lock
+                with session.lock:
+                    if session.last_active >= deadline or session.writers:
+                        continue
+                    session.expired = True
+                    del self._uploads[session.upload_id]
+                    if session.committed or session.fd is None:
+                        continue
+                    self.log.warning("Abandoning upload %s to %s", session.upload_id, session.os_path)
+                    os.close(session.fd)
+                    session.fd = None
+                    try:
+                        os.unlink(session.tmp_path)
+                    except OSError:
+                        pass
+
+
+class AsyncLargeFileManager(AsyncFileContentsManager, LargeFileManager):
+    """Handle large file upload, with file operations on a thread pool."""
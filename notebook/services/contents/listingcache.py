@@ -0,0 +1,306 @@
+"""An in-process cache of directory listings for file-based contents managers.
+
+Cached listings are invalidated by inotify where it is available. Elsewhere,
+or when no more watches can be added, a listing is revalidated against the
+modification time of its directory and expires after a polling interval.
+"""
+
+# Copyright (c) Jupyter Development Team.
+# Distributed under the terms of the Modified BSD License.
+
+from collections import OrderedDict
+import ctypes
+import ctypes.util
+import errno
+import os
+import struct
+import sys
+import threading
+import time
+
+# inotify(7) constants
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = getattr(os, 'O_CLOEXEC', 0)
+
+WATCH_MASK = (
+    IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO
+    | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+)
+
+_event_header = struct.Struct('iIII')
+
+
+class InotifyWatcher(object):
+    """A minimal non-blocking inotify(7) binding through ctypes
+
+    Raises OSError if inotify is not available.
+    """
+
+    def __init__(self):
+        if not sys.platform.startswith('linux'):
+            raise OSError(errno.ENOSYS, "inotify is only available on Linux")
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        try:
+            self._add_watch = libc.inotify_add_watch
+            self._rm_watch = libc.inotify_rm_watch
+            init = libc.inotify_init1
+        except AttributeError:
+            raise OSError(errno.ENOSYS, "inotify is not available")
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self._rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        self.fd = init(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+
+    def add_watch(self, path, mask=WATCH_MASK):
+        """Watch a directory, returning the watch descriptor"""
+        wd = self._add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), path)
+        return wd
+
+    def rm_watch(self, wd):
+        self._rm_watch(self.fd, wd)
+
+    def read_events(self):
+        """Return the pending (wd, mask) events, without blocking"""
+        events = []
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, length = _event_header.unpack_from(data, offset)
+                offset += _event_header.size + length
+                events.append((wd, mask))
+        return events
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+class _Listing(object):
+    __slots__ = ('children', 'wd', 'token', 'expires')
+
+    def __init__(self, children, wd, token, expires):
+        self.children = children
+        self.wd = wd
+        self.token = token
+        self.expires = expires
+
+
+def _dir_token(os_dir):
+    """What identifies a version of a directory when polling"""
+    st = os.stat(os_dir)
+    return (st.st_ino, st.st_mtime_ns)
+
+
+class DirectoryListingCache(object):
+    """A bounded LRU cache of directory listings, keyed by directory path
+
+    Parameters
+    ----------
+    max_entries : int
+        The maximum number of directory listings to keep.
+    poll_interval : float
+        How long a listing that is not watched by inotify may be served
+        before it is rebuilt, in seconds. Changes to the set of entries of
+        such directories are detected immediately from the mtime of the
+        directory; this bounds how long changes to the entries themselves
+        may go unnoticed.
+    use_inotify : bool
+        Whether to try using inotify to invalidate listings.
+    log : logging.Logger, optional
+    clock : callable, optional
+        Returns the current time in seconds, defaults to time.monotonic.
+    """
+
+    def __init__(self, max_entries=128, poll_interval=5.0, use_inotify=True,
+                 log=None, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.poll_interval = poll_interval
+        self.log = log
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._listings = OrderedDict()
+        self._watches = {}
+        # watches with events seen while their listing was being built
+        self._building = 0
+        self._unclaimed_events = set()
+        self._lock = threading.Lock()
+        self._inotify = None
+        if use_inotify:
+            try:
+                self._inotify = InotifyWatcher()
+            except OSError as e:
+                if log is not None:
+                    log.debug("Polling for directory changes, inotify unavailable: %s", e)
+
+    def __len__(self):
+        return len(self._listings)
+
+    def get(self, os_dir, build):
+        """Return the listing of a directory, calling `build()` on a miss
+
+        `build` returns a list of child models. Each call returns fresh
+        copies of the cached models, which callers may modify.
+        """
+        with self._lock:
+            self._process_events()
+            listing = self._listings.get(os_dir)
+            if listing is not None and self._is_valid(os_dir, listing):
+                self._listings.move_to_end(os_dir)
+                self.hits += 1
+                return [dict(child) for child in listing.children]
+            if listing is not None:
+                self._drop(os_dir)
+            self.misses += 1
+            self._building += 1
+
+        # Start watching before listing, so that changes made while listing
+        # invalidate the new entry.
+        children = wd = token = None
+        try:
+            wd = self._watch(os_dir)
+            if wd is None:
+                try:
+                    token = _dir_token(os_dir)
+                except OSError:
+                    children = build()
+                    return children
+            children = build()
+        finally:
+            with self._lock:
+                try:
+                    if children is None:
+                        self._release_watch(wd)
+                    else:
+                        self._store(os_dir, children, wd, token)
+                finally:
+                    self._building -= 1
+                    if not self._building:
+                        self._unclaimed_events.clear()
+        return [dict(child) for child in children]
+
+    def invalidate(self, os_path, recursive=False):
+        """Forget the listing of `os_path` and of the directory containing it
+
+        If `recursive`, also forget the listings of directories below it,
+        e.g. when a directory has been renamed or deleted.
+        """
+        os_path = os_path.rstrip(os.sep) or os.sep
+        parent = os.path.dirname(os_path)
+        prefix = os_path + os.sep
+        with self._lock:
+            for os_dir in list(self._listings):
+                if (os_dir == os_path or os_dir == parent
+                        or (recursive and os_dir.startswith(prefix))):
+                    self._drop(os_dir)
+
+    def clear(self):
+        with self._lock:
+            for os_dir in list(self._listings):
+                self._drop(os_dir)
+
+    def close(self):
+        self.clear()
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify = None
+
+    def _store(self, os_dir, children, wd, token):
+        self._process_events()
+        if wd is not None and wd in self._unclaimed_events:
+            # changed while it was being listed
+            self._release_watch(wd)
+            return
+        if token is None and wd is None:
+            return
+        if os_dir in self._listings:
+            self._drop(os_dir, keep_wd=wd)
+        self._listings[os_dir] = _Listing(
+            children, wd, token, self.clock() + self.poll_interval,
+        )
+        if wd is not None:
+            self._watches.setdefault(wd, set()).add(os_dir)
+        while len(self._listings) > self.max_entries:
+            self._drop(next(iter(self._listings)))
+
+    def _is_valid(self, os_dir, listing):
+        if listing.wd is not None:
+            return True
+        if self.clock() >= listing.expires:
+            return False
+        try:
+            return _dir_token(os_dir) == listing.token
+        except OSError:
+            return False
+
+    def _watch(self, os_dir):
+        if self._inotify is None:
+            return None
+        try:
+            return self._inotify.add_watch(os_dir)
+        except OSError as e:
+            # e.g. ENOSPC when out of watches: poll this directory instead
+            if self.log is not None:
+                self.log.debug("Not watching %s: %s", os_dir, e)
+            return None
+
+    def _drop(self, os_dir, keep_wd=None):
+        listing = self._listings.pop(os_dir)
+        paths = self._watches.get(listing.wd)
+        if paths is not None:
+            paths.discard(os_dir)
+            if listing.wd != keep_wd:
+                self._release_watch(listing.wd)
+
+    def _release_watch(self, wd):
+        """Remove a watch no cached listing depends on"""
+        if wd is None or self._watches.get(wd):
+            return
+        self._watches.pop(wd, None)
+        if self._inotify is not None:
+            self._inotify.rm_watch(wd)
+
+    def _process_events(self):
+        if self._inotify is None:
+            return
+        for wd, mask in self._inotify.read_events():
+            if mask & IN_Q_OVERFLOW:
+                # events were lost, nothing can be trusted
+                for os_dir in list(self._listings):
+                    self._drop(os_dir)
+                continue
+            if self._building:
+                self._unclaimed_events.add(wd)
+            paths = self._watches.get(wd)
+            if not paths:
+                continue
+            if mask & IN_IGNORED:
+                # the watch was removed by the kernel, e.g. directory deleted
+                del self._watches[wd]
+                for os_dir in paths:
+                    self._listings.pop(os_dir, None)
+                continue
+            for os_dir in list(paths):
+                self._drop(os_dir)
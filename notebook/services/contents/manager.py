@@ -3,18 +3,24 @@
 # Copyright (c) Jupyter Development Team.
 # Distributed under the terms of the Modified BSD License.
 
+from base64 import decodebytes
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timezone
 from fnmatch import fnmatch
 import itertools
 import json
 import os
 import re
+import uuid
 
+from dateutil.parser import isoparse
 from tornado.web import HTTPError, RequestHandler
 
 from ...files.handlers import FilesHandler
 from .checkpoints import Checkpoints
+from .validation import NotebookValidator
 from traitlets.config.configurable import LoggingConfigurable
-from nbformat import sign, validate as validate_nb, ValidationError
+from nbformat import from_dict, sign
 from nbformat.v4 import new_notebook
 from ipython_genutils.importstring import import_item
 from traitlets import (
@@ -22,19 +28,168 @@ from traitlets import (
     Bool,
     Dict,
     Instance,
+    Integer,
     List,
     TraitError,
     Type,
     Unicode,
+    observe,
     validate,
     default,
 )
 from ipython_genutils.py3compat import string_types
 from notebook.base.handlers import IPythonHandler
 from notebook.transutils import _
+from notebook.utils import maybe_future
+
+try:
+    from nbformat.v4.nbbase import random_cell_id
+except ImportError:
+    # nbformat < 5.1 predates cell ids
+    def random_cell_id():
+        return uuid.uuid4().hex[:8]
 
 
 copy_pat = re.compile(r'\-Copy\d*\.')
+# the fraction of seconds of an ISO 8601 time
+_fraction_re = re.compile(r'T[\d:]+[.,](\d+)')
+
+#: Keys by which directory listings can be sorted
+LISTING_SORT_KEYS = ('name', 'last_modified', 'size')
+
+
+def listing_cursor(key):
+    """Return the pagination cursor for the sort key of a listing entry"""
+    return '/'.join(str(part) for part in key)
+
+
+def paginate_listing(entries, limit=None, offset=0, cursor=None, sort='name', reverse=False):
+    """Select one page of a directory listing
+
+    Parameters
+    ----------
+    entries : list of (key, item)
+        The entries of the listing. key is a tuple: ``(name,)`` when sorting
+        by name, ``(value, name)`` otherwise.
+    limit : int, optional
+        The maximum number of entries to return.
+    offset : int
+        The number of entries to skip. Ignored if cursor is given.
+    cursor : str, optional
+        The ``next_cursor`` of the previous page: return entries after it.
+    sort : str
+        The key the listing is sorted by, one of LISTING_SORT_KEYS.
+    reverse : bool
+        Whether the listing is sorted in descending order.
+
+    Returns
+    -------
+    page, next_cursor : list of items, str or None
+        next_cursor is None on the last page.
+    """
+    entries = sorted(entries, key=lambda entry: entry[0])
+    keys = [key for key, item in entries]
+    if cursor is not None:
+        if sort == 'name':
+            cursor_key = (cursor,)
+        else:
+            value, _, name = cursor.partition('/')
+            try:
+                cursor_key = (float(value), name)
+            except ValueError:
+                raise HTTPError(400, u'Invalid cursor %r' % cursor)
+
+    if not reverse:
+        start = bisect_right(keys, cursor_key) if cursor is not None else offset
+        stop = len(entries) if limit is None else start + limit
+        page = entries[start:stop]
+        more = stop < len(entries)
+    else:
+        stop = bisect_left(keys, cursor_key) if cursor is not None else len(entries) - offset
+        stop = max(stop, 0)
+        start = 0 if limit is None else max(stop - limit, 0)
+        page = entries[start:stop][::-1]
+        more = start > 0
+
+    next_cursor = listing_cursor(page[-1][0]) if page and more else None
+    return [item for key, item in page], next_cursor
+
+
+#: The operations supported by ContentsManager.patch_notebook
+NOTEBOOK_PATCH_OPS = ('insert', 'delete', 'replace', 'metadata')
+
+
+def apply_notebook_operations(nb, operations):
+    """Apply cell-level changes to a notebook, in place
+
+    Operations are applied in order, each one is a dict with an ``op`` key:
+
+    - ``{'op': 'insert', 'index': i, 'cell': cell}`` inserts a cell before
+      the cell at index i, or at the end if i is the number of cells.
+    - ``{'op': 'delete', 'index': i}`` deletes the cell at index i.
+    - ``{'op': 'replace', 'index': i, 'cell': cell}`` replaces the cell at
+      index i.
+    - ``{'op': 'metadata', 'metadata': metadata}`` replaces the metadata of
+      the notebook, or of the cell at ``index`` if given. The trusted flag
+      of the cell is kept unless the new metadata has one.
+
+    Returns
+    -------
+    cells : list
+        The cells which were inserted, replaced or had their metadata
+        changed, and still are in the notebook.
+    """
+    if not isinstance(operations, list):
+        raise HTTPError(400, u'Notebook operations must be a list')
+    changed = []
+    for operation in operations:
+        if not isinstance(operation, dict) or operation.get('op') not in NOTEBOOK_PATCH_OPS:
+            raise HTTPError(400, u'Invalid notebook operation: %r' % (operation,))
+        op = operation['op']
+        index = operation.get('index')
+        if op != 'metadata' or index is not None:
+            size = len(nb.cells) + (op == 'insert')
+            if not isinstance(index, int) or isinstance(index, bool) or not 0 <= index < size:
+                raise HTTPError(400, u'Invalid cell index for %s: %r' % (op, index))
+
+        if op in ('insert', 'replace'):
+            cell = operation.get('cell')
+            if not isinstance(cell, dict):
+                raise HTTPError(400, u'No cell provided for %s' % op)
+            cell = from_dict(cell)
+            if 'id' not in cell and (nb.nbformat, nb.nbformat_minor) >= (4, 5):
+                cell.id = random_cell_id()
+            if op == 'insert':
+                nb.cells.insert(index, cell)
+            else:
+                nb.cells[index] = cell
+            changed.append(cell)
+        elif op == 'delete':
+            del nb.cells[index]
+        else:
+            metadata = operation.get('metadata')
+            if not isinstance(metadata, dict):
+                raise HTTPError(400, u'No metadata provided')
+            if index is None:
+                nb.metadata = from_dict(metadata)
+            else:
+                cell = nb.cells[index]
+                metadata = from_dict(metadata)
+                # trust is set by the server, not stored in files
+                if 'trusted' in cell.metadata:
+                    metadata.setdefault('trusted', cell.metadata.trusted)
+                cell.metadata = metadata
+                changed.append(cell)
+
+    # cells changed, then deleted or changed again don't need validating
+    cell_ids = {id(cell) for cell in nb.cells}
+    unique = []
+    for cell in changed:
+        if id(cell) in cell_ids:
+            cell_ids.discard(id(cell))
+            unique.append(cell)
+    return unique
+
 
 
 class ContentsManager(LoggingConfigurable):
@@ -60,9 +215,42 @@ class ContentsManager(LoggingConfigurable):
 
     allow_hidden = Bool(False, config=True, help="Allow access to hidden files")
 
+    notary_class = Type(sign.NotebookNotary, klass=sign.NotebookNotary, config=True,
+        help="""The class computing and checking notebook signatures.
+
+        notebook.services.contents.signing.IncrementalNotebookNotary only
+        hashes the cells which changed since a notebook was last signed.
+        """)
+
     notary = Instance(sign.NotebookNotary)
     def _notary_default(self):
-        return sign.NotebookNotary(parent=self)
+        return self.notary_class(parent=self)
+
+    validation_workers = Integer(0, config=True,
+        help="""The number of processes validating the changed cells of
+        notebooks which have many of them. 0 validates them in the server.""")
+
+    validation_parallel_cells = Integer(256, config=True,
+        help="""The number of changed cells from which notebooks are validated
+        by several processes, if validation_workers is set.""")
+
+    _notebook_validator = None
+
+    @observe('validation_workers', 'validation_parallel_cells')
+    def _reset_notebook_validator(self, change):
+        if self._notebook_validator is not None:
+            self._notebook_validator.close()
+            self._notebook_validator = None
+
+    @property
+    def notebook_validator(self):
+        """The NotebookValidator validating notebook models"""
+        if self._notebook_validator is None:
+            self._notebook_validator = NotebookValidator(
+                workers=self.validation_workers,
+                parallel_min_cells=self.validation_parallel_cells,
+            )
+        return self._notebook_validator
 
     hide_globs = List(Unicode(), [
             u'__pycache__', '*.pyc', '*.pyo',
@@ -159,6 +347,11 @@ class ContentsManager(LoggingConfigurable):
         """
     )
 
+    stream_chunk_size = Integer(1024 * 1024, config=True,
+        help="""The size in bytes of the chunks in which files are read
+        when streaming them, e.g. by FilesHandler."""
+    )
+
     def get_extra_handlers(self):
         """Return additional handlers
 
@@ -297,6 +490,123 @@ class ContentsManager(LoggingConfigurable):
         model = self.get(new_path, content=False)
         return model
 
+    def patch_notebook(self, path, operations, last_modified=None):
+        """Apply cell-level changes to a notebook and save it
+
+        For use in PATCH requests, so that only the changed cells of a
+        notebook have to be sent. See `apply_notebook_operations` for the
+        format of operations.
+
+        If `last_modified` is given, the notebook must not have been
+        modified since, or the changes are rejected with 409 Conflict.
+
+        Returns the saved model with no content, like `save`. The default
+        implementation gets the notebook and saves the whole of it.
+        """
+        path = path.strip('/')
+        model = self.get(path, content=True, type='notebook')
+        self._check_last_modified(model, last_modified)
+        apply_notebook_operations(model['content'], operations)
+        return self.save({'type': 'notebook', 'content': model['content']}, path)
+
+    def _check_last_modified(self, model, last_modified):
+        """Raise 409 if a model was modified since last_modified
+
+        Timestamps given as strings are compared at their precision, e.g.
+        to the millisecond for the ones from JavaScript.
+        """
+        if last_modified is None:
+            return
+        current = model['last_modified']
+        if isinstance(last_modified, string_types):
+            try:
+                parsed = isoparse(last_modified)
+            except (ValueError, OverflowError):
+                raise HTTPError(400, u'Invalid last_modified: %r' % last_modified)
+            match = _fraction_re.search(last_modified)
+            digits = min(len(match.group(1)), 6) if match else 0
+            resolution = 10 ** (6 - digits)
+            current = current.replace(microsecond=current.microsecond - current.microsecond % resolution)
+            last_modified = parsed
+        if last_modified.tzinfo is None and current.tzinfo is not None:
+            last_modified = last_modified.replace(tzinfo=timezone.utc)
+        if last_modified != current:
+            raise HTTPError(409, u'%s has been modified since %s' % (model['path'], last_modified))
+
+    def get_directory_page(self, path, limit=None, offset=0, cursor=None,
+                           sort='name', reverse=False, filter_type=None):
+        """Get a directory model whose content is one page of its listing
+
+        The default implementation lists the whole directory with `get` and
+        pages it in memory. Subclasses can override it to only build the
+        models of the requested page.
+
+        Parameters
+        ----------
+        path : str
+            The API path of the directory.
+        limit : int, optional
+            The maximum number of entries to include.
+        offset : int
+            The number of entries to skip. Ignored if cursor is given.
+        cursor : str, optional
+            The ``next_cursor`` of the previous page.
+        sort : str
+            The key to sort by, one of LISTING_SORT_KEYS.
+        reverse : bool
+            Whether to sort in descending order.
+        filter_type : str, optional
+            Only list entries of this type ('directory', 'file' or 'notebook').
+
+        Returns
+        -------
+        model : dict
+            The directory model, with an additional ``next_cursor`` key
+            to pass as `cursor` for the next page (None on the last page).
+        """
+        model = self.get(path, content=True, type='directory')
+        entries = []
+        for child in model['content']:
+            if filter_type is not None and child['type'] != filter_type:
+                continue
+            if sort == 'name':
+                key = (child['name'],)
+            elif sort == 'last_modified':
+                key = (child['last_modified'].timestamp(), child['name'])
+            else:
+                size = child.get('size')
+                key = (-1 if size is None else size, child['name'])
+            entries.append((key, child))
+        model['content'], model['next_cursor'] = paginate_listing(
+            entries, limit=limit, offset=offset, cursor=cursor, sort=sort,
+            reverse=reverse,
+        )
+        return model
+
+    async def read_file_chunks(self, path, start=0, end=None):
+        """Iterate over the bytes of a file, in chunks
+
+        Yields chunks of at most `stream_chunk_size` bytes, from byte `start`
+        up to byte `end` (exclusive, None for the end of the file).
+        Use ``get(path, type='file', content=False)`` for the size and
+        modification time of the file. Overrides can return an iterator
+        or an async iterator.
+
+        The default implementation is an async iterator, which reads the
+        whole file with `get`, so that it works when `get` is asynchronous.
+        Subclasses should override it to read only one chunk at a time.
+        """
+        model = await maybe_future(self.get(path, type='file', content=True))
+        if model['format'] == 'base64':
+            data = decodebytes(model['content'].encode('ascii'))
+        elif model['format'] == 'json':
+            data = json.dumps(model['content']).encode('utf-8')
+        else:
+            data = model['content'].encode('utf-8')
+        data = memoryview(data)[start:end]
+        for offset in range(0, len(data), self.stream_chunk_size):
+            yield data[offset:offset + self.stream_chunk_size].tobytes()
+
     def info_string(self):
         return "Serving contents"
 
@@ -349,15 +659,16 @@ class ContentsManager(LoggingConfigurable):
         return name
 
     def validate_notebook_model(self, model):
-        """Add failed-validation message to model"""
-        try:
-            validate_nb(model['content'])
-        except ValidationError as e:
-            model['message'] = u'Notebook validation failed: {}:\n{}'.format(
-                e.message, json.dumps(e.instance, indent=1, default=lambda obj: '<UNKNOWN>'),
-            )
+        """Add failed-validation message to model
+
+        Only the cells which changed since the last valid version of the
+        notebook at ``model['path']`` are validated, if it is known.
+        """
+        message = self.notebook_validator.validate(model['content'], model.get('path'))
+        if message:
+            model['message'] = message
         return model
-    
+
     def new_untitled(self, path='', type='', ext=''):
         """Create a new untitled file or directory in path
         
@@ -487,11 +798,29 @@ class ContentsManager(LoggingConfigurable):
             The notebook dict
         path : string
             The notebook's path (for logging)
+
+        Returns
+        -------
+        signed : bool
+            Whether the notebook was signed, i.e. is trusted.
         """
         if self.notary.check_cells(nb):
             self.notary.sign(nb)
+            return True
         else:
             self.log.warning("Notebook %s is not trusted", path)
+            return False
+
+    def flush_signatures(self):
+        """Write the signatures the notary may have buffered
+
+        Called when the server stops.
+        """
+        if 'notary' not in self._trait_values:
+            return
+        flush = getattr(self.notary, 'flush', None)
+        if flush is not None:
+            flush()
 
     def mark_trusted_cells(self, nb, path=''):
         """Mark cells as trusted if the notebook signature matches.
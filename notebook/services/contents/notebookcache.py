@@ -0,0 +1,101 @@
+"""An in-process cache of parsed, trust-checked and validated notebooks."""
+
+# Copyright (c) Jupyter Development Team.
+# Distributed under the terms of the Modified BSD License.
+
+from collections import OrderedDict
+import os
+import threading
+
+from notebook.prometheus.metrics import NOTEBOOK_CACHE_REQUESTS_TOTAL
+
+
+def copy_node(node):
+    """Copy a JSON-like structure of dicts and lists
+
+    Much faster than copy.deepcopy for notebooks, since the leaves
+    (strings, numbers, booleans and None) are immutable.
+    """
+    if isinstance(node, dict):
+        return type(node)((key, copy_node(value)) for key, value in node.items())
+    if isinstance(node, list):
+        return [copy_node(value) for value in node]
+    return node
+
+
+def notebook_cache_key(os_path):
+    """What identifies a version of a notebook file"""
+    st = os.stat(os_path)
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+class NotebookCache(object):
+    """A bounded LRU cache of notebooks read from files, keyed by path
+
+    Each entry holds the notebook as read from the file, the validation
+    message of the notebook (None if valid) and its signature, for one
+    version of the file identified by `notebook_cache_key`. Callers get
+    copies of the cached notebooks, which they may modify.
+
+    The cells aren't marked as trusted or not: trust can change without
+    the file changing, e.g. with `jupyter trust`, so callers check the
+    signature against the signature store on each hit.
+
+    Parameters
+    ----------
+    max_bytes : int
+        The maximum total size of the cached notebook files. Parsed notebooks
+        usually take a few times the size of their file in memory.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, os_path, key):
+        """Return a copy of the cached (notebook, message, signature), or None"""
+        with self._lock:
+            entry = self._entries.get(os_path)
+            if entry is None or entry[0] != key:
+                self.misses += 1
+                NOTEBOOK_CACHE_REQUESTS_TOTAL.labels(result='miss').inc()
+                return None
+            self._entries.move_to_end(os_path)
+            self.hits += 1
+        NOTEBOOK_CACHE_REQUESTS_TOTAL.labels(result='hit').inc()
+        _, nb, message, signature = entry
+        return copy_node(nb), message, signature
+
+    def put(self, os_path, key, nb, message=None, signature=None):
+        """Cache a copy of a notebook read from the version `key` of a file"""
+        size = key[2]
+        if size > self.max_bytes:
+            return
+        nb = copy_node(nb)
+        with self._lock:
+            self._pop(os_path)
+            self._entries[os_path] = (key, nb, message, signature)
+            self.nbytes += size
+            while self.nbytes > self.max_bytes:
+                self._pop(next(iter(self._entries)))
+
+    def invalidate(self, os_path):
+        with self._lock:
+            self._pop(os_path)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def _pop(self, os_path):
+        entry = self._entries.pop(os_path, None)
+        if entry is not None:
+            self.nbytes -= entry[0][2]
@@ -0,0 +1,364 @@
+"""
+Checkpoints kept in a content-addressed store of compressed chunks.
+"""
+
+# Copyright (c) Jupyter Development Team.
+# Distributed under the terms of the Modified BSD License.
+
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+import zlib
+
+from tornado.web import HTTPError
+
+from .checkpoints import Checkpoints
+from .fileio import FileManagerMixin
+
+from ipython_genutils.py3compat import getcwd
+from traitlets import Float, Integer, Unicode, default, validate, TraitError
+
+from notebook import _tz as tz
+
+
+def iter_chunks(f, chunk_size):
+    """Split a binary file into content-defined chunks
+
+    Chunks end at line boundaries chosen from the content of the lines, so
+    that inserting or removing lines only changes the chunks around them,
+    not all the chunks after them. Chunks are between ``chunk_size // 2``
+    and ``chunk_size * 2`` bytes, except the last one; longer lines are
+    split.
+    """
+    min_size = max(chunk_size // 2, 1)
+    max_size = max(chunk_size * 2, 1)
+    parts = []
+    size = 0
+    while True:
+        line = f.readline(max_size - size)
+        if not line:
+            break
+        parts.append(line)
+        size += len(line)
+        if size >= max_size or (
+            size >= min_size and line.endswith(b'\n')
+            and zlib.crc32(line) & 0x3f == 0
+        ):
+            yield b''.join(parts)
+            parts = []
+            size = 0
+    if parts:
+        yield b''.join(parts)
+
+
+class ObjectStoreCheckpoints(FileManagerMixin, Checkpoints):
+    """
+    A Checkpoints storing the contents of files as deduplicated chunks.
+
+    Files are split into content-defined chunks, which are stored once,
+    compressed, in a directory of objects named by their sha256, shared by
+    all the checkpoints of all files. A manifest per file lists its
+    checkpoints and their chunks. Several checkpoints are kept per file.
+
+    Only works with FileContentsManager, like FileCheckpoints.
+    """
+
+    store_dir = Unicode(config=True,
+        help="""The directory in which checkpoints are stored.
+
+        Defaults to .ipynb_checkpoints/store in the root directory. Several
+        servers can share it to deduplicate their checkpoints.
+        """)
+
+    @default('store_dir')
+    def _store_dir_default(self):
+        return os.path.join(self.root_dir, '.ipynb_checkpoints', 'store')
+
+    root_dir = Unicode(config=True)
+
+    def _root_dir_default(self):
+        try:
+            return self.parent.root_dir
+        except AttributeError:
+            return getcwd()
+
+    chunk_size = Integer(64 * 1024, config=True,
+        help="""The average size in bytes of the chunks files are split into.""")
+
+    @validate('chunk_size')
+    def _validate_chunk_size(self, proposal):
+        if proposal['value'] < 1:
+            raise TraitError("chunk_size must be at least 1")
+        return proposal['value']
+
+    compression_level = Integer(6, config=True,
+        help="""The zlib compression level of chunks, from 0 to 9.""")
+
+    max_checkpoints = Integer(5, config=True,
+        help="""The number of checkpoints kept per file, the oldest ones are
+        deleted first. 0 keeps all of them.""")
+
+    gc_interval = Float(3600, config=True,
+        help="""The minimum number of seconds between two removals of the
+        chunks no checkpoint uses anymore.""")
+
+    gc_grace_period = Float(600, config=True,
+        help="""The number of seconds unused chunks are kept after their last
+        use, so that checkpoints being created by other servers sharing
+        the store don't lose them.""")
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._lock = threading.RLock()
+        self._last_gc = time.monotonic()
+
+    # ContentsManager-dependent checkpoint API
+    def create_checkpoint(self, contents_mgr, path):
+        """Create a checkpoint."""
+        path = path.strip('/')
+        src_path = contents_mgr._get_os_path(path)
+        with self._lock:
+            with self.open(src_path, 'rb') as f:
+                st = os.fstat(f.fileno())
+                chunks = [self._store_chunk(chunk) for chunk in iter_chunks(f, self.chunk_size)]
+            manifest = self._read_manifest(path)
+            checkpoints = manifest['checkpoints']
+            if checkpoints and checkpoints[-1]['chunks'] == chunks:
+                # unchanged since the last checkpoint
+                checkpoint = checkpoints[-1]
+                checkpoint['mtime'] = st.st_mtime
+            else:
+                checkpoint_id = str(int(checkpoints[-1]['id']) + 1 if checkpoints else 1)
+                checkpoint = {
+                    'id': checkpoint_id,
+                    'mtime': st.st_mtime,
+                    'size': st.st_size,
+                    'chunks': chunks,
+                }
+                checkpoints.append(checkpoint)
+            dropped = False
+            if self.max_checkpoints > 0 and len(checkpoints) > self.max_checkpoints:
+                del checkpoints[:-self.max_checkpoints]
+                dropped = True
+            self._write_manifest(path, manifest)
+            self.log.debug(
+                "Created checkpoint %s of %s from %i chunks",
+                checkpoint['id'], path, len(chunks),
+            )
+        if dropped:
+            self._maybe_gc()
+        return self.checkpoint_model(checkpoint)
+
+    def restore_checkpoint(self, contents_mgr, checkpoint_id, path):
+        """Restore a checkpoint."""
+        path = path.strip('/')
+        checkpoint = self._get_checkpoint(checkpoint_id, path)
+        dest_path = contents_mgr._get_os_path(path)
+        with self.atomic_writing(dest_path, text=False) as f:
+            for digest in checkpoint['chunks']:
+                f.write(self._read_chunk(digest))
+        try:
+            os.utime(dest_path, (checkpoint['mtime'], checkpoint['mtime']))
+        except OSError:
+            self.log.debug("Setting the mtime of %s failed", dest_path, exc_info=True)
+
+    # ContentsManager-independent checkpoint API
+    def rename_checkpoint(self, checkpoint_id, old_path, new_path):
+        """Rename a checkpoint from old_path to new_path."""
+        old_path = old_path.strip('/')
+        new_path = new_path.strip('/')
+        with self._lock:
+            old_manifest = self._read_manifest(old_path)
+            for checkpoint in old_manifest['checkpoints']:
+                if checkpoint['id'] == checkpoint_id:
+                    break
+            else:
+                return
+            old_manifest['checkpoints'].remove(checkpoint)
+            new_manifest = self._read_manifest(new_path)
+            new_manifest['checkpoints'] = [
+                cp for cp in new_manifest['checkpoints'] if cp['id'] != checkpoint_id
+            ] + [checkpoint]
+            new_manifest['checkpoints'].sort(key=lambda cp: int(cp['id']))
+            self._write_manifest(new_path, new_manifest)
+            self._write_manifest(old_path, old_manifest)
+
+    def rename_all_checkpoints(self, old_path, new_path):
+        """Rename all checkpoints for old_path to new_path."""
+        old_path = old_path.strip('/')
+        new_path = new_path.strip('/')
+        with self._lock:
+            manifest = self._read_manifest(old_path)
+            if not manifest['checkpoints']:
+                return
+            manifest['path'] = new_path
+            self._write_manifest(new_path, manifest)
+            with self.perm_to_403():
+                os.unlink(self._manifest_path(old_path))
+
+    def delete_checkpoint(self, checkpoint_id, path):
+        """delete a file's checkpoint"""
+        path = path.strip('/')
+        with self._lock:
+            manifest = self._read_manifest(path)
+            checkpoints = manifest['checkpoints']
+            remaining = [cp for cp in checkpoints if cp['id'] != checkpoint_id]
+            if len(remaining) == len(checkpoints):
+                self.no_such_checkpoint(path, checkpoint_id)
+            manifest['checkpoints'] = remaining
+            self._write_manifest(path, manifest)
+        self._maybe_gc()
+
+    def list_checkpoints(self, path):
+        """list the checkpoints for a given file, oldest first"""
+        path = path.strip('/')
+        with self._lock:
+            manifest = self._read_manifest(path)
+        return [self.checkpoint_model(cp) for cp in manifest['checkpoints']]
+
+    # Checkpoint-related utilities
+    def checkpoint_model(self, checkpoint):
+        """construct the info dict for a given checkpoint"""
+        return dict(
+            id=checkpoint['id'],
+            last_modified=tz.utcfromtimestamp(checkpoint['mtime']),
+        )
+
+    def _get_checkpoint(self, checkpoint_id, path):
+        with self._lock:
+            manifest = self._read_manifest(path)
+        for checkpoint in manifest['checkpoints']:
+            if checkpoint['id'] == checkpoint_id:
+                return checkpoint
+        self.no_such_checkpoint(path, checkpoint_id)
+
+    def _manifest_path(self, path):
+        name = hashlib.sha256(path.encode('utf-8')).hexdigest()
+        return os.path.join(self.store_dir, 'manifests', name + '.json')
+
+    def _object_path(self, digest):
+        return os.path.join(self.store_dir, 'objects', digest[:2], digest[2:])
+
+    def _read_manifest(self, path):
+        try:
+            with self.open(self._manifest_path(path), 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            return {'path': path, 'checkpoints': []}
+        except ValueError:
+            self.log.warning("Ignoring the invalid checkpoint manifest of %s", path)
+            return {'path': path, 'checkpoints': []}
+        return manifest
+
+    def _write_manifest(self, path, manifest):
+        manifest_path = self._manifest_path(path)
+        if not manifest['checkpoints']:
+            try:
+                os.unlink(manifest_path)
+            except FileNotFoundError:
+                pass
+            return
+        data = json.dumps(manifest).encode('utf-8')
+        self._write_replace(manifest_path, data)
+
+    def _write_replace(self, os_path, data):
+        """Write a file under another name, then rename it"""
+        tmp_path = '%s.%i.%i.tmp' % (os_path, os.getpid(), threading.get_ident())
+        with self.perm_to_403():
+            os.makedirs(os.path.dirname(os_path), exist_ok=True)
+            try:
+                with io.open(tmp_path, 'wb') as f:
+                    f.write(data)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, os_path)
+            except BaseException:
+                try:
+                    os.unlink(tmp_path)
+                except OSError:
+                    pass
+                raise
+
+    def _store_chunk(self, chunk):
+        """Store a chunk if it isn't already, returning its digest"""
+        digest = hashlib.sha256(chunk).hexdigest()
+        object_path = self._object_path(digest)
+        try:
+            # mark it used, for the garbage collection of other servers
+            os.utime(object_path)
+        except FileNotFoundError:
+            self._write_replace(
+                object_path, zlib.compress(chunk, self.compression_level),
+            )
+        return digest
+
+    def _read_chunk(self, digest):
+        try:
+            with self.open(self._object_path(digest), 'rb') as f:
+                chunk = zlib.decompress(f.read())
+        except (FileNotFoundError, zlib.error) as e:
+            raise HTTPError(500, u'Checkpoint data is missing or corrupt: %s' % digest) from e
+        if hashlib.sha256(chunk).hexdigest() != digest:
+            raise HTTPError(500, u'Checkpoint data is corrupt: %s' % digest)
+        return chunk
+
+    def _maybe_gc(self):
+        if time.monotonic() - self._last_gc >= self.gc_interval:
+            self.gc()
+
+    def gc(self):
+        """Remove the chunks no checkpoint uses anymore
+
+        Returns the number of chunks removed.
+        """
+        self._last_gc = time.monotonic()
+        manifests_dir = os.path.join(self.store_dir, 'manifests')
+        objects_dir = os.path.join(self.store_dir, 'objects')
+        removed = 0
+        with self._lock:
+            used = set()
+            try:
+                names = os.listdir(manifests_dir)
+            except FileNotFoundError:
+                names = []
+            for name in names:
+                if not name.endswith('.json'):
+                    continue
+                try:
+                    with io.open(os.path.join(manifests_dir, name), encoding='utf-8') as f:
+                        manifest = json.load(f)
+                except (OSError, ValueError):
+                    # in doubt, keep everything
+                    self.log.warning("Not collecting checkpoint chunks, cannot read %s", name)
+                    return 0
+                for checkpoint in manifest['checkpoints']:
+                    used.update(checkpoint['chunks'])
+
+            deadline = time.time() - self.gc_grace_period
+            try:
+                prefixes = os.listdir(objects_dir)
+            except FileNotFoundError:
+                prefixes = []
+            for prefix in prefixes:
+                prefix_dir = os.path.join(objects_dir, prefix)
+                for entry in os.scandir(prefix_dir):
+                    if prefix + entry.name in used or entry.name.endswith('.tmp'):
+                        continue
+                    try:
+                        if entry.stat().st_mtime < deadline:
+                            os.unlink(entry.path)
+                            removed += 1
+                    except FileNotFoundError:
+                        pass
+        self.log.debug("Removed %i unused checkpoint chunks", removed)
+        return removed
+
+    # Error Handling
+    def no_such_checkpoint(self, path, checkpoint_id):
+        raise HTTPError(
+            404,
+            u'Checkpoint does not exist: %s@%s' % (path, checkpoint_id)
+        )
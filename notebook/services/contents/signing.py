@@ -0,0 +1,264 @@
+"""Incremental notebook signatures.
+
+The stock NotebookNotary hashes the whole notebook with HMAC every time a
+notebook is opened or saved. IncrementalNotebookNotary instead signs the
+digests of the cells, which are cached, so that only the cells which changed
+since a notebook was last signed or checked are hashed again.
+"""
+
+# Copyright (c) Jupyter Development Team.
+# Distributed under the terms of the Modified BSD License.
+
+from collections import OrderedDict
+from datetime import datetime, timezone
+from hmac import HMAC
+import threading
+import time
+
+from nbformat.sign import (
+    NotebookNotary, SQLiteSignatureStore, signature_removed, sqlite3,
+    yield_everything,
+)
+from traitlets import Bool, Float, Integer, default
+
+from .notebookcache import copy_node
+
+# distinguishes the signatures of cell digests from whole-notebook signatures
+_SCHEME = b'nbcells:1'
+
+
+class CellDigestCache(object):
+    """A bounded LRU cache of the digests of notebook cells
+
+    Cells are looked up by id, or by source for cells without ids. A cached
+    digest is only reused if the cell is equal to the cached copy of the cell
+    it was computed from. Comparing cells is much cheaper than hashing them,
+    especially when their strings are shared with the cached copy.
+
+    Parameters
+    ----------
+    max_bytes : int
+        The maximum total size of the cached cells, as hashed.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def cell_key(cell):
+        key = cell.get('id')
+        if key is None:
+            source = cell.get('source', '')
+            key = source if isinstance(source, str) else ''.join(source)
+        return (cell.get('cell_type'), key)
+
+    def digest(self, cell, digestmod):
+        """Return the digest of a cell, hashing it only if needed"""
+        key = self.cell_key(cell)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == cell and entry[1] == digestmod:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[2]
+            self.misses += 1
+
+        h = digestmod()
+        size = 0
+        for b in yield_everything(cell):
+            h.update(b)
+            size += len(b)
+        digest = h.digest()
+        if size <= self.max_bytes:
+            with self._lock:
+                old = self._entries.pop(key, None)
+                if old is not None:
+                    self.nbytes -= old[3]
+                self._entries[key] = (copy_node(cell), digestmod, digest, size)
+                self.nbytes += size
+                while self.nbytes > self.max_bytes:
+                    _, old = self._entries.popitem(last=False)
+                    self.nbytes -= old[3]
+        return digest
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+
+class BatchedSignatureStore(SQLiteSignatureStore):
+    """An SQLite signature store which batches its writes
+
+    New signatures and the last_seen updates of checked signatures are kept
+    in memory, and written in one transaction once `flush_interval` has
+    passed or `flush_size` of them are pending, or when the store is closed.
+    If the process is killed first, notebooks signed in the meantime are
+    not trusted anymore.
+    """
+
+    flush_interval = Float(5, config=True,
+        help="""The maximum number of seconds signatures are kept in memory
+        before being written to the database.""")
+
+    flush_size = Integer(100, config=True,
+        help="""The number of pending signatures which triggers a write.""")
+
+    def __init__(self, db_file, **kwargs):
+        super().__init__(db_file, **kwargs)
+        # (digest, algorithm) -> last_seen
+        self._pending = {}
+        self._last_flush = time.monotonic()
+
+    def store_signature(self, digest, algorithm):
+        if self.db is None:
+            return
+        self._pending[(digest, algorithm)] = datetime.now(tz=timezone.utc)
+        self._maybe_flush()
+
+    def check_signature(self, digest, algorithm):
+        if self.db is None:
+            return False
+        key = (digest, algorithm)
+        if key not in self._pending:
+            r = self.db.execute(
+                """SELECT id FROM nbsignatures WHERE
+                algorithm = ? AND
+                signature = ?;
+                """,
+                (algorithm, digest),
+            ).fetchone()
+            if r is None:
+                return False
+        self._pending[key] = datetime.now(tz=timezone.utc)
+        self._maybe_flush()
+        return True
+
+    def remove_signature(self, digest, algorithm):
+        self._pending.pop((digest, algorithm), None)
+        super().remove_signature(digest, algorithm)
+
+    def _maybe_flush(self):
+        if (len(self._pending) >= self.flush_size
+                or time.monotonic() - self._last_flush >= self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        """Write the pending signatures to the database"""
+        self._last_flush = time.monotonic()
+        if not self._pending or self.db is None:
+            return
+        pending, self._pending = self._pending, {}
+        with self.db:
+            for (digest, algorithm), last_seen in pending.items():
+                updated = self.db.execute(
+                    """UPDATE nbsignatures SET last_seen = ? WHERE
+                    algorithm = ? AND
+                    signature = ?;
+                    """,
+                    (last_seen, algorithm, digest),
+                ).rowcount
+                if not updated:
+                    self.db.execute(
+                        """
+                        INSERT INTO nbsignatures (algorithm, signature, last_seen)
+                        VALUES (?, ?, ?)
+                        """,
+                        (algorithm, digest, last_seen),
+                    )
+        (n,) = self.db.execute("SELECT Count(*) FROM nbsignatures").fetchone()
+        if n > self.cache_size:
+            self.cull_db()
+            self.db.commit()
+
+    def close(self):
+        if self.db is not None:
+            self.flush()
+        super().close()
+
+
+class IncrementalNotebookNotary(NotebookNotary):
+    """A notary signing the digests of the cells of notebooks
+
+    The signature of a notebook is the HMAC of the digests of its cells and
+    of its other fields, rather than of all of its contents. Cell digests are
+    cached, so that signing or checking a notebook only hashes the cells
+    which changed.
+
+    Its signatures differ from the ones of NotebookNotary, so notebooks
+    signed by it are not trusted by other tools using the same signature
+    database. Notebooks signed by NotebookNotary are still trusted, unless
+    `check_whole_signatures` is disabled.
+    """
+
+    cell_cache_bytes = Integer(64 * 1024 * 1024, config=True,
+        help="""The maximum total size in bytes of the cells whose digests
+        are cached.""")
+
+    check_whole_signatures = Bool(True, config=True,
+        help="""Whether to trust notebooks signed by the whole-notebook
+        scheme of NotebookNotary, e.g. with `jupyter trust`.
+
+        Checking them hashes all of notebooks whose cell signature is
+        not known.""")
+
+    @default('store_factory')
+    def _store_factory_default(self):
+        default_factory = super()._store_factory_default()
+        def factory():
+            if sqlite3 is None:
+                return default_factory()
+            return BatchedSignatureStore(self.db_file, parent=self)
+        return factory
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.cell_cache = CellDigestCache(self.cell_cache_bytes)
+
+    def compute_signature(self, nb):
+        """Compute the HMAC of the digests of the cells of a notebook"""
+        if nb.nbformat < 4:
+            return super().compute_signature(nb)
+        hmac = HMAC(self.secret, digestmod=self.digestmod)
+        hmac.update(_SCHEME)
+        with signature_removed(nb):
+            for key in sorted(nb):
+                if key == 'cells':
+                    continue
+                h = self.digestmod()
+                for b in yield_everything(nb[key]):
+                    h.update(b)
+                hmac.update(key.encode())
+                hmac.update(h.digest())
+        hmac.update(b'cells')
+        for cell in nb.cells:
+            hmac.update(self.cell_cache.digest(cell, self.digestmod))
+        return hmac.hexdigest()
+
+    def check_signature(self, nb):
+        if super().check_signature(nb):
+            return True
+        if not self.check_whole_signatures or nb.nbformat < 4:
+            return False
+        signature = NotebookNotary.compute_signature(self, nb)
+        return self.store.check_signature(signature, self.algorithm)
+
+    def unsign(self, nb):
+        super().unsign(nb)
+        if nb.nbformat >= 4:
+            signature = NotebookNotary.compute_signature(self, nb)
+            self.store.remove_signature(signature, self.algorithm)
+
+    def flush(self):
+        """Write the signatures buffered by the store"""
+        flush = getattr(self.store, 'flush', None)
+        if flush is not None:
+            flush()
@@ -2,6 +2,7 @@
 
 from contextlib import contextmanager
 from functools import partial
+import hashlib
 import io
 import json
 import os
@@ -16,6 +17,8 @@ from send2trash import send2trash
 from send2trash.exceptions import TrashPermissionError
 
 from ..filecheckpoints import GenericFileCheckpoints
+from ..largefilemanager import AsyncLargeFileManager
+from ..objectcheckpoints import ObjectStoreCheckpoints
 
 from traitlets.config import Config
 from notebook.utils import url_path_join, url_escape, to_os_path
@@ -63,8 +66,8 @@ class API(object):
         response.raise_for_status()
         return response
 
-    def list(self, path='/'):
-        return self._req('GET', path)
+    def list(self, path='/', **params):
+        return self._req('GET', path, params=params or None)
 
     def read(self, path, type=None, format=None, content=None):
         params = {}
@@ -112,6 +115,12 @@ class API(object):
         body = json.dumps({'path': new_path})
         return self._req('PATCH', path, body)
 
+    def patch_notebook(self, path, operations, last_modified=None):
+        body = {'operations': operations}
+        if last_modified is not None:
+            body['last_modified'] = last_modified
+        return self._req('PATCH', path, json.dumps(body))
+
     def get_checkpoints(self,  path):
         return self._req('GET', url_path_join(path, 'checkpoints'))
 
@@ -280,6 +289,57 @@ class APITest(NotebookTestBase):
         with assert_http_error(404):
             self.api.list('nonexistant')
 
+    def test_list_paginated(self):
+        names = sorted(m['name'] for m in self.api.list('ordering').json()['content'])
+        self.assertEqual(len(names), 9)
+
+        model = self.api.list('ordering', limit=4).json()
+        self.assertEqual([m['name'] for m in model['content']], names[:4])
+        page = self.api.list('ordering', limit=4, offset=4).json()
+        self.assertEqual([m['name'] for m in page['content']], names[4:8])
+
+        # follow the cursor to the last page
+        listed = []
+        cursor = None
+        while True:
+            params = {'limit': 2}
+            if cursor is not None:
+                params['cursor'] = cursor
+            model = self.api.list('ordering', **params).json()
+            listed.extend(m['name'] for m in model['content'])
+            cursor = model['next_cursor']
+            if cursor is None:
+                break
+        self.assertEqual(listed, names)
+
+        model = self.api.list('ordering', sort='-name', limit=3).json()
+        self.assertEqual([m['name'] for m in model['content']], names[::-1][:3])
+        model = self.api.list('ordering', sort='-name', cursor=model['next_cursor']).json()
+        self.assertEqual([m['name'] for m in model['content']], names[::-1][3:])
+        self.assertIsNone(model['next_cursor'])
+
+    def test_list_sorted_filtered(self):
+        model = self.api.list('foo', sort='size').json()
+        sizes = [m['size'] for m in model['content']]
+        self.assertEqual(sizes[0], None)  # the bar directory
+        self.assertEqual(sizes[1:], sorted(sizes[1:]))
+
+        model = self.api.list('foo', sort='-last_modified', limit=3).json()
+        dates = [m['last_modified'] for m in model['content']]
+        self.assertEqual(dates, sorted(dates, reverse=True))
+        self.assertIsNotNone(model['next_cursor'])
+
+        model = self.api.list('foo', filter_type='notebook').json()
+        self.assertEqual({m['type'] for m in model['content']}, {'notebook'})
+        self.assertEqual(len(model['content']), 4)
+        model = self.api.list('foo', filter_type='directory').json()
+        self.assertEqual([m['name'] for m in model['content']], ['bar'])
+
+        with assert_http_error(400):
+            self.api.list('foo', sort='owner')
+        with assert_http_error(400):
+            self.api.list('foo', limit=0)
+
     def test_get_nb_contents(self):
         for d, name in self.dirs_nbs:
             path = url_path_join(d, name + '.ipynb')
@@ -447,6 +507,32 @@ class APITest(NotebookTestBase):
         self.assertEqual(model['format'], 'text')
         self.assertEqual(model['content'], body)
 
+    def test_upload_resumable(self):
+        data = os.urandom(100)
+        path = u'å b/Resumable.bin'
+
+        def send(offset, length=30):
+            chunk = data[offset:offset + length]
+            return self.api.upload(path, body=json.dumps({
+                'type': 'file',
+                'format': 'base64',
+                'content': encodebytes(chunk).decode('ascii'),
+                'upload_id': 'upload-1',
+                'upload_size': len(data),
+                'offset': offset,
+                'checksum': 'sha256:' + hashlib.sha256(chunk).hexdigest(),
+            })).json()
+
+        self.assertEqual(send(90)['upload']['missing'], [[0, 90]])
+        self.assertEqual(send(30)['upload']['missing'], [[0, 30], [60, 90]])
+        self.assertFalse(self.isfile(path))
+        send(0)
+        model = send(60)
+        self.assertTrue(model['upload']['complete'])
+        self.assertEqual(model['size'], 100)
+        with open(self.to_os_path(path), 'rb') as f:
+            self.assertEqual(f.read(), data)
+
     def test_upload_b64(self):
         body = b'\xFFblob'
         b64body = encodebytes(body).decode('ascii')
@@ -609,6 +695,32 @@ class APITest(NotebookTestBase):
         self.assertEqual(newnb.cells[0].source,
                          u'Created by test ³')
 
+    def test_patch_notebook(self):
+        model = self.api.read('foo/a.ipynb').json()
+        cells = [new_markdown_cell(u'first'), new_markdown_cell(u'second ³')]
+        self.api.patch_notebook('foo/a.ipynb', [
+            {'op': 'insert', 'index': 0, 'cell': cells[0]},
+            {'op': 'insert', 'index': 1, 'cell': cells[1]},
+            {'op': 'metadata', 'metadata': {'patched': True}},
+        ], last_modified=model['last_modified'])
+        nb = from_dict(self.api.read('foo/a.ipynb').json()['content'])
+        self.assertEqual([cell.source for cell in nb.cells], [u'first', u'second ³'])
+        self.assertEqual(nb.metadata, {'patched': True})
+
+        resp = self.api.patch_notebook('foo/a.ipynb', [
+            {'op': 'delete', 'index': 0},
+            {'op': 'replace', 'index': 0, 'cell': new_markdown_cell(u'replaced')},
+        ])
+        self.assertIsNone(resp.json()['content'])
+        nb = from_dict(self.api.read('foo/a.ipynb').json()['content'])
+        self.assertEqual([cell.source for cell in nb.cells], [u'replaced'])
+
+        with assert_http_error(400):
+            self.api.patch_notebook('foo/a.ipynb', [{'op': 'delete', 'index': 1}])
+        # based on an older version
+        with assert_http_error(409):
+            self.api.patch_notebook('foo/a.ipynb', [], last_modified=model['last_modified'])
+
     def test_checkpoints(self):
         resp = self.api.read('foo/a.ipynb')
         r = self.api.new_checkpoint('foo/a.ipynb')
@@ -736,3 +848,33 @@ class GenericFileCheckpointsAPITest(APITest):
         )
 
 
+
+class ObjectStoreCheckpointsAPITest(APITest):
+    """
+    Run the tests from APITest with ObjectStoreCheckpoints.
+    """
+    config = Config()
+    config.FileContentsManager.checkpoints_class = ObjectStoreCheckpoints
+
+    def test_config_did_something(self):
+
+        self.assertIsInstance(
+            self.notebook.contents_manager.checkpoints,
+            ObjectStoreCheckpoints,
+        )
+
+
+class AsyncFileContentsManagerAPITest(APITest):
+    """
+    Run the tests from APITest with AsyncLargeFileManager.
+    """
+    config = Config()
+    config.NotebookApp.contents_manager_class = AsyncLargeFileManager
+    config.AsyncFileContentsManager.max_workers = 2
+
+    def test_config_did_something(self):
+
+        self.assertIsInstance(
+            self.notebook.contents_manager,
+            AsyncLargeFileManager,
+        )
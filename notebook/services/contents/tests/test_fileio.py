@@ -3,20 +3,29 @@
 # Copyright (c) Jupyter Development Team.
 # Distributed under the terms of the Modified BSD License.
 
+import errno
 import io as stdlib_io
 import os.path
+import shutil
+import threading
+import time
 import unittest
+from unittest import mock
 import pytest
 import stat
 import sys
 
-from ..fileio import atomic_writing
+from .. import fileio
+from ..fileio import (
+    FsyncScheduler, _FsyncRequest, atomic_writing, copyfile, replace_writing,
+)
 
 from ipython_genutils.tempdir import TemporaryDirectory
 
 umask = 0
 
-def test_atomic_writing():
+@pytest.mark.parametrize('atomic_writing', [atomic_writing, replace_writing])
+def test_atomic_writing(atomic_writing):
     class CustomExc(Exception): pass
 
     with TemporaryDirectory() as td:
@@ -47,6 +56,9 @@ def test_atomic_writing():
         with stdlib_io.open(f1, 'r') as f:
             assert f.read() == u'Before'
 
+        # no temporary file is left
+        assert sorted(os.listdir(td)) == sorted(['penguin'] + (['flamingo'] if have_symlink else []))
+
         with atomic_writing(f1) as f:
             f.write(u'Overwritten')
 
@@ -78,20 +90,21 @@ class TestWithSetUmask(unittest.TestCase):
 
     @pytest.mark.skipif(sys.platform == "win32", reason="do not run on windows")
     def test_atomic_writing_umask(self):
-        with TemporaryDirectory() as td:
-            os.umask(0o022)
-            f1 = os.path.join(td, '1')
-            with atomic_writing(f1) as f:
-                f.write(u'1')
-            mode = stat.S_IMODE(os.stat(f1).st_mode)
-            assert mode == 0o644
-    
-            os.umask(0o057)
-            f2 = os.path.join(td, '2')
-            with atomic_writing(f2) as f:
-                f.write(u'2')
-            mode = stat.S_IMODE(os.stat(f2).st_mode)
-            assert mode == 0o620
+        for atomic_writing in (fileio.atomic_writing, replace_writing):
+            with TemporaryDirectory() as td:
+                os.umask(0o022)
+                f1 = os.path.join(td, '1')
+                with atomic_writing(f1) as f:
+                    f.write(u'1')
+                mode = stat.S_IMODE(os.stat(f1).st_mode)
+                assert mode == 0o644
+
+                os.umask(0o057)
+                f2 = os.path.join(td, '2')
+                with atomic_writing(f2) as f:
+                    f.write(u'2')
+                mode = stat.S_IMODE(os.stat(f2).st_mode)
+                assert mode == 0o620
 
 
 def test_atomic_writing_newlines():
@@ -130,3 +143,128 @@ def test_atomic_writing_newlines():
         with stdlib_io.open(path, 'r', newline='') as f:
             read = f.read()
         assert read == text
+
+
+def test_copyfile():
+    with TemporaryDirectory() as td:
+        src = os.path.join(td, 'src')
+        dst = os.path.join(td, 'dst')
+        data = os.urandom(3 * 1024 * 1024 + 1)
+        with stdlib_io.open(src, 'wb') as f:
+            f.write(data)
+        with stdlib_io.open(dst, 'wb') as f:
+            f.write(b'previous content, longer than nothing')
+
+        copyfile(src, dst)
+        with stdlib_io.open(dst, 'rb') as f:
+            assert f.read() == data
+
+        # without reflinks nor copies in the kernel
+        with mock.patch.object(fileio, '_clone_file', return_value=False), \
+                mock.patch.object(fileio, '_copy_in_kernel', return_value=False):
+            os.unlink(dst)
+            copyfile(src, dst)
+        with stdlib_io.open(dst, 'rb') as f:
+            assert f.read() == data
+
+        with pytest.raises(shutil.SameFileError):
+            copyfile(src, src)
+        assert os.path.getsize(src) == len(data)
+
+
+def test_copy_in_kernel_unsupported():
+    with TemporaryDirectory() as td:
+        src = os.path.join(td, 'src')
+        with stdlib_io.open(src, 'wb') as f:
+            f.write(b'data')
+        error = OSError(fileio.errno.EXDEV, 'cross-device')
+        with mock.patch('os.copy_file_range', side_effect=error, create=True), \
+                mock.patch('os.sendfile', side_effect=error, create=True):
+            with stdlib_io.open(src, 'rb') as fsrc, \
+                    stdlib_io.open(os.path.join(td, 'dst'), 'wb') as fdst:
+                assert not fileio._copy_in_kernel(fsrc, fdst)
+
+
+def test_copy_in_kernel_nothing_copied():
+    # like procfs, copy_file_range copying nothing isn't the end of the file
+    with TemporaryDirectory() as td:
+        src = os.path.join(td, 'src')
+        dst = os.path.join(td, 'dst')
+        with stdlib_io.open(src, 'wb') as f:
+            f.write(b'data')
+        with mock.patch.object(fileio, '_clone_file', return_value=False), \
+                mock.patch('os.copy_file_range', return_value=0, create=True):
+            copyfile(src, dst)
+        with stdlib_io.open(dst, 'rb') as f:
+            assert f.read() == b'data'
+
+
+def test_replace_writing_keeps_umask():
+    with TemporaryDirectory() as td, \
+            mock.patch('os.umask', side_effect=AssertionError('umask changed')):
+        with replace_writing(os.path.join(td, 'new')) as f:
+            f.write(u'new')
+        assert os.listdir(td) == ['new']
+
+
+def test_replace_strategy():
+    from ..filemanager import FileContentsManager
+    with TemporaryDirectory() as td:
+        cm = FileContentsManager(root_dir=td, atomic_writing_strategy='replace')
+        cm.new(path='a.txt')
+        os_path = os.path.join(td, 'a.txt')
+        inode = os.stat(os_path).st_ino
+        cm.save({'type': 'file', 'format': 'text', 'content': u'saved'}, 'a.txt')
+        assert cm.get('a.txt')['content'] == u'saved'
+        assert os.listdir(td) == ['a.txt']
+        assert os.stat(os_path).st_ino != inode
+
+
+def test_fsync_scheduler():
+    synced = []
+    def slow_fsync(fd):
+        time.sleep(0.01)
+        synced.append(fd)
+
+    scheduler = FsyncScheduler(max_delay=0.05)
+    with TemporaryDirectory() as td:
+        def write(i):
+            with scheduler.writing(), replace_writing(
+                os.path.join(td, str(i)), syncer=scheduler,
+            ) as f:
+                f.write(u'%i' % i)
+
+        with mock.patch.object(fileio.os, 'fsync', slow_fsync):
+            threads = [threading.Thread(target=write, args=(i,)) for i in range(8)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+
+        for i in range(8):
+            with stdlib_io.open(os.path.join(td, str(i))) as f:
+                assert f.read() == u'%i' % i
+        # 8 files, and their directory synced once per batch
+        assert scheduler.syncs < 16
+        assert scheduler.batches < 16
+
+        # the same file is synced once
+        path = os.path.join(td, '0')
+        with stdlib_io.open(path, 'a') as f1, stdlib_io.open(path, 'a') as f2:
+            batch = [_FsyncRequest('file', f1.fileno()), _FsyncRequest('file', f2.fileno())]
+            syncs = scheduler.syncs
+            scheduler._sync_batch(batch)
+        assert scheduler.syncs == syncs + 1
+        assert all(request.done.is_set() for request in batch)
+
+
+def test_fsync_scheduler_error():
+    scheduler = FsyncScheduler()
+    with TemporaryDirectory() as td:
+        error = OSError(errno.EIO, 'I/O error')
+        with mock.patch.object(fileio.os, 'fsync', side_effect=error):
+            with pytest.raises(OSError) as excinfo:
+                with replace_writing(os.path.join(td, 'a'), syncer=scheduler) as f:
+                    f.write(u'a')
+        assert excinfo.value.errno == errno.EIO
+        assert os.listdir(td) == []
@@ -1,6 +1,9 @@
-from unittest import TestCase
+import asyncio
+import base64
+import hashlib
+from unittest import TestCase, mock
 from ipython_genutils.tempdir import TemporaryDirectory
-from ..largefilemanager import LargeFileManager
+from ..largefilemanager import AsyncLargeFileManager, LargeFileManager
 import os
 from tornado import web
 
@@ -111,3 +114,139 @@ class TestLargeFileManager(TestCase):
         self.assertIn('path', model)
         self.assertEqual(model['name'], 'Untitled.ipynb')
         self.assertEqual(model['path'], 'foo/Untitled.ipynb')
+
+    def upload(self, path, upload_id, data, offset, size, **kwargs):
+        model = {
+            'type': 'file',
+            'format': 'base64',
+            'content': base64.b64encode(data[offset:offset + kwargs.pop('length', 4)]).decode('ascii'),
+            'upload_id': upload_id,
+            'upload_size': size,
+            'offset': offset,
+        }
+        model.update(kwargs)
+        return self.contents_manager.save(model, path)
+
+    def test_resumable_upload(self):
+        cm = self.contents_manager
+        cm.save({'type': 'file', 'format': 'text', 'content': u'old'}, 'up.bin')
+        data = os.urandom(10)
+
+        # out of order
+        model = self.upload('up.bin', 'abc', data, 8, 10)
+        self.assertEqual(model['upload']['missing'], [[0, 8]])
+        self.assertFalse(model['upload']['complete'])
+        model = self.upload('up.bin', 'abc', data, 0, 10)
+        self.assertEqual(model['upload']['missing'], [[4, 8]])
+        self.assertEqual(model['upload']['received'], 6)
+        # the file is only replaced once complete
+        self.assertEqual(cm.get('up.bin')['content'], u'old')
+        self.assertNotIn('.~upload-abc-up.bin', [m['name'] for m in cm.get('')['content']])
+
+        # resume: an empty chunk returns the status
+        model = self.upload('up.bin', 'abc', data, 0, 10, length=0)
+        self.assertEqual(model['upload']['missing'], [[4, 8]])
+
+        model = self.upload('up.bin', 'abc', data, 4, 10)
+        self.assertTrue(model['upload']['complete'])
+        self.assertEqual(model['size'], 10)
+        with open(os.path.join(self.td, 'up.bin'), 'rb') as f:
+            self.assertEqual(f.read(), data)
+        self.assertEqual(os.listdir(self.td), ['up.bin'])
+
+        # chunks arriving after completion are ignored
+        model = self.upload('up.bin', 'abc', data, 4, 10)
+        self.assertEqual(model['upload']['missing'], [])
+
+    def test_upload_checksum(self):
+        data = b'0123456789'
+        with self.assertRaises(web.HTTPError) as r:
+            self.upload('c.bin', 'c', data, 0, 10, checksum='sha256:' + '0' * 64)
+        self.assertEqual(r.exception.status_code, 400)
+        with self.assertRaises(web.HTTPError) as r:
+            self.upload('c.bin', 'c', data, 0, 10, checksum='nope:0')
+        self.assertEqual(r.exception.status_code, 400)
+        model = self.upload(
+            'c.bin', 'c', data, 0, 10, length=10,
+            checksum='sha256:' + hashlib.sha256(data).hexdigest(),
+        )
+        self.assertTrue(model['upload']['complete'])
+
+    def test_upload_errors(self):
+        data = b'0123456789'
+        for kwargs in [
+            dict(upload_id='../x'),
+            dict(offset=-1),
+            dict(upload_size='10'),
+            dict(offset=8),  # past the end
+            dict(type='notebook'),
+        ]:
+            args = dict(path='e.bin', upload_id='e', data=data, offset=0, size=6)
+            args.update(kwargs)
+            with self.assertRaises(web.HTTPError) as r:
+                self.upload(**args)
+            self.assertEqual(r.exception.status_code, 400, kwargs)
+
+        self.upload('e.bin', 'e', data, 0, 10)
+        with self.assertRaises(web.HTTPError) as r:
+            self.upload('other.bin', 'e', data, 0, 10)
+        self.assertEqual(r.exception.status_code, 409)
+
+    def test_upload_expired(self):
+        cm = self.contents_manager
+        self.upload('x.bin', 'x', b'0123456789', 0, 10)
+        self.assertEqual(len(os.listdir(self.td)), 1)
+        cm.upload_timeout = 0
+        self.upload('y.bin', 'y', b'0123456789', 0, 10)
+        self.assertEqual(os.listdir(self.td), ['.~upload-y-y.bin'])
+
+    def test_upload_expired_while_writing(self):
+        cm = self.contents_manager
+        data = b'0123456789'
+        self.upload('z.bin', 'z', data, 0, 10)
+        session = cm._uploads['z']
+        cm.upload_timeout = 0
+        cm._expire_uploads()
+        self.assertTrue(session.expired)
+        self.assertIsNone(session.fd)
+        # a chunk which got the session before it expired
+        with mock.patch.object(cm, '_get_upload', return_value=session):
+            with self.assertRaises(web.HTTPError) as r:
+                self.upload('z.bin', 'z', data, 4, 10)
+        self.assertEqual(r.exception.status_code, 410)
+        self.assertEqual(os.listdir(self.td), [])
+
+
+class TestAsyncLargeFileManager(TestCase):
+
+    def setUp(self):
+        self._temp_dir = TemporaryDirectory()
+        self.td = self._temp_dir.name
+        self.contents_manager = AsyncLargeFileManager(root_dir=self.td, max_workers=4)
+
+    def tearDown(self):
+        self._temp_dir.cleanup()
+
+    def test_parallel_upload(self):
+        cm = self.contents_manager
+        data = os.urandom(64 * 1024)
+        chunk_size = 4096
+
+        def send(offset):
+            return cm.save({
+                'type': 'file',
+                'format': 'base64',
+                'content': base64.b64encode(data[offset:offset + chunk_size]).decode('ascii'),
+                'upload_id': 'parallel',
+                'upload_size': len(data),
+                'offset': offset,
+            }, 'parallel.bin')
+
+        async def upload():
+            offsets = list(range(0, len(data), chunk_size))[::-1]
+            return await asyncio.gather(*[send(offset) for offset in offsets])
+
+        models = asyncio.get_event_loop().run_until_complete(upload())
+        self.assertTrue(any(m['upload']['complete'] for m in models))
+        with open(os.path.join(self.td, 'parallel.bin'), 'rb') as f:
+            self.assertEqual(f.read(), data)
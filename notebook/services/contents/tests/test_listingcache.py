@@ -0,0 +1,180 @@
+"""Tests for the directory listing cache."""
+
+import os
+from unittest import TestCase, skipUnless
+
+from ipython_genutils.tempdir import TemporaryDirectory
+
+from ..filemanager import FileContentsManager
+from ..listingcache import DirectoryListingCache, InotifyWatcher
+
+try:
+    InotifyWatcher().close()
+except OSError:
+    have_inotify = False
+else:
+    have_inotify = True
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+def touch(path, text=''):
+    with open(path, 'w') as f:
+        f.write(text)
+
+
+class TestDirectoryListingCache(TestCase):
+
+    def setUp(self):
+        td = TemporaryDirectory()
+        self.td = td.__enter__()
+        self.addCleanup(td.__exit__, None, None, None)
+        self.builds = 0
+
+    def make_cache(self, **kwargs):
+        cache = DirectoryListingCache(**kwargs)
+        self.addCleanup(cache.close)
+        return cache
+
+    def listing(self, cache, os_dir):
+        def build():
+            self.builds += 1
+            return [{'name': name} for name in sorted(os.listdir(os_dir))]
+        return [child['name'] for child in cache.get(os_dir, build)]
+
+    def test_polling(self):
+        clock = FakeClock()
+        cache = self.make_cache(use_inotify=False, poll_interval=10, clock=clock)
+        touch(os.path.join(self.td, 'a'))
+        self.assertEqual(self.listing(cache, self.td), ['a'])
+        self.assertEqual(self.listing(cache, self.td), ['a'])
+        self.assertEqual(self.builds, 1)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+        # adding or removing entries changes the mtime of the directory
+        os.utime(self.td, ns=(0, 0))
+        self.assertEqual(self.listing(cache, self.td), ['a'])
+        self.assertEqual(self.builds, 2)
+
+        # other changes are picked up once the listing expires
+        clock.now = 10
+        self.listing(cache, self.td)
+        self.assertEqual(self.builds, 3)
+
+    @skipUnless(have_inotify, "requires inotify")
+    def test_inotify(self):
+        cache = self.make_cache(poll_interval=0)
+        sub = os.path.join(self.td, 'sub')
+        os.mkdir(sub)
+        self.assertEqual(self.listing(cache, self.td), ['sub'])
+        self.assertEqual(self.listing(cache, sub), [])
+        # watched listings don't expire
+        self.assertEqual(self.listing(cache, self.td), ['sub'])
+        self.assertEqual(self.builds, 2)
+
+        touch(os.path.join(sub, 'a'))
+        self.assertEqual(self.listing(cache, sub), ['a'])
+        self.assertEqual(self.listing(cache, self.td), ['sub'])
+        self.assertEqual(self.builds, 3)
+
+        with open(os.path.join(sub, 'a'), 'a') as f:
+            f.write('more')
+        self.listing(cache, sub)
+        self.assertEqual(self.builds, 4)
+
+        os.rename(sub, os.path.join(self.td, 'moved'))
+        self.assertEqual(self.listing(cache, self.td), ['moved'])
+        self.assertEqual(self.builds, 5)
+
+    def test_lru(self):
+        cache = self.make_cache(max_entries=2, use_inotify=False, poll_interval=60)
+        dirs = []
+        for name in 'abc':
+            os_dir = os.path.join(self.td, name)
+            os.mkdir(os_dir)
+            dirs.append(os_dir)
+        self.listing(cache, dirs[0])
+        self.listing(cache, dirs[1])
+        self.listing(cache, dirs[0])
+        self.listing(cache, dirs[2])
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(self.builds, 3)
+        # b was the least recently used
+        self.listing(cache, dirs[0])
+        self.assertEqual(self.builds, 3)
+        self.listing(cache, dirs[1])
+        self.assertEqual(self.builds, 4)
+
+    def test_invalidate(self):
+        cache = self.make_cache(use_inotify=False, poll_interval=60)
+        sub = os.path.join(self.td, 'sub')
+        subsub = os.path.join(sub, 'sub')
+        os.makedirs(subsub)
+        for os_dir in (self.td, sub, subsub):
+            self.listing(cache, os_dir)
+        cache.invalidate(os.path.join(subsub, 'file'))
+        self.assertEqual(len(cache), 2)
+        cache.invalidate(sub, recursive=True)
+        self.assertEqual(len(cache), 0)
+
+
+class TestFileContentsManagerListingCache(TestCase):
+
+    def setUp(self):
+        td = TemporaryDirectory()
+        self.td = td.__enter__()
+        self.addCleanup(td.__exit__, None, None, None)
+        self.cm = FileContentsManager(
+            root_dir=self.td,
+            listing_cache_size=10,
+            listing_cache_use_inotify=False,
+            listing_cache_poll_interval=3600,
+        )
+
+    def sizes(self, path=''):
+        return {
+            child['name']: child['size']
+            for child in self.cm.get(path)['content']
+        }
+
+    def test_save_invalidates(self):
+        cm = self.cm
+        cm.save({'type': 'file', 'format': 'text', 'content': 'x'}, 'a.txt')
+        self.assertEqual(self.sizes(), {'a.txt': 1})
+        self.assertEqual(self.sizes(), {'a.txt': 1})
+        self.assertEqual(cm.listing_cache.hits, 1)
+
+        # same entries, only the size of the file changes in place
+        cm.use_atomic_writing = False
+        cm.save({'type': 'file', 'format': 'text', 'content': 'xyz'}, 'a.txt')
+        self.assertEqual(self.sizes(), {'a.txt': 3})
+
+    def test_rename_delete_invalidate(self):
+        cm = self.cm
+        cm.save({'type': 'directory'}, 'sub')
+        cm.save({'type': 'file', 'format': 'text', 'content': 'x'}, 'sub/a.txt')
+        self.assertEqual(self.sizes('sub'), {'a.txt': 1})
+        self.assertEqual(self.sizes(), {'sub': None})
+
+        cm.rename_file('sub/a.txt', 'a.txt')
+        self.assertEqual(self.sizes('sub'), {})
+        self.assertEqual(self.sizes(), {'sub': None, 'a.txt': 1})
+
+        cm.delete_file('a.txt')
+        self.assertEqual(self.sizes(), {'sub': None})
+
+    def test_listing_copies(self):
+        self.cm.save({'type': 'file', 'format': 'text', 'content': 'x'}, 'a.txt')
+        self.cm.get('')['content'][0]['name'] = 'changed'
+        self.assertEqual(list(self.sizes()), ['a.txt'])
+
+    def test_disabled(self):
+        self.cm.listing_cache_size = 0
+        self.assertIsNone(self.cm.listing_cache)
+        self.assertEqual(self.sizes(), {})
@@ -1,13 +1,15 @@
 """Tests for the notebook manager."""
 
+import asyncio
 import os
 import sys
+import threading
 import time
 from contextlib import contextmanager
 from itertools import combinations
 
 from tornado.web import HTTPError
-from unittest import TestCase, skipIf
+from unittest import TestCase, skipIf, mock
 from tempfile import NamedTemporaryFile
 
 from nbformat import v4 as nbformat
@@ -15,7 +17,8 @@ from nbformat import v4 as nbformat
 from ipython_genutils.tempdir import TemporaryDirectory
 from traitlets import TraitError
 
-from ..filemanager import FileContentsManager
+from ..filemanager import AsyncFileContentsManager, FileContentsManager
+from ..manager import ContentsManager
 
 
 def _make_dir(contents_manager, api_path):
@@ -29,6 +32,12 @@ def _make_dir(contents_manager, api_path):
         print("Directory already exists: %r" % os_path)
 
 
+def _read_async_chunks(chunks):
+    async def read():
+        return [chunk async for chunk in chunks]
+    return asyncio.get_event_loop().run_until_complete(read())
+
+
 class TestFileContentsManager(TestCase):
 
     @contextmanager
@@ -123,6 +132,11 @@ class TestFileContentsManager(TestCase):
             self.assertEqual(contents['untitled.txt'], file_model)
             # broken symlinks should still be shown in the contents manager
             self.assertTrue('bad symlink' in contents)
+            # as by get, which has no content for them
+            symlink_path = '%s/%s' % (path, 'bad symlink')
+            self.assertEqual(contents['bad symlink'], cm.get(symlink_path, content=False))
+            with self.assertRaisesHTTPError(404):
+                cm.get(symlink_path)
 
     @skipIf(sys.platform == 'win32', "will not run on windows")
     def test_recursive_symlink(self):
@@ -164,6 +178,84 @@ class TestFileContentsManager(TestCase):
             )
 
 
+    def test_dir_listing(self):
+        with TemporaryDirectory() as td:
+            cm = FileContentsManager(root_dir=td)
+            parent = 'test listing'
+            _make_dir(cm, parent)
+            _make_dir(cm, parent + '/subdir')
+            cm.new(path=parent + '/a.ipynb')
+            cm.new(path=parent + '/b.txt')
+            cm.new(path=parent + '/c.png')
+            if sys.platform != 'win32':
+                self.symlink(cm, parent + '/subdir', parent + '/linked dir')
+
+            names = sorted(
+                name for name in os.listdir(cm._get_os_path(parent))
+                if not name.startswith('.')
+            )
+            expected = [cm.get('%s/%s' % (parent, name), content=False) for name in names]
+            model = cm.get(parent)
+            self.assertEqual(
+                sorted(model['content'], key=lambda x: x['name']),
+                expected,
+            )
+
+    def test_dir_listing_stat_calls(self):
+        """Listing a directory does not stat its entries again through os.*"""
+        with TemporaryDirectory() as td:
+            cm = FileContentsManager(root_dir=td)
+            for i in range(50):
+                cm.new(path='file%i.txt' % i)
+
+            with mock.patch('os.lstat', wraps=os.lstat) as lstat, \
+                    mock.patch('os.stat', wraps=os.stat) as stat:
+                model = cm.get('')
+            self.assertEqual(len(model['content']), 50)
+            self.assertLess(lstat.call_count + stat.call_count, 10)
+
+    def test_read_file_chunks(self):
+        with TemporaryDirectory() as td:
+            cm = FileContentsManager(root_dir=td, stream_chunk_size=4)
+            cm.save({'type': 'file', 'format': 'text', 'content': u'abcdefghij'}, 'a.txt')
+            for args, expected in [
+                ((), [b'abcd', b'efgh', b'ij']),
+                ((3,), [b'defg', b'hij']),
+                ((3, 5), [b'de']),
+                ((20,), []),
+            ]:
+                self.assertEqual(list(cm.read_file_chunks('a.txt', *args)), expected)
+                # the generic implementation, reading the model
+                self.assertEqual(_read_async_chunks(ContentsManager.read_file_chunks(cm, 'a.txt', *args)), expected)
+            with self.assertRaisesHTTPError(404):
+                cm.read_file_chunks('missing.txt')
+
+    def test_dir_page(self):
+        with TemporaryDirectory() as td:
+            cm = FileContentsManager(root_dir=td)
+            _make_dir(cm, 'sub')
+            for i in range(10):
+                cm.new(path='file%i.txt' % i)
+                cm.new(path='nb%i.ipynb' % i)
+
+            for kwargs in [
+                dict(limit=5),
+                dict(limit=5, offset=18),
+                dict(limit=3, cursor='file5.txt'),
+                dict(sort='size', reverse=True, limit=4),
+                dict(sort='last_modified', filter_type='notebook', limit=4),
+                dict(filter_type='directory'),
+            ]:
+                # the scandir implementation matches the generic one
+                model = cm.get_directory_page('', **kwargs)
+                expected = ContentsManager.get_directory_page(cm, '', **kwargs)
+                self.assertEqual(model, expected)
+
+            with mock.patch.object(cm, '_dir_entry_model', wraps=cm._dir_entry_model) as entry_model:
+                model = cm.get_directory_page('', limit=5)
+            self.assertEqual(entry_model.call_count, 5)
+            self.assertEqual(model['next_cursor'], 'file4.txt')
+
     @skipIf(hasattr(os, 'getuid') and os.getuid() == 0, "Can't test permissions as root")
     @skipIf(sys.platform.startswith('win'), "Can't test permissions on Windows")
     def test_403(self):
@@ -506,6 +598,65 @@ class TestContentsManager(TestCase):
         self.assertEqual(model['name'], 'Untitled.ipynb')
         self.assertEqual(model['path'], 'foo/Untitled.ipynb')
 
+    def test_patch_notebook(self):
+        cm = self.contents_manager
+        nb, name, path = self.new_notebook()
+        cm.trust_notebook(path)
+        model = cm.patch_notebook(path, [
+            {'op': 'insert', 'index': 0, 'cell': nbformat.new_markdown_cell('a')},
+            {'op': 'metadata', 'index': 1, 'metadata': {'collapsed': True}},
+        ])
+        self.assertIsNone(model['content'])
+        self.assertNotIn('message', model)
+        nb = cm.get(path)['content']
+        self.assertEqual([cell.cell_type for cell in nb.cells], ['markdown', 'code'])
+        self.assertEqual(nb.cells[1].metadata, {'collapsed': True, 'trusted': True})
+
+        # replacing the trusted output with an untrusted one
+        cell = nbformat.new_code_cell("print('hi')", outputs=[
+            nbformat.new_output("display_data", {'text/html': '<b>hi</b>'}),
+        ])
+        cm.patch_notebook(path, [{'op': 'replace', 'index': 1, 'cell': cell}])
+        nb = cm.get(path)['content']
+        self.assertFalse(nb.cells[1].metadata.trusted)
+
+        # invalid changes are saved, with a validation message
+        model = cm.patch_notebook(path, [
+            {'op': 'insert', 'index': 2, 'cell': {
+                'cell_type': 'raw', 'metadata': {}, 'source': '', 'bad': 1,
+            }},
+        ])
+        self.assertIn('message', model)
+        self.assertIn('message', cm.get(path))
+
+        for operations in (
+            {},
+            [{'op': 'move'}],
+            [{'op': 'delete', 'index': 3}],
+            [{'op': 'insert', 'index': True, 'cell': cell}],
+            [{'op': 'replace', 'index': 0}],
+            [{'op': 'metadata'}],
+        ):
+            with self.assertRaisesHTTPError(400):
+                cm.patch_notebook(path, operations)
+        with self.assertRaisesHTTPError(404):
+            cm.patch_notebook('missing.ipynb', [])
+
+    def test_patch_notebook_last_modified(self):
+        cm = self.contents_manager
+        nb, name, path = self.new_notebook()
+        last_modified = cm.get(path, content=False)['last_modified']
+        cm.patch_notebook(path, [{'op': 'delete', 'index': 0}], last_modified)
+        with self.assertRaisesHTTPError(409):
+            cm.patch_notebook(path, [], last_modified.isoformat())
+        with self.assertRaisesHTTPError(400):
+            cm.patch_notebook(path, [], 'yesterday')
+
+        # compared to the millisecond, as given by JavaScript
+        last_modified = cm.get(path, content=False)['last_modified']
+        js_time = last_modified.strftime('%Y-%m-%dT%H:%M:%S.') + '%03dZ' % (last_modified.microsecond // 1000)
+        cm.patch_notebook(path, [], js_time)
+
     def test_delete(self):
         cm = self.contents_manager
         # Create a notebook
@@ -656,3 +807,89 @@ class TestContentsManagerNoAtomic(TestContentsManager):
             root_dir = self.td,
         )
         self.contents_manager.use_atomic_writing = False
+
+
+class TestAsyncFileContentsManager(TestCase):
+
+    def setUp(self):
+        self._temp_dir = TemporaryDirectory()
+        self.td = self._temp_dir.name
+        self.contents_manager = AsyncFileContentsManager(
+            root_dir=self.td, max_workers=2,
+        )
+
+    def tearDown(self):
+        self._temp_dir.cleanup()
+
+    def run_async(self, awaitable):
+        return asyncio.get_event_loop().run_until_complete(awaitable)
+
+    def test_runs_on_pool(self):
+        cm = self.contents_manager
+        threads = []
+        list_dir = cm._list_dir
+
+        def record_thread(*args):
+            threads.append(threading.current_thread().name)
+            return list_dir(*args)
+
+        with mock.patch.object(cm, '_list_dir', record_thread):
+            awaitable = cm.get('')
+            self.assertTrue(asyncio.isfuture(awaitable))
+            model = self.run_async(awaitable)
+        self.assertEqual(model['content'], [])
+        self.assertEqual(len(threads), 1)
+        self.assertTrue(threads[0].startswith('contents'))
+
+    def test_new_and_trust(self):
+        cm = self.contents_manager
+        # new saves and gets the notebook from the pool
+        model = self.run_async(cm.new_untitled(type='notebook'))
+        path = model['path']
+        self.run_async(cm.trust_notebook(path))
+        nb = self.run_async(cm.get(path))['content']
+        # the notary can only be used from its thread
+        self.assertTrue(self.run_async(
+            cm.run_in_notary_thread(lambda: cm.notary.check_signature(nb))
+        ))
+
+        self.run_async(cm.rename(path, 'renamed.ipynb'))
+        self.run_async(cm.delete('renamed.ipynb'))
+        listing = self.run_async(cm.get(''))
+        self.assertEqual(listing['content'], [])
+
+    def test_read_file_chunks(self):
+        cm = self.contents_manager
+        cm.stream_chunk_size = 3
+        with open(os.path.join(self.td, 'data.bin'), 'wb') as f:
+            f.write(b'0123456789')
+
+        async def read(*args):
+            return [chunk async for chunk in cm.read_file_chunks('data.bin', *args)]
+
+        self.assertEqual(self.run_async(read()), [b'012', b'345', b'678', b'9'])
+        self.assertEqual(self.run_async(read(2, 7)), [b'234', b'56'])
+        # the generic implementation awaits the model
+        chunks = ContentsManager.read_file_chunks(cm, 'data.bin', 2, 7)
+        self.assertEqual(_read_async_chunks(chunks), [b'234', b'56'])
+
+    def test_max_workers(self):
+        with self.assertRaises(TraitError):
+            self.contents_manager.max_workers = 0
+
+    def test_fsync_batching(self):
+        # only by default for the concurrent saves of the pool
+        self.assertTrue(self.contents_manager.fsync_batching)
+        self.assertFalse(FileContentsManager(root_dir=self.td).fsync_batching)
+
+    def test_shutdown_executors(self):
+        cm = self.contents_manager
+        self.run_async(cm.get(''))
+        executor = cm.executor
+        cm.shutdown_executors()
+        self.assertIsNone(cm._executor)
+        with self.assertRaises(RuntimeError):
+            executor.submit(print)
+        # started again when needed
+        self.assertEqual(self.run_async(cm.get(''))['content'], [])
+        cm.shutdown_executors()
@@ -0,0 +1,136 @@
+"""Tests for the parsed notebook cache."""
+
+import os
+from unittest import TestCase
+
+from ipython_genutils.tempdir import TemporaryDirectory
+from nbformat import v4 as nbformat
+
+from ..filemanager import FileContentsManager
+from ..notebookcache import NotebookCache, copy_node
+
+
+class TestNotebookCache(TestCase):
+
+    def test_copy_node(self):
+        nb = nbformat.new_notebook(cells=[nbformat.new_code_cell('1')])
+        copy = copy_node(nb)
+        self.assertEqual(copy, nb)
+        self.assertIs(type(copy.cells[0]), type(nb.cells[0]))
+        copy.cells[0].metadata['x'] = 1
+        self.assertEqual(nb.cells[0].metadata, {})
+
+    def test_lru_bytes(self):
+        cache = NotebookCache(max_bytes=10)
+        cache.put('a', (1, 1, 4), {'a': 1})
+        cache.put('b', (2, 1, 4), {'b': 1})
+        self.assertEqual(cache.get('a', (1, 1, 4)), ({'a': 1}, None, None))
+        cache.put('c', (3, 1, 4), {'c': 1})
+        # b was the least recently used
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.nbytes, 8)
+        self.assertIsNone(cache.get('b', (2, 1, 4)))
+        # too large to be cached
+        cache.put('d', (4, 1, 11), {'d': 1})
+        self.assertIsNone(cache.get('d', (4, 1, 11)))
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+
+    def test_key_mismatch(self):
+        cache = NotebookCache(max_bytes=10)
+        cache.put('a', (1, 1, 4), {'a': 1}, 'invalid', 'signature')
+        self.assertIsNone(cache.get('a', (1, 2, 4)))
+        self.assertEqual(cache.get('a', (1, 1, 4)), ({'a': 1}, 'invalid', 'signature'))
+        cache.invalidate('a')
+        self.assertEqual((len(cache), cache.nbytes), (0, 0))
+
+
+class TestFileContentsManagerNotebookCache(TestCase):
+
+    def setUp(self):
+        td = TemporaryDirectory()
+        self.td = td.__enter__()
+        self.addCleanup(td.__exit__, None, None, None)
+        self.cm = FileContentsManager(
+            root_dir=self.td, notebook_cache_max_bytes=1 << 20,
+        )
+        nb = nbformat.new_notebook(cells=[
+            nbformat.new_code_cell('1', outputs=[
+                nbformat.new_output('display_data', {'text/html': '<b>x</b>'}),
+            ]),
+        ])
+        self.cm.save({'type': 'notebook', 'content': nb}, 'a.ipynb')
+
+    def test_hit_returns_copy(self):
+        cm = self.cm
+        model = cm.get('a.ipynb')
+        model['content'].cells.append(nbformat.new_markdown_cell('x'))
+        model = cm.get('a.ipynb')
+        self.assertEqual(len(model['content'].cells), 1)
+        self.assertEqual((cm.notebook_cache.hits, cm.notebook_cache.misses), (1, 1))
+
+    def test_modified_on_disk(self):
+        cm = self.cm
+        cm.get('a.ipynb')
+        os_path = cm._get_os_path('a.ipynb')
+        nb = nbformat.new_notebook()
+        with open(os_path, 'w') as f:
+            f.write(nbformat.writes(nb))
+        self.assertEqual(cm.get('a.ipynb')['content'].cells, [])
+
+    def test_trust_invalidates(self):
+        cm = self.cm
+        nb = cm.get('a.ipynb')['content']
+        self.assertFalse(nb.cells[0].metadata.get('trusted'))
+        cm.trust_notebook('a.ipynb')
+        nb = cm.get('a.ipynb')['content']
+        self.assertTrue(nb.cells[0].metadata.get('trusted'))
+
+    def test_trusted_elsewhere(self):
+        # e.g. with `jupyter trust`, which doesn't change the file
+        cm = self.cm
+        nb = cm.get('a.ipynb')['content']
+        self.assertFalse(nb.cells[0].metadata.get('trusted'))
+        with open(cm._get_os_path('a.ipynb')) as f:
+            cm.notary.sign(nbformat.reads(f.read()))
+        nb = cm.get('a.ipynb')['content']
+        self.assertTrue(nb.cells[0].metadata.get('trusted'))
+        self.assertEqual(cm.notebook_cache.hits, 1)
+
+    def test_invalid_message_cached(self):
+        cm = self.cm
+        os_path = cm._get_os_path('a.ipynb')
+        with open(os_path, 'w') as f:
+            f.write('{"nbformat": 4, "nbformat_minor": 4, "metadata": {}, '
+                    '"cells": [{"cell_type": "markdown", "metadata": {}, '
+                    '"source": "", "bad": 1}]}')
+        first = cm.get('a.ipynb')
+        second = cm.get('a.ipynb')
+        self.assertIn('message', first)
+        self.assertEqual(first['message'], second['message'])
+        self.assertEqual(cm.notebook_cache.hits, 1)
+
+    def test_patch_notebook(self):
+        cm = self.cm
+        cm.trust_notebook('a.ipynb')
+        cm.patch_notebook('a.ipynb', [
+            {'op': 'insert', 'index': 1, 'cell': nbformat.new_markdown_cell('x')},
+        ])
+        cached = cm.get('a.ipynb')
+        self.assertEqual(cm.notebook_cache.hits, 1)
+        cm.notebook_cache.clear()
+        self.assertEqual(cached, cm.get('a.ipynb'))
+
+    def test_rename_delete(self):
+        cm = self.cm
+        cm.get('a.ipynb')
+        self.assertEqual(len(cm.notebook_cache), 1)
+        cm.rename_file('a.ipynb', 'b.ipynb')
+        self.assertEqual(len(cm.notebook_cache), 0)
+        cm.get('b.ipynb')
+        cm.delete_file('b.ipynb')
+        self.assertEqual(len(cm.notebook_cache), 0)
+
+    def test_disabled(self):
+        self.cm.notebook_cache_max_bytes = 0
+        self.assertIsNone(self.cm.notebook_cache)
+        self.cm.get('a.ipynb')
@@ -0,0 +1,129 @@
+"""Tests for the checkpoints in a content-addressed store."""
+
+import io
+import os
+from unittest import TestCase
+
+from ipython_genutils.tempdir import TemporaryDirectory
+from tornado.web import HTTPError
+
+from ..filemanager import FileContentsManager
+from ..objectcheckpoints import ObjectStoreCheckpoints, iter_chunks
+
+
+def lines(start, stop):
+    return b''.join(b'line %i of the file\n' % i for i in range(start, stop))
+
+
+class TestIterChunks(TestCase):
+
+    def test_chunks(self):
+        data = lines(0, 5000) + b'x' * 1000
+        chunks = list(iter_chunks(io.BytesIO(data), 256))
+        self.assertEqual(b''.join(chunks), data)
+        self.assertTrue(all(len(chunk) <= 512 for chunk in chunks))
+        self.assertTrue(all(len(chunk) >= 128 for chunk in chunks[:-1]))
+
+    def test_content_defined(self):
+        data = lines(0, 5000)
+        chunks = set(iter_chunks(io.BytesIO(data), 256))
+        inserted = list(iter_chunks(io.BytesIO(b'inserted\n' + data), 256))
+        # only the chunks around the insertion change
+        self.assertLess(len(set(inserted) - chunks), 5)
+
+
+class TestObjectStoreCheckpoints(TestCase):
+
+    def setUp(self):
+        td = TemporaryDirectory()
+        self.td = td.__enter__()
+        self.addCleanup(td.__exit__, None, None, None)
+        self.cm = FileContentsManager(root_dir=self.td)
+        self.cm.checkpoints = self.checkpoints = ObjectStoreCheckpoints(
+            parent=self.cm, chunk_size=256, max_checkpoints=3,
+        )
+
+    def write(self, path, content):
+        self.cm.save({'type': 'file', 'format': 'text', 'content': content}, path)
+
+    def read(self, path):
+        return self.cm.get(path)['content']
+
+    def objects(self):
+        objects_dir = os.path.join(self.checkpoints.store_dir, 'objects')
+        return sum(len(files) for _, _, files in os.walk(objects_dir))
+
+    def test_create_restore(self):
+        cm = self.cm
+        self.write('a.txt', lines(0, 1000).decode())
+        cp1 = cm.create_checkpoint('a.txt')
+        self.write('a.txt', lines(0, 1001).decode())
+        cp2 = cm.create_checkpoint('a.txt')
+        self.assertEqual([cp['id'] for cp in cm.list_checkpoints('a.txt')], ['1', '2'])
+        self.assertEqual(cm.create_checkpoint('a.txt')['id'], '2')
+
+        cm.restore_checkpoint(cp1['id'], 'a.txt')
+        self.assertEqual(self.read('a.txt'), lines(0, 1000).decode())
+        cm.restore_checkpoint(cp2['id'], 'a.txt')
+        self.assertEqual(self.read('a.txt'), lines(0, 1001).decode())
+        with self.assertRaises(HTTPError) as e:
+            cm.restore_checkpoint('3', 'a.txt')
+        self.assertEqual(e.exception.status_code, 404)
+
+    def test_deduplication(self):
+        cm = self.cm
+        self.write('a.txt', lines(0, 1000).decode())
+        cm.create_checkpoint('a.txt')
+        objects = self.objects()
+        self.write('b.txt', lines(0, 1000).decode())
+        cm.create_checkpoint('b.txt')
+        self.assertEqual(self.objects(), objects)
+        self.write('b.txt', 'inserted\n' + lines(0, 1000).decode())
+        cm.create_checkpoint('b.txt')
+        self.assertLess(self.objects(), objects + 5)
+
+    def test_retention_and_gc(self):
+        cm = self.cm
+        checkpoints = self.checkpoints
+        checkpoints.gc_grace_period = 0
+        for i in range(5):
+            self.write('a.txt', lines(i * 1000, (i + 1) * 1000).decode())
+            cm.create_checkpoint('a.txt')
+        self.assertEqual([cp['id'] for cp in cm.list_checkpoints('a.txt')], ['3', '4', '5'])
+        self.assertGreater(checkpoints.gc(), 0)
+        for cp in cm.list_checkpoints('a.txt'):
+            cm.restore_checkpoint(cp['id'], 'a.txt')
+
+        cm.delete('a.txt')
+        self.assertEqual(cm.list_checkpoints('a.txt'), [])
+        checkpoints.gc()
+        self.assertEqual(self.objects(), 0)
+
+    def test_rename(self):
+        cm = self.cm
+        self.write('a.txt', 'a')
+        cp = cm.create_checkpoint('a.txt')
+        cm.rename('a.txt', 'b.txt')
+        self.assertEqual(cm.list_checkpoints('a.txt'), [])
+        self.assertEqual(cm.list_checkpoints('b.txt'), [cp])
+
+        self.write('c.txt', 'c')
+        cm.create_checkpoint('c.txt')
+        self.checkpoints.rename_checkpoint('1', 'c.txt', 'b.txt')
+        self.assertEqual(cm.list_checkpoints('c.txt'), [])
+        cm.restore_checkpoint('1', 'b.txt')
+        self.assertEqual(self.read('b.txt'), 'c')
+
+    def test_corrupt_chunk(self):
+        cm = self.cm
+        self.write('a.txt', 'a')
+        cm.create_checkpoint('a.txt')
+        objects_dir = os.path.join(self.checkpoints.store_dir, 'objects')
+        for dirpath, _, files in os.walk(objects_dir):
+            for name in files:
+                with open(os.path.join(dirpath, name), 'wb') as f:
+                    f.write(b'corrupt')
+        with self.assertRaises(HTTPError) as e:
+            cm.restore_checkpoint('1', 'a.txt')
+        self.assertEqual(e.exception.status_code, 500)
+        self.assertEqual(self.read('a.txt'), 'a')
@@ -0,0 +1,175 @@
+"""Tests for incremental notebook signatures."""
+
+import hashlib
+import os
+from unittest import TestCase
+
+from ipython_genutils.tempdir import TemporaryDirectory
+from nbformat import v4 as nbformat
+from nbformat.sign import NotebookNotary, SQLiteSignatureStore
+
+from ..filemanager import FileContentsManager
+from ..signing import (
+    BatchedSignatureStore, CellDigestCache, IncrementalNotebookNotary,
+)
+
+
+def new_notebook():
+    return nbformat.new_notebook(cells=[
+        nbformat.new_code_cell(str(i), outputs=[
+            nbformat.new_output('display_data', {'text/html': '<b>%i</b>' % i}),
+        ])
+        for i in range(3)
+    ])
+
+
+class TestCellDigestCache(TestCase):
+
+    def test_digest(self):
+        cache = CellDigestCache(max_bytes=1 << 20)
+        cell = nbformat.new_code_cell('1')
+        digest = cache.digest(cell, hashlib.sha256)
+        self.assertEqual(cache.digest(dict(cell), hashlib.sha256), digest)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        self.assertNotEqual(cache.digest(cell, hashlib.sha512), digest)
+
+        # same id, different contents
+        cell.source = '2'
+        self.assertNotEqual(cache.digest(cell, hashlib.sha256), digest)
+        self.assertEqual(len(cache), 1)
+
+    def test_max_bytes(self):
+        cache = CellDigestCache(max_bytes=200)
+        for i in range(10):
+            cache.digest(nbformat.new_code_cell(str(i)), hashlib.sha256)
+        self.assertLessEqual(cache.nbytes, 200)
+        self.assertLess(len(cache), 10)
+
+
+class TestIncrementalNotebookNotary(TestCase):
+
+    def setUp(self):
+        td = TemporaryDirectory()
+        self.td = td.__enter__()
+        self.addCleanup(td.__exit__, None, None, None)
+        self.notary = IncrementalNotebookNotary(
+            db_file=':memory:', secret=b'secret', data_dir=self.td,
+        )
+        self.addCleanup(self.notary.close)
+
+    def test_sign_check(self):
+        notary = self.notary
+        nb = new_notebook()
+        self.assertFalse(notary.check_signature(nb))
+        notary.sign(nb)
+        self.assertTrue(notary.check_signature(nb))
+        misses = notary.cell_cache.misses
+
+        nb.cells[1].outputs[0].data['text/html'] = '<b>changed</b>'
+        self.assertFalse(notary.check_signature(nb))
+        # only the changed cell was hashed again
+        self.assertEqual(notary.cell_cache.misses, misses + 1)
+
+        nb.cells[1].outputs = []
+        nb.metadata['signature'] = 'ignored'
+        notary.sign(nb)
+        del nb.metadata['signature']
+        self.assertTrue(notary.check_signature(nb))
+        notary.unsign(nb)
+        self.assertFalse(notary.check_signature(nb))
+
+    def test_signature_covers_structure(self):
+        notary = self.notary
+        nb = new_notebook()
+        signature = notary.compute_signature(nb)
+        nb.cells.reverse()
+        self.assertNotEqual(notary.compute_signature(nb), signature)
+        nb.cells.reverse()
+        nb.metadata['x'] = 1
+        self.assertNotEqual(notary.compute_signature(nb), signature)
+        # different from whole-notebook signatures
+        del nb.metadata['x']
+        self.assertNotEqual(signature, NotebookNotary.compute_signature(notary, nb))
+
+    def test_whole_signatures(self):
+        notary = self.notary
+        nb = new_notebook()
+        notary.store.store_signature(
+            NotebookNotary.compute_signature(notary, nb), notary.algorithm,
+        )
+        self.assertTrue(notary.check_signature(nb))
+        notary.check_whole_signatures = False
+        self.assertFalse(notary.check_signature(nb))
+
+
+class TestBatchedSignatureStore(TestCase):
+
+    def setUp(self):
+        td = TemporaryDirectory()
+        self.td = td.__enter__()
+        self.addCleanup(td.__exit__, None, None, None)
+        self.db_file = os.path.join(self.td, 'nbsignatures.db')
+
+    def count(self):
+        store = SQLiteSignatureStore(self.db_file)
+        try:
+            (n,) = store.db.execute("SELECT Count(*) FROM nbsignatures").fetchone()
+        finally:
+            store.close()
+        return n
+
+    def test_batched_writes(self):
+        store = BatchedSignatureStore(self.db_file, flush_interval=3600, flush_size=3)
+        store.store_signature('a', 'sha256')
+        store.store_signature('b', 'sha256')
+        self.assertTrue(store.check_signature('a', 'sha256'))
+        self.assertFalse(store.check_signature('c', 'sha256'))
+        self.assertEqual(self.count(), 0)
+
+        store.store_signature('c', 'sha256')
+        self.assertEqual(self.count(), 3)
+        store.store_signature('a', 'sha256')
+        store.remove_signature('b', 'sha256')
+        store.store_signature('d', 'sha256')
+        store.close()
+        self.assertEqual(self.count(), 3)
+
+        store = BatchedSignatureStore(self.db_file)
+        self.addCleanup(store.close)
+        for digest in 'acd':
+            self.assertTrue(store.check_signature(digest, 'sha256'))
+        self.assertFalse(store.check_signature('b', 'sha256'))
+
+
+class TestFileContentsManagerSigning(TestCase):
+
+    def setUp(self):
+        td = TemporaryDirectory()
+        self.td = td.__enter__()
+        self.addCleanup(td.__exit__, None, None, None)
+        self.cm = FileContentsManager(
+            root_dir=self.td, notary_class=IncrementalNotebookNotary,
+        )
+        self.cm.notary = IncrementalNotebookNotary(
+            parent=self.cm, db_file=':memory:', secret=b'secret',
+        )
+
+    def test_trust(self):
+        cm = self.cm
+        cm.save({'type': 'notebook', 'content': new_notebook()}, 'a.ipynb')
+        nb = cm.get('a.ipynb')['content']
+        self.assertFalse(nb.cells[0].metadata.trusted)
+        cm.trust_notebook('a.ipynb')
+        nb = cm.get('a.ipynb')['content']
+        self.assertTrue(nb.cells[0].metadata.trusted)
+
+        cm.patch_notebook('a.ipynb', [
+            {'op': 'delete', 'index': 0},
+        ])
+        nb = cm.get('a.ipynb')['content']
+        self.assertTrue(nb.cells[0].metadata.trusted)
+        cm.flush_signatures()
+
+    def test_default_notary(self):
+        cm = FileContentsManager(root_dir=self.td)
+        self.assertIs(type(cm.notary), NotebookNotary)
@@ -0,0 +1,116 @@
+"""Tests for incremental notebook validation."""
+
+import os
+from unittest import TestCase
+
+from ipython_genutils.tempdir import TemporaryDirectory
+from nbformat import validate, ValidationError
+from nbformat import v4 as nbformat
+
+from ..filemanager import FileContentsManager
+from ..validation import NotebookValidator, fingerprint, validation_message
+
+
+def new_notebook(n=3):
+    return nbformat.new_notebook(cells=[
+        nbformat.new_code_cell(str(i), outputs=[
+            nbformat.new_output('display_data', {'text/html': '<b>%i</b>' % i}),
+        ])
+        for i in range(n)
+    ])
+
+
+class TestNotebookValidator(TestCase):
+
+    def test_fingerprint(self):
+        cell = nbformat.new_code_cell('1')
+        self.assertEqual(fingerprint(cell), fingerprint(dict(cell)))
+        self.assertNotEqual(fingerprint({'a': 1}), fingerprint({'a': True}))
+        self.assertNotEqual(fingerprint([1, 2]), fingerprint([2, 1]))
+        self.assertNotEqual(fingerprint({'a': 1}), fingerprint({'a': 1.0}))
+        self.assertEqual(fingerprint({'a': 1, 'b': 2}), fingerprint({'b': 2, 'a': 1}))
+
+    def test_changed_cells(self):
+        validator = NotebookValidator()
+        nb = new_notebook()
+        self.assertIsNone(validator.validate(nb, 'a.ipynb'))
+        self.assertEqual(validator.cells_checked, 3)
+        self.assertIsNone(validator.validate(nb, 'a.ipynb'))
+        self.assertEqual(validator.cells_checked, 3)
+
+        nb.cells[1].source = 'changed'
+        nb.cells.append(nbformat.new_markdown_cell('new'))
+        self.assertIsNone(validator.validate(nb, 'a.ipynb'))
+        self.assertEqual(validator.cells_checked, 5)
+        # no path, nothing is known
+        self.assertIsNone(validator.validate(nb))
+        self.assertEqual(validator.cells_checked, 9)
+
+    def test_invalid(self):
+        validator = NotebookValidator()
+        nb = new_notebook()
+        validator.validate(nb, 'a.ipynb')
+        nb.cells[2].outputs[0]['bad'] = 1
+        with self.assertRaises(ValidationError) as cm:
+            validate(nb)
+        self.assertEqual(validator.validate(nb, 'a.ipynb'), validation_message(cm.exception))
+
+        # the invalid cell isn't remembered as valid
+        self.assertIsNotNone(validator.validate(nb, 'a.ipynb'))
+        del nb.cells[2].outputs[0]['bad']
+        nb.metadata['kernelspec'] = {}
+        self.assertIsNotNone(validator.validate(nb, 'a.ipynb'))
+
+    def test_duplicate_ids(self):
+        validator = NotebookValidator()
+        nb = new_notebook()
+        nb.cells[1].id = nb.cells[0].id
+        self.assertIsNone(validator.validate(nb, 'a.ipynb'))
+        self.assertEqual(validator.cells_checked, 0)
+
+    def test_workers(self):
+        validator = NotebookValidator(workers=2, parallel_min_cells=2)
+        self.addCleanup(validator.close)
+        nb = new_notebook(5)
+        self.assertIsNone(validator.validate(nb, 'a.ipynb'))
+        nb.cells[0].outputs[0]['bad'] = 1
+        nb.cells[4].source = 'changed'
+        self.assertIsNotNone(validator.validate(nb, 'a.ipynb'))
+
+
+class TestFileContentsManagerValidation(TestCase):
+
+    def setUp(self):
+        td = TemporaryDirectory()
+        self.td = td.__enter__()
+        self.addCleanup(td.__exit__, None, None, None)
+        self.cm = FileContentsManager(root_dir=self.td)
+        self.cm.save({'type': 'notebook', 'content': new_notebook()}, 'a.ipynb')
+
+    def test_save_then_load(self):
+        cm = self.cm
+        checked = cm.notebook_validator.cells_checked
+        nb = cm.get('a.ipynb')['content']
+        self.assertEqual(cm.notebook_validator.cells_checked, checked)
+        nb.cells[0].source = 'changed'
+        cm.save({'type': 'notebook', 'content': nb}, 'a.ipynb')
+        self.assertEqual(cm.notebook_validator.cells_checked, checked + 1)
+
+    def test_validate_unmodified(self):
+        cm = self.cm
+        cm.validate_unmodified_notebooks = False
+        os_path = cm._get_os_path('a.ipynb')
+        with open(os_path) as f:
+            content = f.read()
+        with open(os_path, 'w') as f:
+            f.write(content.replace('"outputs": [', '"bad": 1, "outputs": [', 1))
+
+        model = cm.get('a.ipynb')
+        self.assertIn('message', model)
+        cm.notebook_validator.validate = None
+        self.assertEqual(cm.get('a.ipynb')['message'], model['message'])
+
+        del cm.notebook_validator.validate
+        with open(os_path, 'w') as f:
+            f.write(content + '\n')
+        self.assertNotIn('message', cm.get('a.ipynb'))
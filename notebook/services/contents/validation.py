@@ -0,0 +1,236 @@
+"""Incremental validation of notebooks against the nbformat schema.
+
+Validating a whole notebook with nbformat is slow for notebooks with many
+cells or large outputs. NotebookValidator compiles the schema once, and only
+validates the cells which changed since the last valid version of the same
+notebook. Invalid notebooks are validated again by nbformat, so that their
+error messages are the usual ones.
+"""
+
+# Copyright (c) Jupyter Development Team.
+# Distributed under the terms of the Modified BSD License.
+
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import json
+import multiprocessing
+import threading
+
+from ipython_genutils.importstring import import_item
+from nbformat import validate as validate_nb, ValidationError
+
+try:
+    import fastjsonschema
+except ImportError:
+    fastjsonschema = None
+    from jsonschema import Draft4Validator
+
+try:
+    from nbformat.validator import _get_schema_json
+except ImportError:
+    _get_schema_json = None
+
+_CELL_DEFINITIONS = {
+    'code': 'code_cell',
+    'markdown': 'markdown_cell',
+    'raw': 'raw_cell',
+}
+
+# (version, version_minor, definition) -> is_valid function, or None
+_compiled = {}
+_compiled_lock = threading.Lock()
+
+
+def validation_message(error):
+    """The message added to models of notebooks failing validation"""
+    return u'Notebook validation failed: {}:\n{}'.format(
+        error.message, json.dumps(error.instance, indent=1, default=lambda obj: '<UNKNOWN>'),
+    )
+
+
+def compile_schema(version, version_minor, definition=None):
+    """Compile (once) the nbformat schema of a notebook or of one of its parts
+
+    Returns a function checking whether an instance is valid, or None if
+    the schema is not available, e.g. for notebooks from a newer nbformat.
+    """
+    key = (version, version_minor, definition)
+    with _compiled_lock:
+        if key in _compiled:
+            return _compiled[key]
+        _compiled[key] = is_valid = _compile_schema(version, version_minor, definition)
+    return is_valid
+
+
+def _compile_schema(version, version_minor, definition):
+    if _get_schema_json is None:
+        return None
+    try:
+        v = import_item('nbformat.v%s' % version)
+    except ImportError:
+        return None
+    if getattr(v, 'nbformat_minor', 0) < version_minor:
+        # nbformat validates future notebooks with a relaxed schema
+        return None
+    try:
+        schema = _get_schema_json(v, version=version, version_minor=version_minor)
+    except (AttributeError, KeyError, OSError):
+        return None
+    if definition is not None:
+        definitions = schema.get('definitions', {})
+        if definition not in definitions:
+            return None
+        schema = {
+            '$ref': '#/definitions/%s' % definition,
+            'definitions': definitions,
+        }
+
+    if fastjsonschema is None:
+        return Draft4Validator(schema).is_valid
+    validate = fastjsonschema.compile(schema)
+
+    def is_valid(instance):
+        try:
+            validate(instance)
+        except fastjsonschema.JsonSchemaException:
+            return False
+        return True
+    return is_valid
+
+
+def fingerprint(node):
+    """A digest of a JSON-like structure, identifying a version of a cell
+
+    Computed from its serialization, so that different cells only have the
+    same fingerprint if their digests collide.
+    """
+    data = json.dumps(node, sort_keys=True, separators=(',', ':'), default=repr)
+    return hashlib.sha256(data.encode('utf-8')).digest()
+
+
+def check_cells(cells, version, version_minor):
+    """Whether all the cells are valid, with the compiled schema
+
+    Also run by the processes of the pool of NotebookValidator.
+    """
+    for cell in cells:
+        definition = _CELL_DEFINITIONS.get(cell.get('cell_type'), 'cell')
+        is_valid = compile_schema(version, version_minor, definition)
+        if is_valid is None or not is_valid(cell):
+            return False
+    return True
+
+
+class NotebookValidator(object):
+    """Validates notebooks, only checking the cells which changed
+
+    For each of the last `max_paths` notebooks validated with a path, the
+    fingerprints of their cells are kept, so that the cells which did not
+    change since the last valid version of a notebook aren't checked again.
+
+    Parameters
+    ----------
+    max_paths : int
+        The number of notebooks whose valid cells are remembered.
+    workers : int
+        The number of processes checking cells when a notebook has at
+        least `parallel_min_cells` cells to check. 0 checks all cells
+        in the calling thread.
+    parallel_min_cells : int
+    """
+
+    def __init__(self, max_paths=256, workers=0, parallel_min_cells=256):
+        self.max_paths = max_paths
+        self.workers = workers
+        self.parallel_min_cells = parallel_min_cells
+        self.cells_checked = 0
+        # path -> (version, version_minor, fingerprints of the cells)
+        self._valid_cells = OrderedDict()
+        self._lock = threading.Lock()
+        self._pool = None
+
+    def validate(self, nb, path=None):
+        """Return the validation message of a notebook, or None if valid"""
+        valid_cells = self._check(nb, path)
+        if valid_cells is not None:
+            if path is not None:
+                with self._lock:
+                    self._valid_cells[path] = valid_cells
+                    self._valid_cells.move_to_end(path)
+                    while len(self._valid_cells) > self.max_paths:
+                        self._valid_cells.popitem(last=False)
+            return None
+
+        # invalid, or not supported by the compiled schemas
+        self.forget(path)
+        try:
+            validate_nb(nb)
+        except ValidationError as e:
+            return validation_message(e)
+        return None
+
+    def forget(self, path):
+        with self._lock:
+            self._valid_cells.pop(path, None)
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+            self._pool = None
+
+    def _check(self, nb, path):
+        """Check a notebook with the compiled schemas
+
+        Returns (version, version_minor, fingerprints of the cells) if it
+        is valid, or None if it has to be validated by nbformat.
+        """
+        version = nb.get('nbformat')
+        version_minor = nb.get('nbformat_minor')
+        cells = nb.get('cells')
+        if (not isinstance(version, int) or not isinstance(version_minor, int)
+                or not isinstance(cells, list)):
+            return None
+        is_valid = compile_schema(version, version_minor)
+        if is_valid is None or not is_valid(dict(nb, cells=[])):
+            return None
+        if not all(isinstance(cell, dict) for cell in cells):
+            return None
+        # nbformat repairs duplicate ids
+        cell_ids = [cell['id'] for cell in cells if 'id' in cell]
+        if len(cell_ids) != len(set(cell_ids)):
+            return None
+
+        known = ()
+        if path is not None:
+            with self._lock:
+                entry = self._valid_cells.get(path)
+            if entry is not None and entry[:2] == (version, version_minor):
+                known = entry[2]
+        fingerprints = set()
+        changed = []
+        for cell in cells:
+            fp = fingerprint(cell)
+            fingerprints.add(fp)
+            if fp not in known:
+                changed.append(cell)
+        self.cells_checked += len(changed)
+        if not self._check_cells(changed, version, version_minor):
+            return None
+        return (version, version_minor, fingerprints)
+
+    def _check_cells(self, cells, version, version_minor):
+        if not self.workers or len(cells) < self.parallel_min_cells:
+            return check_cells(cells, version, version_minor)
+        if self._pool is None:
+            # not forked, as the server runs threads
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context('spawn'),
+            )
+        size = -(-len(cells) // self.workers)
+        futures = [
+            self._pool.submit(check_cells, cells[i:i + size], version, version_minor)
+            for i in range(0, len(cells), size)
+        ]
+        return all(future.result() for future in futures)
@@ -0,0 +1,194 @@
+"""ZMQ streams to a kernel, shared by the websockets connected to it."""
+
+# Copyright (c) Jupyter Development Team.
+# Distributed under the terms of the Modified BSD License.
+
+import logging
+
+from jupyter_client.session import Session
+
+
+class ChannelHub(object):
+    """One set of ZMQ streams to a kernel, shared by its websocket handlers
+
+    IOPub messages are sent to all the attached handlers. Messages on the
+    shell, control and stdin channels are sent to the handler which sent
+    messages with the session of their parent header. All the streams use
+    the same identity, so that stdin requests come back to the hub.
+
+    The hub can also send its own requests, whose replies aren't sent to
+    any handler.
+
+    Replies for the session of a handler which was detached, e.g. when its
+    tab was closed or reloaded while other websockets stay connected, are
+    held and sent to the next handler attached with that session. They are
+    dropped when the streams are released, the kernel manager then
+    buffering the messages of the last session only.
+    """
+
+    channel_names = ("iopub", "shell", "control", "stdin")
+    # limits of the replies held for detached sessions
+    max_detached_sessions = 100
+    max_detached_replies = 1000
+
+    def __init__(self, kernel_manager, kernel_id, log=None):
+        self.kernel_manager = kernel_manager
+        self.kernel_id = kernel_id
+        self.log = log or logging.getLogger(__name__)
+        kernel = kernel_manager.get_kernel(kernel_id)
+        self.session = Session(config=kernel.session.config, key=kernel.session.key)
+        self.channels = {}
+        self.handlers = []
+        # whether the IOPub subscription of the streams is established
+        self.iopub_received = False
+        # session id -> handler
+        self._sessions = {}
+        # msg_id of a request of the hub -> callback
+        self._requests = {}
+        self._iopub_callbacks = []
+        # session id of a detached handler -> [(channel, msg_list)]
+        self._detached = {}
+
+    def __repr__(self):
+        return "%s(%s)" % (self.__class__.__name__, self.kernel_id)
+
+    def open(self, channels=None):
+        """Connect the streams, or take over `channels`, if not open already"""
+        if self.channels:
+            if channels:
+                self.log.warning("Closing extra streams to kernel %s", self.kernel_id)
+                for stream in channels.values():
+                    if not stream.closed():
+                        stream.close()
+            return
+        if not channels:
+            channels = {}
+            identity = self.session.bsession
+            try:
+                for channel in self.channel_names:
+                    meth = getattr(self.kernel_manager, "connect_" + channel)
+                    channels[channel] = stream = meth(self.kernel_id, identity=identity)
+                    stream.channel = channel
+            except Exception:
+                for stream in channels.values():
+                    stream.close()
+                raise
+            self.iopub_received = False
+        self.channels = channels
+        for stream in channels.values():
+            stream.on_recv_stream(self._dispatch)
+
+    def release(self):
+        """Stop dispatching messages, and hand the streams over, e.g. for buffering"""
+        channels, self.channels = self.channels, {}
+        for stream in channels.values():
+            if not stream.closed():
+                stream.stop_on_recv()
+        self._requests.clear()
+        self._iopub_callbacks = []
+        self._detached.clear()
+        return channels
+
+    def close(self):
+        for stream in self.release().values():
+            if not stream.closed():
+                stream.close()
+        self.handlers = []
+        self._sessions.clear()
+
+    def attach(self, handler):
+        """Start sending messages to a handler"""
+        if handler not in self.handlers:
+            self.handlers.append(handler)
+        session = handler.session.session
+        if self._sessions.setdefault(session, handler) is not handler:
+            return
+        replies = self._detached.pop(session, None)
+        if replies:
+            self.log.info("Replaying %s replies of kernel %s for session %s",
+                          len(replies), self.kernel_id, session)
+            for channel, msg_list in replies:
+                stream = self.channels.get(channel)
+                if stream is not None:
+                    handler._on_zmq_reply(stream, msg_list)
+
+    def detach(self, handler):
+        """Stop sending messages to a handler"""
+        if handler in self.handlers:
+            self.handlers.remove(handler)
+        for session, other in list(self._sessions.items()):
+            if other is handler:
+                del self._sessions[session]
+                if getattr(handler, 'session_key', None):
+                    # hold its replies, until it connects again
+                    self._detached.pop(session, None)
+                    self._detached[session] = []
+        while len(self._detached) > self.max_detached_sessions:
+            del self._detached[next(iter(self._detached))]
+
+    def send(self, handler, channel, msg):
+        """Send a message of a handler, which gets the replies to it"""
+        stream = self.channels.get(channel)
+        if stream is None or stream.closed():
+            self.log.debug("Dropping %s message to closed kernel %s", channel, self.kernel_id)
+            return
+        session = msg['header'].get('session')
+        if channel != 'iopub' and session is not None:
+            self._sessions[session] = handler
+        handler.session.send(stream, msg)
+
+    def request(self, msg_type, callback, content=None):
+        """Send a request of the hub on the shell channel
+
+        `callback` is called with the deserialized reply. Returns the
+        msg_id of the request, to `forget` it.
+        """
+        msg = self.session.msg(msg_type, content)
+        msg_id = msg['header']['msg_id']
+        self._requests[msg_id] = callback
+        self.session.send(self.channels['shell'], msg)
+        return msg_id
+
+    def forget(self, msg_id):
+        """Ignore the reply to a request of the hub"""
+        self._requests.pop(msg_id, None)
+
+    def add_iopub_callback(self, callback):
+        """Call `callback` with the next IOPub messages, until removed"""
+        self._iopub_callbacks.append(callback)
+
+    def remove_iopub_callback(self, callback):
+        if callback in self._iopub_callbacks:
+            self._iopub_callbacks.remove(callback)
+
+    def _dispatch(self, stream, msg_list):
+        if stream.channel == 'iopub':
+            self.iopub_received = True
+            targets = self._iopub_callbacks + [handler._on_zmq_reply for handler in self.handlers]
+            for target in targets:
+                try:
+                    target(stream, msg_list)
+                except Exception:
+                    self.log.exception("Failed to send IOPub message of kernel %s", self.kernel_id)
+            return
+
+        idents, fed_msg_list = self.session.feed_identities(msg_list)
+        parent = self.session.unpack(fed_msg_list[2]) if len(fed_msg_list) > 2 else {}
+        callback = self._requests.pop(parent.get('msg_id'), None)
+        if callback is not None:
+            try:
+                callback(self.session.deserialize(fed_msg_list))
+            except Exception:
+                self.log.exception("Failed to handle the reply of kernel %s", self.kernel_id)
+            return
+        session = parent.get('session')
+        handler = self._sessions.get(session)
+        if handler is None:
+            replies = self._detached.get(session)
+            if replies is not None and len(replies) < self.max_detached_replies:
+                replies.append((stream.channel, msg_list))
+                return
+            self.log.debug("Dropping %s message of kernel %s for session %s",
+                           stream.channel, self.kernel_id, session)
+            return
+        handler._on_zmq_reply(stream, msg_list)
@@ -8,7 +8,6 @@ Preliminary documentation at https://github.com/ipython/ipython/wiki/IPEP-16%3A-
 
 import json
 import logging
-from textwrap import dedent
 
 from tornado import gen, web
 from tornado.concurrent import Future
@@ -21,6 +20,7 @@ from notebook.utils import maybe_future, url_path_join, url_escape
 
 from ...base.handlers import APIHandler
 from ...base.zmqhandlers import AuthenticatedZMQStreamHandler, deserialize_binary_message
+from .ratelimit import IOPubRateLimiter
 
 class MainKernelHandler(APIHandler):
 
@@ -118,11 +118,23 @@ class ZMQChannelsHandler(AuthenticatedZMQStreamHandler):
     def rate_limit_window(self):
         return self.settings.get('rate_limit_window', 1.0)
 
+    @property
+    def iopub_stream_coalesce_window(self):
+        return self.settings.get('iopub_stream_coalesce_window', 0)
+
+    # flush coalesced stream output once it reaches this many characters
+    stream_coalesce_max_chars = 65536
+
     def __repr__(self):
         return "%s(%s)" % (self.__class__.__name__, getattr(self, 'kernel_id', 'uninitialized'))
 
     def create_stream(self):
         km = self.kernel_manager
+        if getattr(km, 'share_kernel_channels', False):
+            self.hub = km.channel_hub(self.kernel_id)
+            self.hub.open()
+            self.channels = self.hub.channels
+            return
         identity = self.session.bsession
         for channel in ("iopub", "shell", "control", "stdin"):
             meth = getattr(km, "connect_" + channel)
@@ -153,14 +165,24 @@ class ZMQChannelsHandler(AuthenticatedZMQStreamHandler):
             f.set_result(None)
             return f
 
-        # Use a transient shell channel to prevent leaking
-        # shell responses to the front-end.
-        shell_channel = kernel.connect_shell()
+        hub = self.hub
+        if hub is None:
+            # Use a transient shell channel to prevent leaking
+            # shell responses to the front-end.
+            shell_channel = kernel.connect_shell()
+        else:
+            # the replies to the requests of the hub aren't sent to front-ends
+            shell_channel = hub.channels["shell"]
         # The IOPub used by the client, whose subscriptions we are verifying.
         iopub_channel = self.channels["iopub"]
+        # kernel_info_requests sent through the hub
+        requests = []
 
         info_future = Future()
         iopub_future = Future()
+        if hub is not None and hub.iopub_received:
+            # shared with other clients, and subscribed already
+            iopub_future.set_result(None)
         both_done = gen.multi([info_future, iopub_future])
 
         def finish(f=None):
@@ -175,6 +197,11 @@ class ZMQChannelsHandler(AuthenticatedZMQStreamHandler):
         def cleanup(f=None):
             """Common cleanup"""
             loop.remove_timeout(nudge_handle)
+            if hub is not None:
+                hub.remove_iopub_callback(on_iopub)
+                for msg_id in requests:
+                    hub.forget(msg_id)
+                return
             iopub_channel.stop_on_recv()
             if not shell_channel.closed():
                 shell_channel.close()
@@ -188,15 +215,22 @@ class ZMQChannelsHandler(AuthenticatedZMQStreamHandler):
                 self.log.debug("Nudge: resolving shell future: %s", self.kernel_id)
                 info_future.set_result(None)
 
-        def on_iopub(msg):
+        def on_iopub(*args):
             self.log.debug("Nudge: IOPub received: %s", self.kernel_id)
             if not iopub_future.done():
-                iopub_channel.stop_on_recv()
+                if hub is not None:
+                    hub.remove_iopub_callback(on_iopub)
+                else:
+                    iopub_channel.stop_on_recv()
                 self.log.debug("Nudge: resolving iopub future: %s", self.kernel_id)
                 iopub_future.set_result(None)
 
-        iopub_channel.on_recv(on_iopub)
-        shell_channel.on_recv(on_shell_reply)
+        if hub is not None:
+            if not iopub_future.done():
+                hub.add_iopub_callback(on_iopub)
+        else:
+            iopub_channel.on_recv(on_iopub)
+            shell_channel.on_recv(on_shell_reply)
         loop = IOLoop.current()
 
         # Nudge the kernel with kernel info requests until we get an IOPub message
@@ -231,7 +265,10 @@ class ZMQChannelsHandler(AuthenticatedZMQStreamHandler):
             if not both_done.done():
                 log = self.log.warning if count % 10 == 0 else self.log.debug
                 log("Nudge: attempt %s on kernel %s" % (count, self.kernel_id))
-                self.session.send(shell_channel, "kernel_info_request")
+                if hub is not None:
+                    requests.append(hub.request("kernel_info_request", on_shell_reply))
+                else:
+                    self.session.send(shell_channel, "kernel_info_request")
                 nonlocal nudge_handle
                 nudge_handle = loop.call_later(0.5, nudge, count)
 
@@ -308,21 +345,21 @@ class ZMQChannelsHandler(AuthenticatedZMQStreamHandler):
         super().initialize()
         self.zmq_stream = None
         self.channels = {}
+        # the streams shared with the other websockets of the kernel, if any
+        self.hub = None
         self.kernel_id = None
         self.kernel_info_channel = None
         self._kernel_info_future = Future()
         self._close_future = Future()
         self.session_key = ''
 
-        # Rate limiting code
-        self._iopub_window_msg_count = 0
-        self._iopub_window_byte_count = 0
-        self._iopub_msgs_exceeded = False
-        self._iopub_data_exceeded = False
-        # Queue of (time stamp, byte count)
-        # Allows you to specify that the byte count should be lowered
-        # by a delta amount at some point in the future.
-        self._iopub_window_byte_queue = []
+        # Rate limiting, set up when the websocket is opened
+        self._iopub_rate_limiter = None
+
+        # Stream coalescing: (stream, msg, [text, ...]) waiting to be sent
+        self._pending_stream = None
+        self._pending_stream_handle = None
+        self._pending_stream_chars = 0
 
     @gen.coroutine
     def pre_get(self):
@@ -371,6 +408,14 @@ class ZMQChannelsHandler(AuthenticatedZMQStreamHandler):
     def open(self, kernel_id):
         super().open()
         km = self.kernel_manager
+        self._iopub_rate_limiter = IOPubRateLimiter(
+            kernel_id,
+            msg_rate_limit=self.iopub_msg_rate_limit,
+            data_rate_limit=self.iopub_data_rate_limit,
+            window=self.rate_limit_window,
+            on_exceeded=self._write_rate_limit_error,
+            log=self.log,
+        )
         km.notify_connect(kernel_id)
 
         # on new connections, flush the message buffer
@@ -378,6 +423,10 @@ class ZMQChannelsHandler(AuthenticatedZMQStreamHandler):
         if buffer_info and buffer_info['session_key'] == self.session_key:
             self.log.info("Restoring connection for %s", self.session_key)
             self.channels = buffer_info['channels']
+            if getattr(km, 'share_kernel_channels', False):
+                self.hub = km.channel_hub(kernel_id)
+                self.hub.open(self.channels)
+                self.channels = self.hub.channels
             connected = self.nudge()
             
             def replay(value):
@@ -387,6 +436,7 @@ class ZMQChannelsHandler(AuthenticatedZMQStreamHandler):
                     for channel, msg_list in replay_buffer:
                         stream = self.channels[channel]
                         self._on_zmq_reply(stream, msg_list)
+                    replay_buffer.close()
 
             connected.add_done_callback(replay)
         else:
@@ -397,9 +447,10 @@ class ZMQChannelsHandler(AuthenticatedZMQStreamHandler):
                 self.log.error("Error opening stream: %s", e)
                 # WebSockets don't response to traditional error codes so we
                 # close the connection.
-                for channel, stream in self.channels.items():
-                    if not stream.closed():
-                        stream.close()
+                if self.hub is None:
+                    for channel, stream in self.channels.items():
+                        if not stream.closed():
+                            stream.close()
                 self.close()
                 return
 
@@ -407,6 +458,10 @@ class ZMQChannelsHandler(AuthenticatedZMQStreamHandler):
         km.add_restart_callback(self.kernel_id, self.on_restart_failed, 'dead')
 
         def subscribe(value):
+            if self.hub is not None:
+                if self.channels:
+                    self.hub.attach(self)
+                return
             for channel, stream in self.channels.items():
                 stream.on_recv_stream(self._on_zmq_reply)
 
@@ -434,117 +489,107 @@ class ZMQChannelsHandler(AuthenticatedZMQStreamHandler):
         mt = msg['header']['msg_type']
         if am and mt not in am:
             self.log.warning('Received message of type "%s", which is not allowed. Ignoring.' % mt)
+        elif self.hub is not None:
+            self.hub.send(self, channel, msg)
         else:
             stream = self.channels[channel]
             self.session.send(stream, msg)
 
     def _on_zmq_reply(self, stream, msg_list):
         idents, fed_msg_list = self.session.feed_identities(msg_list)
-        msg = self.session.deserialize(fed_msg_list)
-        parent = msg['parent_header']
-        def write_stderr(error_message):
-            self.log.warning(error_message)
-            msg = self.session.msg("stream",
-                content={"text": error_message + '\n', "name": "stderr"},
-                parent=parent
-            )
-            msg['channel'] = 'iopub'
-            self.write_message(json.dumps(msg, default=date_default))
         channel = getattr(stream, 'channel', None)
-        msg_type = msg['header']['msg_type']
+        # Only the header is needed for most messages, whose frames are then
+        # passed through to the websocket without unpacking their content.
+        header = self._unpack_header(fed_msg_list)
+        if header is None:
+            msg = self.session.deserialize(fed_msg_list)
+            msg_type = msg['header']['msg_type']
+        else:
+            msg = None
+            msg_type = header['msg_type']
+            if channel == 'iopub' and (msg_type == 'status' or (
+                    msg_type == 'stream' and self.iopub_stream_coalesce_window > 0)):
+                msg = self.session.deserialize(fed_msg_list)
 
         if channel == 'iopub' and msg_type == 'status' and msg['content'].get('execution_state') == 'idle':
             # reset rate limit counter on status=idle,
             # to avoid 'Run All' hitting limits prematurely.
-            self._iopub_window_byte_queue = []
-            self._iopub_window_msg_count = 0
-            self._iopub_window_byte_count = 0
-            self._iopub_msgs_exceeded = False
-            self._iopub_data_exceeded = False
+            self._iopub_rate_limiter.reset()
 
-        if channel == 'iopub' and msg_type not in {'status', 'comm_open', 'execute_input'}:
-            
-            # Remove the counts queued for removal.
-            now = IOLoop.current().time()
-            while len(self._iopub_window_byte_queue) > 0:
-                queued = self._iopub_window_byte_queue[0]
-                if (now >= queued[0]):
-                    self._iopub_window_byte_count -= queued[1]
-                    self._iopub_window_msg_count -= 1
-                    del self._iopub_window_byte_queue[0]
-                else:
-                    # This part of the queue hasn't be reached yet, so we can
-                    # abort the loop.
-                    break
-
-            # Increment the bytes and message count
-            self._iopub_window_msg_count += 1
-            if msg_type == 'stream':
-                byte_count = sum([len(x) for x in msg_list])
-            else:
-                byte_count = 0
-            self._iopub_window_byte_count += byte_count
-            
-            # Queue a removal of the byte and message count for a time in the 
-            # future, when we are no longer interested in it.
-            self._iopub_window_byte_queue.append((now + self.rate_limit_window, byte_count))
-            
-            # Check the limits, set the limit flags, and reset the
-            # message and data counts.
-            msg_rate = float(self._iopub_window_msg_count) / self.rate_limit_window
-            data_rate = float(self._iopub_window_byte_count) / self.rate_limit_window
-            
-            # Check the msg rate
-            if self.iopub_msg_rate_limit > 0 and msg_rate > self.iopub_msg_rate_limit:
-                if not self._iopub_msgs_exceeded:
-                    self._iopub_msgs_exceeded = True
-                    write_stderr(dedent("""\
-                    IOPub message rate exceeded.
-                    The notebook server will temporarily stop sending output
-                    to the client in order to avoid crashing it.
-                    To change this limit, set the config variable
-                    `--NotebookApp.iopub_msg_rate_limit`.
-                    
-                    Current values:
-                    NotebookApp.iopub_msg_rate_limit={} (msgs/sec)
-                    NotebookApp.rate_limit_window={} (secs)
-                    """.format(self.iopub_msg_rate_limit, self.rate_limit_window)))
-            else:
-                # resume once we've got some headroom below the limit
-                if self._iopub_msgs_exceeded and msg_rate < (0.8 * self.iopub_msg_rate_limit):
-                    self._iopub_msgs_exceeded = False
-                    if not self._iopub_data_exceeded:
-                        self.log.warning("iopub messages resumed")
-
-            # Check the data rate
-            if self.iopub_data_rate_limit > 0 and data_rate > self.iopub_data_rate_limit:
-                if not self._iopub_data_exceeded:
-                    self._iopub_data_exceeded = True
-                    write_stderr(dedent("""\
-                    IOPub data rate exceeded.
-                    The notebook server will temporarily stop sending output
-                    to the client in order to avoid crashing it.
-                    To change this limit, set the config variable
-                    `--NotebookApp.iopub_data_rate_limit`.
-                    
-                    Current values:
-                    NotebookApp.iopub_data_rate_limit={} (bytes/sec)
-                    NotebookApp.rate_limit_window={} (secs)
-                    """.format(self.iopub_data_rate_limit, self.rate_limit_window)))
-            else:
-                # resume once we've got some headroom below the limit
-                if self._iopub_data_exceeded and data_rate < (0.8 * self.iopub_data_rate_limit):
-                    self._iopub_data_exceeded = False
-                    if not self._iopub_msgs_exceeded:
-                        self.log.warning("iopub messages resumed")
-        
-            # If either of the limit flags are set, do not send the message.
-            if self._iopub_msgs_exceeded or self._iopub_data_exceeded:
-                # we didn't send it, remove the current message from the calculus
-                self._iopub_window_msg_count -= 1
-                self._iopub_window_byte_count -= byte_count
-                self._iopub_window_byte_queue.pop(-1)
+        if channel == 'iopub':
+            byte_count = sum(len(x) for x in msg_list)
+            if not self._iopub_rate_limiter.check(
+                    msg_type, byte_count, msg if msg is not None else fed_msg_list):
+                return
+
+        if channel == 'iopub' and msg_type == 'stream' and self.iopub_stream_coalesce_window > 0:
+            self._coalesce_stream(stream, msg)
+            return
+        # preserve ordering by sending any held stream output first
+        self._flush_stream()
+        if msg is not None:
+            super()._on_zmq_reply(stream, msg)
+        else:
+            # pass on the unpacked header, not to parse the frames again
+            super()._on_zmq_reply(stream, fed_msg_list, header=header)
+
+    def _write_rate_limit_error(self, error_message, msg):
+        """Tell the client that output of msg was dropped by the iopub rate limits
+
+        msg is either a deserialized message, or its frames without identities.
+        """
+        self.log.warning(error_message)
+        if isinstance(msg, dict):
+            parent = msg['parent_header']
+        else:
+            parent = self.session.unpack(msg[2])
+        err_msg = self.session.msg("stream",
+            content={"text": error_message + '\n', "name": "stderr"},
+            parent=parent
+        )
+        err_msg['channel'] = 'iopub'
+        self._flush_stream()
+        self.write_message(json.dumps(err_msg, default=date_default))
+
+    def _coalesce_stream(self, stream, msg):
+        """Hold a stream message, merging it with the stream messages that follow
+
+        Consecutive stream messages with the same parent and stream name are
+        sent as one message at the end of the coalescing window.
+        """
+        pending = self._pending_stream
+        if pending is not None:
+            pending_msg, texts = pending[1], pending[2]
+            if (pending_msg['parent_header'].get('msg_id') == msg['parent_header'].get('msg_id')
+                    and pending_msg['content'].get('name') == msg['content'].get('name')):
+                texts.append(msg['content'].get('text', ''))
+                self._pending_stream_chars += len(texts[-1])
+                if self._pending_stream_chars >= self.stream_coalesce_max_chars:
+                    self._flush_stream()
                 return
+            self._flush_stream()
+
+        texts = [msg['content'].get('text', '')]
+        self._pending_stream = (stream, msg, texts)
+        self._pending_stream_chars = len(texts[0])
+        loop = IOLoop.current()
+        self._pending_stream_handle = loop.call_later(
+            self.iopub_stream_coalesce_window, self._flush_stream,
+        )
+
+    def _flush_stream(self):
+        """Send the stream message held for coalescing, if any"""
+        if self._pending_stream is None:
+            return
+        stream, msg, texts = self._pending_stream
+        self._pending_stream = None
+        if self._pending_stream_handle is not None:
+            IOLoop.current().remove_timeout(self._pending_stream_handle)
+            self._pending_stream_handle = None
+        if self.ws_connection is None:
+            return
+        if len(texts) > 1:
+            msg['content']['text'] = ''.join(texts)
         super()._on_zmq_reply(stream, msg)
 
     def close(self):
@@ -553,11 +598,21 @@ class ZMQChannelsHandler(AuthenticatedZMQStreamHandler):
 
     def on_close(self):
         self.log.debug("Websocket closed %s", self.session_key)
+        if self._iopub_rate_limiter is not None:
+            self._iopub_rate_limiter.close()
+        # drop stream output held for coalescing, the websocket is gone
+        if self._pending_stream_handle is not None:
+            IOLoop.current().remove_timeout(self._pending_stream_handle)
+            self._pending_stream_handle = None
+        self._pending_stream = None
         # unregister myself as an open session (only if it's really me)
         if self._open_sessions.get(self.session_key) is self:
             self._open_sessions.pop(self.session_key)
 
         km = self.kernel_manager
+        hub = self.hub
+        if hub is not None:
+            hub.detach(self)
         if self.kernel_id in km:
             km.notify_disconnect(self.kernel_id)
             km.remove_restart_callback(
@@ -569,10 +624,19 @@ class ZMQChannelsHandler(AuthenticatedZMQStreamHandler):
 
             # start buffering instead of closing if this was the last connection
             if km._kernel_connections[self.kernel_id] == 0:
+                if hub is not None:
+                    self.channels = hub.release()
                 km.start_buffering(self.kernel_id, self.session_key, self.channels)
                 self._close_future.set_result(None)
                 return
 
+        if hub is not None:
+            # the streams are closed with the last connection, or the kernel
+            self.channels = {}
+            if not self._close_future.done():
+                self._close_future.set_result(None)
+            return
+
         # This method can be called twice, once by self.kernel_died and once
         # from the WebSocket close event. If the WebSocket connection is
         # closed before the ZMQ streams are setup, they could be None.
@@ -591,6 +655,7 @@ class ZMQChannelsHandler(AuthenticatedZMQStreamHandler):
             # ensures proper ordering on the IOPub channel
             # that all messages from the stopped kernel have been delivered
             iopub.flush()
+        self._flush_stream()
         msg = self.session.msg("status",
             {'execution_state': status}
         )
@@ -6,10 +6,14 @@
 # Copyright (c) Jupyter Development Team.
 # Distributed under the terms of the Modified BSD License.
 
-from collections import defaultdict
+import asyncio
+from collections import defaultdict, deque
 from datetime import datetime, timedelta
 from functools import partial
+import inspect
+import json
 import os
+import time
 
 from tornado import web
 from tornado.concurrent import Future
@@ -21,11 +25,22 @@ from traitlets import (Any, Bool, Dict, List, Unicode, TraitError, Integer,
        Float, Instance, default, validate
 )
 
+from notebook.culler import IdleCuller
 from notebook.utils import maybe_future, to_os_path, exists
 from notebook._tz import utcnow, isoformat
 from ipython_genutils.py3compat import getcwd
 
-from notebook.prometheus.metrics import KERNEL_CURRENTLY_RUNNING_TOTAL
+from notebook.prometheus.metrics import (
+    KERNEL_CURRENTLY_RUNNING_TOTAL, KERNEL_SHUTDOWN_DURATION_SECONDS,
+)
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+from .channelhub import ChannelHub
+from .messagebuffer import MessageBuffer, OVERFLOW_POLICIES
 
 # Since use of AsyncMultiKernelManager is optional at the moment, don't require appropriate jupyter_client.
 # This will be confirmed at runtime in notebookapp.  The following block can be removed once the jupyter_client's
@@ -54,6 +69,8 @@ class MappingKernelManager(MultiKernelManager):
 
     _culler_callback = None
 
+    _idle_culler = None
+
     _initialized_culler = False
 
     @default('root_dir')
@@ -82,7 +99,9 @@ class MappingKernelManager(MultiKernelManager):
 
     cull_interval_default = 300  # 5 minutes
     cull_interval = Integer(cull_interval_default, config=True,
-        help="""The interval (in seconds) on which to check for idle kernels exceeding the cull timeout value."""
+        help="""The interval (in seconds) on which to check again for idle kernels which could not be culled
+        when their cull timeout expired, e.g. busy or connected ones. Kernels are otherwise culled as soon
+        as they have been idle for the cull timeout."""
     )
 
     cull_connected = Bool(False, config=True,
@@ -95,6 +114,28 @@ class MappingKernelManager(MultiKernelManager):
         Only effective if cull_idle_timeout > 0."""
     )
 
+    shutdown_concurrency = Integer(32, config=True,
+        help="""The maximum number of kernels shut down at the same time,
+        when the server stops or when culling idle kernels.
+        Only the AsyncMappingKernelManager shuts kernels down concurrently."""
+    )
+
+    shutdown_deadline = Float(0, config=True,
+        help="""The time (in seconds) allowed for shutting down kernels gracefully,
+        when the server stops or when culling idle kernels. Kernels still shutting
+        down afterwards are killed. 0 means no deadline.
+        The MappingKernelManager shuts kernels down one at a time, and shuts
+        the ones left at the deadline down with now=True."""
+    )
+
+    share_kernel_channels = Bool(True, config=True,
+        help="""Whether the websockets connected to a kernel share one set of ZMQ sockets.
+        When False, each websocket opens its own sockets, and the kernel publishes
+        its IOPub messages once per websocket."""
+    )
+
+    _channel_hubs = Dict()
+
     buffer_offline_messages = Bool(True, config=True,
         help="""Whether messages from kernels whose frontends have disconnected should be buffered in-memory.
         When True (default), messages are buffered and replayed on reconnect,
@@ -104,6 +145,54 @@ class MappingKernelManager(MultiKernelManager):
         """
     )
 
+    buffer_max_bytes = Integer(100 * 1024 * 1024, config=True,
+        help="""The maximum number of bytes of messages to buffer per kernel
+        while no frontends are connected. 0 means no limit.
+        Once exceeded, `buffer_overflow_policies` are applied.
+        """
+    )
+
+    buffer_max_messages = Integer(0, config=True,
+        help="""The maximum number of messages to buffer per kernel
+        while no frontends are connected. 0 means no limit.
+        Once exceeded, `buffer_overflow_policies` are applied.
+        """
+    )
+
+    buffer_overflow_policies = List(Unicode(), list(OVERFLOW_POLICIES), config=True,
+        help="""Policies applied, in order, when a kernel's offline message buffer
+        exceeds its limits:
+
+        - coalesce_stream: merge adjacent stream messages with the same parent and name
+        - latest_display: keep only the latest update_display_data for each display_id
+        - drop_oldest: discard the oldest output messages
+
+        If the buffer is still over its limits afterwards, new messages are discarded.
+        """
+    )
+
+    @validate('buffer_overflow_policies')
+    def _validate_buffer_overflow_policies(self, proposal):
+        value = proposal['value']
+        for policy in value:
+            if policy not in OVERFLOW_POLICIES:
+                raise TraitError("Unknown buffer overflow policy %r, expected one of %s"
+                                 % (policy, ', '.join(OVERFLOW_POLICIES)))
+        return value
+
+    buffer_spill_threshold = Integer(0, config=True,
+        help="""The number of bytes of buffered messages to hold in memory per kernel
+        before spilling further messages to a memory-mapped file in `buffer_spill_dir`.
+        0 disables spilling to disk.
+        """
+    )
+
+    buffer_spill_dir = Unicode('', config=True,
+        help="""The directory in which offline message buffers are spilled.
+        Defaults to the system temporary directory.
+        """
+    )
+
     kernel_info_timeout = Float(60, config=True,
         help="""Timeout for giving up on a kernel (in seconds).
         On starting and restarting kernels, we check whether the
@@ -115,6 +204,40 @@ class MappingKernelManager(MultiKernelManager):
         """
     )
 
+    kernel_pool = Dict(config=True,
+        help="""The number of idle kernels to keep started, by kernel spec name,
+        e.g. {"python3": 2}.
+
+        Starting a kernel of one of these kernel specs hands out one of the
+        pooled kernels, if it can be moved to the directory of the notebook
+        (see `kernel_pool_chdir_code`), and the pool is refilled in the background.
+        """
+    )
+
+    kernel_pool_max_memory = Integer(0, config=True,
+        help="""The maximum total memory, in bytes, of the kernels of the pool.
+        No kernel is added to the pool once it is reached. 0 means no limit.
+        Requires psutil.
+        """
+    )
+
+    kernel_pool_chdir_code = Dict(
+        {'python': 'import os; os.chdir({path})'}, config=True,
+        help="""Code changing the working directory of a pooled kernel, by kernel language.
+        {path} is replaced with the directory, as a JSON string.
+        Kernels of other languages are only handed out if they are started
+        in the root directory.
+        """
+    )
+
+    _kernel_pool = Any()
+    @default('_kernel_pool')
+    def _default_kernel_pool(self):
+        # kernel spec name -> deque of (kernel_id, kernel manager)
+        return defaultdict(deque)
+
+    _kernel_pool_filling = False
+
     _kernel_buffers = Any()
     @default('_kernel_buffers')
     def _default_kernel_buffers(self):
@@ -173,9 +296,15 @@ class MappingKernelManager(MultiKernelManager):
         if kernel_id is None:
             if path is not None:
                 kwargs['cwd'] = self.cwd_for_path(path)
-            kernel_id = await maybe_future(self.pinned_superclass.start_kernel(self, **kwargs))
+            kernel_id = await self._take_pooled_kernel(**kwargs)
+            pooled = kernel_id is not None
+            if not pooled:
+                kernel_id = await maybe_future(self.pinned_superclass.start_kernel(self, **kwargs))
             self._kernel_connections[kernel_id] = 0
             self.start_watching_activity(kernel_id)
+            if pooled:
+                # it answered already
+                self._kernels[kernel_id].execution_state = 'idle'
             self.log.info("Kernel started: %s, name: %s" % (kernel_id, self._kernels[kernel_id].kernel_name))
             self.log.debug("Kernel args: %r" % kwargs)
             # register callback for failed auto-restart
@@ -197,9 +326,247 @@ class MappingKernelManager(MultiKernelManager):
         # Initialize culling if not already
         if not self._initialized_culler:
             self.initialize_culler()
+        elif self._idle_culler is not None and kernel_id not in self._idle_culler:
+            self._idle_culler.add(kernel_id, self._kernel_idle_deadline(kernel_id))
 
         return kernel_id
 
+    async def fill_kernel_pool(self):
+        """Start the kernels missing from the pool, one at a time"""
+        if self._kernel_pool_filling:
+            return
+        self._kernel_pool_filling = True
+        try:
+            for kernel_name, size in self.kernel_pool.items():
+                pool = self._kernel_pool[kernel_name]
+                while len(pool) < size:
+                    if self._kernel_pool_full():
+                        return
+                    kernel_id, km = await self._start_pooled_kernel(kernel_name)
+                    pool.append((kernel_id, km))
+                    self.log.debug("Kernel %s added to the pool of %s", kernel_id, kernel_name)
+        except Exception:
+            self.log.exception("Failed to fill the kernel pool")
+        finally:
+            self._kernel_pool_filling = False
+
+    def _kernel_pool_full(self):
+        if not self.kernel_pool_max_memory:
+            return False
+        if psutil is None:
+            self.log.warning("kernel_pool_max_memory requires psutil, which is not installed.")
+            self.kernel_pool_max_memory = 0
+            return False
+        memory = 0
+        for pool in self._kernel_pool.values():
+            for kernel_id, km in pool:
+                # the provisioner only exists in jupyter_client 7+
+                pid = getattr(getattr(km, 'provisioner', None), 'pid', None)
+                if pid is None:
+                    pid = getattr(getattr(km, 'kernel', None), 'pid', None)
+                if pid is None:
+                    self.log.warning("No process id of pooled kernel %s, its memory is not counted", kernel_id)
+                    continue
+                try:
+                    memory += psutil.Process(pid).memory_info().rss
+                except psutil.Error:
+                    pass
+        if memory >= self.kernel_pool_max_memory:
+            self.log.debug("The kernel pool uses %i bytes, not adding kernels", memory)
+            return True
+        return False
+
+    async def _start_pooled_kernel(self, kernel_name):
+        """Start a kernel in the root directory, outside of the running kernels"""
+        kernel_id = await maybe_future(self.pinned_superclass.start_kernel(
+            self, kernel_name=kernel_name, cwd=self.root_dir,
+        ))
+        km = self._kernels.pop(kernel_id)
+        try:
+            await self._request_reply(km, 'kernel_info_request')
+        except Exception:
+            await maybe_future(km.shutdown_kernel(now=True))
+            raise
+        return kernel_id, km
+
+    async def _take_pooled_kernel(self, kernel_name=None, cwd=None, **kwargs):
+        """Hand out a kernel of the pool, moved to cwd, or return None"""
+        if kernel_name is None:
+            kernel_name = self.default_kernel_name
+        pool = self._kernel_pool.get(kernel_name)
+        if kwargs or not pool:
+            # e.g. a custom environment
+            return None
+        while pool:
+            kernel_id, km = pool.popleft()
+            if not await maybe_future(km.is_alive()):
+                continue
+            code = None
+            if cwd is not None and os.path.abspath(cwd) != self.root_dir:
+                language = getattr(km.kernel_spec, 'language', '').lower()
+                code = self.kernel_pool_chdir_code.get(language)
+                if code is None:
+                    pool.appendleft((kernel_id, km))
+                    return None
+            if code is not None:
+                try:
+                    reply = await self._request_reply(km, 'execute_request', {
+                        'code': code.replace('{path}', json.dumps(cwd)),
+                        'silent': True,
+                        'store_history': False,
+                    })
+                except Exception:
+                    reply = None
+                if reply is None or reply['content'].get('status') != 'ok':
+                    self.log.warning("Failed to change the directory of pooled kernel %s", kernel_id)
+                    await maybe_future(km.shutdown_kernel(now=True))
+                    continue
+            self._kernels[kernel_id] = km
+            self.log.info("Using pooled kernel %s", kernel_id)
+            IOLoop.current().add_callback(self.fill_kernel_pool)
+            return kernel_id
+        return None
+
+    def _request_reply(self, kernel, msg_type, content=None):
+        """Send a request to a kernel on a new shell channel
+
+        Returns a Future of the reply, failing after `kernel_info_timeout`.
+        """
+        channel = kernel.connect_shell()
+        future = Future()
+        loop = IOLoop.current()
+
+        def finish():
+            if not channel.closed():
+                channel.close()
+            loop.remove_timeout(timeout)
+
+        def on_reply(msg_list):
+            finish()
+            if not future.done():
+                idents, msg_list = kernel.session.feed_identities(msg_list)
+                future.set_result(kernel.session.deserialize(msg_list))
+
+        def on_timeout():
+            finish()
+            if not future.done():
+                future.set_exception(TimeoutError("Timeout waiting for %s reply" % msg_type))
+
+        kernel.session.send(channel, msg_type, content)
+        channel.on_recv(on_reply)
+        timeout = loop.add_timeout(loop.time() + self.kernel_info_timeout, on_timeout)
+        return future
+
+    def shutdown_kernel_pool(self):
+        """Shutdown the kernels of the pool"""
+        results = []
+        for pool in self._kernel_pool.values():
+            while pool:
+                kernel_id, km = pool.popleft()
+                results.append(km.shutdown_kernel(now=True))
+        awaitables = [result for result in results if inspect.isawaitable(result)]
+        if awaitables:
+            async def wait():
+                await asyncio.gather(*awaitables)
+            return wait()
+
+    async def shutdown_kernels(self, kernel_ids, now=False):
+        """Shutdown kernels together, within `shutdown_deadline`
+
+        Up to `shutdown_concurrency` kernels are shut down at a time. Kernels
+        still shutting down gracefully at the deadline are killed, and the
+        ones left are shut down with now=True.
+
+        Returns the durations of the phases in seconds: 'graceful', until
+        the kernels are shut down or the deadline, 'kill' and 'total'.
+        """
+        start = time.monotonic()
+        deadline = start + self.shutdown_deadline if self.shutdown_deadline > 0 else None
+        semaphore = asyncio.Semaphore(max(self.shutdown_concurrency, 1))
+        graceful = set()
+
+        async def shutdown(kernel_id):
+            async with semaphore:
+                kill = now or (deadline is not None and time.monotonic() >= deadline)
+                if not kill:
+                    graceful.add(kernel_id)
+                try:
+                    await maybe_future(self.shutdown_kernel(kernel_id, now=kill))
+                except web.HTTPError:
+                    pass  # Already removed
+                except Exception:
+                    self.log.exception("Failed to shut down kernel %s", kernel_id)
+                finally:
+                    graceful.discard(kernel_id)
+
+        tasks = {kernel_id: asyncio.ensure_future(shutdown(kernel_id)) for kernel_id in kernel_ids}
+        if tasks:
+            await asyncio.wait(
+                tasks.values(),
+                timeout=None if deadline is None else max(deadline - time.monotonic(), 0),
+            )
+        graceful_end = time.monotonic()
+
+        stragglers = [kernel_id for kernel_id in graceful if not tasks[kernel_id].done()]
+        for kernel_id in stragglers:
+            tasks[kernel_id].cancel()
+        if tasks:
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
+        await asyncio.gather(*[self._kill_straggler(kernel_id) for kernel_id in stragglers])
+        end = time.monotonic()
+
+        timings = {
+            'graceful': graceful_end - start,
+            'kill': end - graceful_end,
+            'total': end - start,
+        }
+        KERNEL_SHUTDOWN_DURATION_SECONDS.labels(phase='graceful').observe(timings['graceful'])
+        KERNEL_SHUTDOWN_DURATION_SECONDS.labels(phase='kill').observe(timings['kill'])
+        if tasks:
+            self.log.info(
+                "Shut down %d kernels in %.2fs (graceful: %.2fs, kill: %.2fs, %d killed after the deadline)",
+                len(tasks), timings['total'], timings['graceful'], timings['kill'], len(stragglers),
+            )
+        return timings
+
+    async def _kill_straggler(self, kernel_id):
+        """Kill a kernel whose graceful shutdown was cancelled"""
+        self.log.warning("Killing kernel %s, which did not shut down in time", kernel_id)
+        km = self._kernels.get(kernel_id)
+        if km is not None:
+            try:
+                await maybe_future(km.shutdown_kernel(now=True))
+            except Exception:
+                self.log.exception("Failed to kill kernel %s", kernel_id)
+        self.remove_kernel(kernel_id)
+        self._kernel_connections.pop(kernel_id, None)
+
+    def shutdown_all(self, now=False):
+        """Shutdown all kernels, including the kernels of the pool
+
+        The kernels are shut down one at a time. Once `shutdown_deadline`
+        has passed, the ones left are shut down with now=True, but a kernel
+        already shutting down gracefully isn't interrupted.
+        """
+        start = time.monotonic()
+        deadline = start + self.shutdown_deadline if self.shutdown_deadline > 0 else None
+        pool = self.shutdown_kernel_pool()
+        killed = 0
+        for kernel_id in self.list_kernel_ids():
+            kill = now or (deadline is not None and time.monotonic() >= deadline)
+            if kill and not now:
+                killed += 1
+            try:
+                self.shutdown_kernel(kernel_id, now=kill)
+            except web.HTTPError:
+                pass  # Already removed
+            except Exception:
+                self.log.exception("Failed to shut down kernel %s", kernel_id)
+        if killed:
+            self.log.warning("Shut down %d kernels with now=True after the deadline", killed)
+        self.log.info("Shut down kernels in %.2fs", time.monotonic() - start)
+        return pool
+
     def start_buffering(self, kernel_id, session_key, channels):
         """Start buffering messages for a kernel
         Parameters
@@ -226,14 +593,23 @@ class MappingKernelManager(MultiKernelManager):
         buffer_info = self._kernel_buffers[kernel_id]
         # record the session key because only one session can buffer
         buffer_info['session_key'] = session_key
-        # TODO: the buffer should likely be a memory bounded queue, we're starting with a list to keep it simple
-        buffer_info['buffer'] = []
+        kernel = self._kernels[kernel_id]
+        buffer_info['buffer'] = MessageBuffer(
+            kernel_id,
+            Session(config=kernel.session.config, key=kernel.session.key),
+            max_bytes=self.buffer_max_bytes,
+            max_messages=self.buffer_max_messages,
+            policies=self.buffer_overflow_policies,
+            spill_threshold=self.buffer_spill_threshold,
+            spill_dir=self.buffer_spill_dir,
+            log=self.log,
+        )
         buffer_info['channels'] = channels
 
         # forward any future messages to the internal buffer
         def buffer_msg(channel, msg_parts):
             self.log.debug("Buffering msg on %s:%s", kernel_id, channel)
-            buffer_info['buffer'].append((channel, msg_parts))
+            buffer_info['buffer'].append(channel, msg_parts)
 
         for channel, stream in channels.items():
             stream.on_recv(partial(buffer_msg, channel))
@@ -285,6 +661,15 @@ class MappingKernelManager(MultiKernelManager):
         if msg_buffer:
             self.log.info("Discarding %s buffered messages for %s",
                 len(msg_buffer), buffer_info['session_key'])
+        msg_buffer.close()
+
+    def channel_hub(self, kernel_id):
+        """Return the ZMQ streams to a kernel shared by its websockets"""
+        self._check_kernel_id(kernel_id)
+        hub = self._channel_hubs.get(kernel_id)
+        if hub is None:
+            hub = self._channel_hubs[kernel_id] = ChannelHub(self, kernel_id, log=self.log)
+        return hub
 
     def shutdown_kernel(self, kernel_id, now=False, restart=False):
         """Shutdown a kernel by kernel_id"""
@@ -294,6 +679,9 @@ class MappingKernelManager(MultiKernelManager):
             kernel._activity_stream.close()
             kernel._activity_stream = None
         self.stop_buffering(kernel_id)
+        hub = self._channel_hubs.pop(kernel_id, None)
+        if hub is not None:
+            hub.close()
 
         # Decrease the metric of number of kernels
         # running for the relevant kernel type by 1
@@ -358,6 +746,9 @@ class MappingKernelManager(MultiKernelManager):
         """Notice a disconnection from a kernel"""
         if kernel_id in self._kernel_connections:
             self._kernel_connections[kernel_id] -= 1
+            if self._idle_culler is not None and not self._kernel_connections[kernel_id]:
+                # may be culled now
+                self._idle_culler.add(kernel_id, self._kernel_idle_deadline(kernel_id))
 
     def kernel_model(self, kernel_id):
         """Return a JSON-safe dict representing a kernel
@@ -414,57 +805,130 @@ class MappingKernelManager(MultiKernelManager):
             """Record an IOPub message arriving from a kernel"""
             self.last_kernel_activity = kernel.last_activity = utcnow()
 
-            idents, fed_msg_list = session.feed_identities(msg_list)
-            msg = session.deserialize(fed_msg_list)
-
-            msg_type = msg['header']['msg_type']
-            if msg_type == 'status':
-                kernel.execution_state = msg['content']['execution_state']
+            msg_type, execution_state = self._parse_activity(session, msg_list)
+            if execution_state is not None:
+                kernel.execution_state = execution_state
                 self.log.debug("activity on %s: %s (%s)", kernel_id, msg_type, kernel.execution_state)
             else:
                 self.log.debug("activity on %s: %s", kernel_id, msg_type)
 
-        kernel._activity_stream.on_recv(record_activity)
+        # not copied, as most of the frames aren't looked at
+        kernel._activity_stream.on_recv(record_activity, copy=False)
+
+    def _parse_activity(self, session, msg_list):
+        """Return the type of an IOPub message, and the execution state it reports, if any
+
+        Only the header of the message is unpacked, and the message is only
+        deserialized, and its signature checked, if it is a status message.
+        """
+        idents, fed_msg_list = session.feed_identities(msg_list, copy=False)
+        if len(fed_msg_list) < 5:
+            raise TypeError("malformed message, must have at least 5 elements")
+        msg_type = session.unpack(fed_msg_list[1].bytes).get('msg_type')
+        if msg_type != 'status':
+            return msg_type, None
+        msg = session.deserialize(fed_msg_list, copy=False)
+        return msg_type, msg['content']['execution_state']
 
     def initialize_culler(self):
         """Start idle culler if 'cull_idle_timeout' is greater than zero.
         Regardless of that value, set flag that we've been here.
         """
         if not self._initialized_culler and self.cull_idle_timeout > 0:
-            if self._culler_callback is None:
+            if self._culler_callback is None and self._idle_culler is None:
                 loop = IOLoop.current()
                 if self.cull_interval <= 0:  # handle case where user set invalid value
                     self.log.warning("Invalid value for 'cull_interval' detected (%s) - using default value (%s).",
                         self.cull_interval, self.cull_interval_default)
                     self.cull_interval = self.cull_interval_default
-                self._culler_callback = PeriodicCallback(
-                    self.cull_kernels, 1000*self.cull_interval)
-                self.log.info("Culling kernels with idle durations > %s seconds at %s second intervals ...",
-                    self.cull_idle_timeout, self.cull_interval)
+                if (type(self).cull_kernels is not MappingKernelManager.cull_kernels
+                        or type(self).cull_kernel_if_idle is not MappingKernelManager.cull_kernel_if_idle):
+                    # subclasses cull their own way, check all kernels periodically
+                    self._culler_callback = PeriodicCallback(
+                        self.cull_kernels, 1000*self.cull_interval)
+                    self.log.info("Culling kernels with idle durations > %s seconds at %s second intervals ...",
+                        self.cull_idle_timeout, self.cull_interval)
+                    self._culler_callback.start()
+                else:
+                    self._idle_culler = IdleCuller(
+                        self._kernel_cull_time, self.shutdown_kernels, self.cull_interval, log=self.log,
+                    )
+                    for kernel_id in list(self._kernels):
+                        self._idle_culler.add(kernel_id, self._kernel_idle_deadline(kernel_id))
+                    self.log.info("Culling kernels with idle durations > %s seconds ...", self.cull_idle_timeout)
                 if self.cull_busy:
                     self.log.info("Culling kernels even if busy")
                 if self.cull_connected:
                     self.log.info("Culling kernels even with connected clients")
-                self._culler_callback.start()
 
         self._initialized_culler = True
 
     async def cull_kernels(self):
         self.log.debug("Polling every %s seconds for kernels idle > %s seconds...",
             self.cull_interval, self.cull_idle_timeout)
+        if type(self).cull_kernel_if_idle is not MappingKernelManager.cull_kernel_if_idle:
+            # respect the culling of subclasses, without a deadline
+            semaphore = asyncio.Semaphore(max(self.shutdown_concurrency, 1))
+
+            async def cull(kernel_id):
+                async with semaphore:
+                    try:
+                        await self.cull_kernel_if_idle(kernel_id)
+                    except Exception as e:
+                        self.log.exception("The following exception was encountered while checking the "
+                                           "idle duration of kernel {}: {}".format(kernel_id, e))
+
+            await asyncio.gather(*[cull(kernel_id) for kernel_id in list(self._kernels)])
+            return
+
         """Create a separate list of kernels to avoid conflicting updates while iterating"""
+        idle_kernel_ids = []
         for kernel_id in list(self._kernels):
             try:
-                await self.cull_kernel_if_idle(kernel_id)
+                if self.kernel_is_idle(kernel_id):
+                    idle_kernel_ids.append(kernel_id)
             except Exception as e:
                 self.log.exception("The following exception was encountered while checking the "
                                    "idle duration of kernel {}: {}".format(kernel_id, e))
+        if idle_kernel_ids:
+            await self.shutdown_kernels(idle_kernel_ids)
+
+    def _kernel_idle_deadline(self, kernel_id):
+        """When a kernel will have been idle for `cull_idle_timeout`, if not active until then"""
+        last_activity = getattr(self._kernels.get(kernel_id), 'last_activity', None)
+        if last_activity is None:
+            return utcnow()
+        return last_activity + timedelta(seconds=self.cull_idle_timeout)
+
+    def _kernel_cull_time(self, kernel_id):
+        """The time from which a kernel may be culled, or None if it is gone
+
+        Kernels which are idle for long enough, but busy or connected, are
+        checked again after `cull_interval`.
+        """
+        kernel = self._kernels.get(kernel_id)
+        if kernel is None:
+            return None
+        now = utcnow()
+        last_activity = getattr(kernel, 'last_activity', None)
+        if last_activity is not None:
+            deadline = last_activity + timedelta(seconds=self.cull_idle_timeout)
+            if deadline >= now:
+                return deadline
+        if self.kernel_is_idle(kernel_id):
+            return now
+        return now + timedelta(seconds=self.cull_interval)
 
     async def cull_kernel_if_idle(self, kernel_id):
+        if self.kernel_is_idle(kernel_id):
+            await maybe_future(self.shutdown_kernel(kernel_id))
+
+    def kernel_is_idle(self, kernel_id):
+        """Whether a kernel is idle enough to be culled"""
         try:
             kernel = self._kernels[kernel_id]
         except KeyError:
-            return  # KeyErrors are somewhat expected since the kernel can be shutdown as the culling check is made.
+            return False  # KeyErrors are somewhat expected since the kernel can be shutdown as the culling check is made.
 
         if hasattr(kernel, 'last_activity'):  # last_activity is monkey-patched, so ensure that has occurred
             self.log.debug("kernel_id=%s, kernel_name=%s, last_activity=%s",
@@ -481,7 +945,8 @@ class MappingKernelManager(MultiKernelManager):
                 idle_duration = int(dt_idle.total_seconds())
                 self.log.warning("Culling '%s' kernel '%s' (%s) with %d connections due to %s seconds of inactivity.",
                                  kernel.execution_state, kernel.kernel_name, kernel_id, connections, idle_duration)
-                await maybe_future(self.shutdown_kernel(kernel_id))
+                return True
+        return False
 
 
 # AsyncMappingKernelManager inherits as much as possible from MappingKernelManager, overriding
@@ -497,6 +962,16 @@ class AsyncMappingKernelManager(MappingKernelManager, AsyncMultiKernelManager):
         self.pinned_superclass.__init__(self, **kwargs)
         self.last_kernel_activity = utcnow()
 
+    async def shutdown_all(self, now=False):
+        """Shutdown all kernels, including the kernels of the pool
+
+        The kernels are shut down concurrently, see `shutdown_kernels`.
+        """
+        pool = self.shutdown_kernel_pool()
+        if pool is not None:
+            await pool
+        await self.shutdown_kernels(self.list_kernel_ids(), now=now)
+
     async def shutdown_kernel(self, kernel_id, now=False, restart=False):
         """Shutdown a kernel by kernel_id"""
         self._check_kernel_id(kernel_id)
@@ -505,6 +980,9 @@ class AsyncMappingKernelManager(MappingKernelManager, AsyncMultiKernelManager):
             kernel._activity_stream.close()
             kernel._activity_stream = None
         self.stop_buffering(kernel_id)
+        hub = self._channel_hubs.pop(kernel_id, None)
+        if hub is not None:
+            hub.close()
 
         # Decrease the metric of number of kernels
         # running for the relevant kernel type by 1
@@ -0,0 +1,325 @@
+"""A bounded buffer for kernel messages received while no frontend is connected.
+
+Messages are kept as the raw zmq frames received from the kernel, so that
+they can be replayed through the regular websocket path on reconnect.
+When the buffer grows beyond its configured limits, a sequence of overflow
+policies is applied to bring it back under them.
+"""
+
+# Copyright (c) Jupyter Development Team.
+# Distributed under the terms of the Modified BSD License.
+
+from collections import deque
+import mmap
+import tempfile
+
+from jupyter_client.session import DELIM
+
+from notebook.prometheus.metrics import (
+    KERNEL_BUFFERED_BYTES,
+    KERNEL_BUFFER_DISCARDED_MESSAGES_TOTAL,
+)
+
+#: The overflow policies understood by MessageBuffer
+OVERFLOW_POLICIES = ('coalesce_stream', 'latest_display', 'drop_oldest')
+
+# Once a buffer overflows, it is compacted down to this fraction of its limits,
+# so that the cost of a compaction pass is amortized over many messages.
+LOW_WATER_MARK = 0.8
+
+
+class BufferedMessage(object):
+    """A single message held by a MessageBuffer.
+
+    The frames are either held in memory (``parts``) or in the buffer's
+    spill segment (``offset`` and ``sizes``).
+    """
+    __slots__ = ('channel', 'parts', 'offset', 'sizes', 'nbytes')
+
+    def __init__(self, channel, parts):
+        self.channel = channel
+        self.parts = parts
+        self.offset = None
+        self.sizes = None
+        self.nbytes = sum(len(part) for part in parts)
+
+
+class MessageBuffer(object):
+    """A memory bounded queue of (channel, msg_list) pairs for one kernel.
+
+    Parameters
+    ----------
+    kernel_id : str
+        The id of the kernel whose messages are buffered (used for metrics).
+    session : jupyter_client.session.Session
+        A session sharing the kernel's key, used to re-sign coalesced messages.
+    max_bytes : int
+        The maximum number of bytes to buffer. 0 means no limit.
+    max_messages : int
+        The maximum number of messages to buffer. 0 means no limit.
+    policies : list of str
+        The overflow policies to apply, in order, once a limit is exceeded.
+        See OVERFLOW_POLICIES. If the limits are still exceeded after all
+        policies have been applied, new messages are discarded.
+    spill_threshold : int
+        The number of bytes to hold in memory before appending further messages
+        to a memory-mapped segment file. 0 disables spilling.
+    spill_dir : str, optional
+        The directory in which the segment file is created.
+    """
+
+    def __init__(self, kernel_id, session, max_bytes=0, max_messages=0,
+                 policies=OVERFLOW_POLICIES, spill_threshold=0, spill_dir=None,
+                 log=None):
+        self.kernel_id = kernel_id
+        self.session = session
+        self.max_bytes = max_bytes
+        self.max_messages = max_messages
+        self.policies = list(policies)
+        self.spill_threshold = spill_threshold
+        self.spill_dir = spill_dir or None
+        self.log = log
+
+        self._messages = deque()
+        self.nbytes = 0
+        self.nmessages = 0
+        self.memory_bytes = 0
+        self.discarded = 0
+        self._full = False
+        self._segment = None
+        self._segment_size = 0
+        self._segment_live = 0
+        self._mmap = None
+
+    def __len__(self):
+        return len(self._messages)
+
+    def __iter__(self):
+        """Iterate over the buffered (channel, msg_list) pairs, oldest first."""
+        for message in list(self._messages):
+            yield message.channel, self._load(message)
+
+    def append(self, channel, msg_list):
+        """Add a message received on `channel` to the buffer."""
+        if self._full:
+            self._discard(1, 'full')
+            return
+        message = BufferedMessage(channel, list(msg_list))
+        self._account(message)
+        self._messages.append(message)
+        if self._over(1):
+            self._compact()
+        self._update_metrics()
+
+    def close(self):
+        """Release all buffered messages and the spill segment, if any."""
+        self._messages.clear()
+        self.nbytes = self.nmessages = self.memory_bytes = 0
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        if self._segment is not None:
+            self._segment.close()
+            self._segment = None
+        self._segment_size = self._segment_live = 0
+        try:
+            KERNEL_BUFFERED_BYTES.remove(self.kernel_id)
+        except KeyError:
+            pass
+
+    # -- accounting --
+
+    def _over(self, fraction):
+        if self.max_bytes > 0 and self.nbytes > fraction * self.max_bytes:
+            return True
+        if self.max_messages > 0 and self.nmessages > fraction * self.max_messages:
+            return True
+        return False
+
+    def _account(self, message):
+        """Update accounting for a message about to be added to the queue"""
+        if self.spill_threshold > 0 and self.memory_bytes + message.nbytes > self.spill_threshold:
+            self._spill(message)
+        else:
+            self.memory_bytes += message.nbytes
+        self.nbytes += message.nbytes
+        self.nmessages += 1
+
+    def _forget(self, message):
+        """Update accounting for a message that was removed from the queue"""
+        self.nbytes -= message.nbytes
+        self.nmessages -= 1
+        if message.parts is None:
+            self._segment_live -= message.nbytes
+        else:
+            self.memory_bytes -= message.nbytes
+
+    def _discard(self, count, reason):
+        self.discarded += count
+        KERNEL_BUFFER_DISCARDED_MESSAGES_TOTAL.labels(reason=reason).inc(count)
+
+    def _update_metrics(self):
+        KERNEL_BUFFERED_BYTES.labels(kernel_id=self.kernel_id).set(self.nbytes)
+
+    # -- spilling --
+
+    def _spill(self, message):
+        """Move the frames of a message to the segment file"""
+        if self._segment is None:
+            self._segment = tempfile.TemporaryFile(prefix='kernel-buffer-', dir=self.spill_dir)
+        self._segment.seek(self._segment_size)
+        self._segment.write(b''.join(message.parts))
+        message.offset = self._segment_size
+        message.sizes = [len(part) for part in message.parts]
+        message.parts = None
+        self._segment_size += message.nbytes
+        self._segment_live += message.nbytes
+
+    def _load(self, message):
+        """Return the frames of a message, reading them from the segment if spilled"""
+        if message.parts is not None:
+            return message.parts
+        self._segment.flush()
+        if self._mmap is None or len(self._mmap) < self._segment_size:
+            if self._mmap is not None:
+                self._mmap.close()
+            self._mmap = mmap.mmap(self._segment.fileno(), 0, access=mmap.ACCESS_READ)
+        parts = []
+        offset = message.offset
+        for size in message.sizes:
+            parts.append(self._mmap[offset:offset + size])
+            offset += size
+        return parts
+
+    def _rewrite_segment(self):
+        """Rewrite the segment with only the live spilled messages"""
+        spilled = [m for m in self._messages if m.parts is None]
+        loaded = [(m, self._load(m)) for m in spilled]
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        self._segment.seek(0)
+        self._segment.truncate()
+        self._segment_size = self._segment_live = 0
+        for message, parts in loaded:
+            message.parts = parts
+            self._spill(message)
+
+    # -- overflow policies --
+
+    def _compact(self):
+        """Apply the overflow policies until the buffer is under its limits"""
+        before = len(self._messages)
+        for policy in self.policies:
+            if not self._over(LOW_WATER_MARK):
+                break
+            getattr(self, '_apply_' + policy)()
+
+        if self._over(1):
+            # nothing left to try, refuse further messages
+            self._full = True
+            newest = self._messages.pop()
+            self._forget(newest)
+            self._discard(1, 'full')
+            before -= 1
+
+        if self._segment is not None and self._segment_live * 2 < self._segment_size:
+            self._rewrite_segment()
+
+        if self.log and before > len(self._messages):
+            self.log.debug("Compacted message buffer for %s from %i to %i messages",
+                           self.kernel_id, before, len(self._messages))
+
+    def _header(self, message):
+        """Parse the header, parent header and content of a buffered message"""
+        parts = self._load(message)
+        idx = parts.index(DELIM)
+        unpack = self.session.unpack
+        return (
+            parts[:idx],
+            unpack(parts[idx + 2]),
+            unpack(parts[idx + 3]),
+            unpack(parts[idx + 4]),
+            unpack(parts[idx + 5]),
+        )
+
+    def _apply_coalesce_stream(self):
+        """Merge adjacent IOPub stream messages with the same parent and name"""
+        merged = deque()
+        run = []
+
+        def flush_run():
+            if len(run) == 1:
+                merged.append(run[0][0])
+            elif run:
+                idents, header, parent, metadata, content = run[0][1]
+                content = dict(content, text=''.join(msg[4].get('text', '') for _, msg in run))
+                msg_list = self.session.serialize({
+                    'header': header,
+                    'parent_header': parent,
+                    'metadata': metadata,
+                    'content': content,
+                }, ident=idents)
+                for message, _ in run:
+                    self._forget(message)
+                message = BufferedMessage('iopub', msg_list)
+                self._account(message)
+                merged.append(message)
+                self._discard(len(run) - 1, 'coalesce_stream')
+            del run[:]
+
+        for message in self._messages:
+            msg = None
+            if message.channel == 'iopub':
+                msg = self._header(message)
+                if msg[1].get('msg_type') != 'stream':
+                    msg = None
+            if msg is None:
+                flush_run()
+                merged.append(message)
+                continue
+            if run and not (
+                msg[2].get('msg_id') == run[0][1][2].get('msg_id')
+                and msg[4].get('name') == run[0][1][4].get('name')
+            ):
+                flush_run()
+            run.append((message, msg))
+        flush_run()
+        self._messages = merged
+
+    def _apply_latest_display(self):
+        """Drop update_display_data messages superseded by a later update"""
+        seen = set()
+        kept = deque()
+        dropped = 0
+        for message in reversed(self._messages):
+            if message.channel == 'iopub':
+                _, header, _, _, content = self._header(message)
+                if header.get('msg_type') == 'update_display_data':
+                    display_id = content.get('transient', {}).get('display_id')
+                    if display_id in seen:
+                        self._forget(message)
+                        dropped += 1
+                        continue
+                    seen.add(display_id)
+            kept.appendleft(message)
+        if dropped:
+            self._discard(dropped, 'latest_display')
+        self._messages = kept
+
+    def _apply_drop_oldest(self):
+        """Drop the oldest messages, IOPub first, down to the low water mark"""
+        kept = deque()
+        dropped = 0
+        # shell, control and stdin replies are small and frontends wait on them,
+        # so only drop them if discarding IOPub output was not enough.
+        for channels in (('iopub',), None):
+            for message in self._messages:
+                if self._over(LOW_WATER_MARK) and (channels is None or message.channel in channels):
+                    self._forget(message)
+                    dropped += 1
+                else:
+                    kept.append(message)
+            self._messages, kept = kept, deque()
+        if dropped:
+            self._discard(dropped, 'drop_oldest')
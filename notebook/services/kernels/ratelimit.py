@@ -0,0 +1,190 @@
+"""Sliding window rate limiting of IOPub messages sent to websockets."""
+
+# Copyright (c) Jupyter Development Team.
+# Distributed under the terms of the Modified BSD License.
+
+from collections import deque
+from textwrap import dedent
+import time
+
+from notebook.prometheus.metrics import (
+    KERNEL_IOPUB_MESSAGE_RATE,
+    KERNEL_IOPUB_DATA_RATE,
+)
+
+# IOPub message types which are never limited
+UNLIMITED_MSG_TYPES = {'status', 'comm_open', 'execute_input'}
+
+_exceeded_messages = {
+    'msg': dedent("""\
+        IOPub message rate exceeded.
+        The notebook server will temporarily stop sending output
+        to the client in order to avoid crashing it.
+        To change this limit, set the config variable
+        `--NotebookApp.iopub_msg_rate_limit`.
+
+        Current values:
+        NotebookApp.iopub_msg_rate_limit={limit} (msgs/sec)
+        NotebookApp.rate_limit_window={window} (secs)
+        """),
+    'data': dedent("""\
+        IOPub data rate exceeded.
+        The notebook server will temporarily stop sending output
+        to the client in order to avoid crashing it.
+        To change this limit, set the config variable
+        `--NotebookApp.iopub_data_rate_limit`.
+
+        Current values:
+        NotebookApp.iopub_data_rate_limit={limit} (bytes/sec)
+        NotebookApp.rate_limit_window={window} (secs)
+        """),
+}
+
+
+class IOPubRateLimiter(object):
+    """Limit the rate of IOPub messages and data sent over one connection
+
+    Messages are counted over a sliding window of `window` seconds. Each
+    counted message is queued with its expiry time, so expiring old messages
+    and accounting for new ones are O(1).
+
+    Once a limit is exceeded, messages are refused until the rate drops
+    below 80% of the limit.
+
+    Parameters
+    ----------
+    kernel_id : str
+        The kernel whose messages are limited. The current rates of all
+        limiters for a kernel are exported as metrics.
+    msg_rate_limit : float
+        The maximum number of messages per second. 0 means no limit.
+    data_rate_limit : float
+        The maximum number of bytes per second. 0 means no limit.
+    window : float
+        The length of the sliding window, in seconds.
+    on_exceeded : callable, optional
+        Called with a message explaining which limit was exceeded, and the
+        `msg` passed to `check`, when a limit is first exceeded.
+    log : logging.Logger, optional
+    clock : callable, optional
+        Returns the current time in seconds, defaults to time.monotonic.
+    """
+
+    # live limiters by kernel id, used to report current rates
+    _kernel_limiters = {}
+
+    def __init__(self, kernel_id, msg_rate_limit=0, data_rate_limit=0, window=1.0,
+                 on_exceeded=None, log=None, clock=time.monotonic):
+        self.kernel_id = kernel_id
+        self.msg_rate_limit = msg_rate_limit
+        self.data_rate_limit = data_rate_limit
+        self.window = window
+        self.on_exceeded = on_exceeded
+        self.log = log
+        self.clock = clock
+
+        # (expiry time, byte count) of the messages in the current window
+        self._queue = deque()
+        self.msg_count = 0
+        self.byte_count = 0
+        self.msgs_exceeded = False
+        self.data_exceeded = False
+
+        limiters = self._kernel_limiters.get(kernel_id)
+        if limiters is None:
+            limiters = self._kernel_limiters[kernel_id] = set()
+            KERNEL_IOPUB_MESSAGE_RATE.labels(kernel_id=kernel_id).set_function(
+                lambda: sum(limiter.rates()[0] for limiter in limiters)
+            )
+            KERNEL_IOPUB_DATA_RATE.labels(kernel_id=kernel_id).set_function(
+                lambda: sum(limiter.rates()[1] for limiter in limiters)
+            )
+        limiters.add(self)
+
+    def close(self):
+        """Stop reporting the rates of this limiter"""
+        limiters = self._kernel_limiters.get(self.kernel_id)
+        if limiters is None or self not in limiters:
+            return
+        limiters.discard(self)
+        if not limiters:
+            del self._kernel_limiters[self.kernel_id]
+            for gauge in (KERNEL_IOPUB_MESSAGE_RATE, KERNEL_IOPUB_DATA_RATE):
+                try:
+                    gauge.remove(self.kernel_id)
+                except KeyError:
+                    pass
+
+    def reset(self):
+        """Clear the window and the limit flags, e.g. when the kernel becomes idle"""
+        self._queue.clear()
+        self.msg_count = 0
+        self.byte_count = 0
+        self.msgs_exceeded = False
+        self.data_exceeded = False
+
+    def _expire(self, now):
+        queue = self._queue
+        while queue and now >= queue[0][0]:
+            _, byte_count = queue.popleft()
+            self.msg_count -= 1
+            self.byte_count -= byte_count
+
+    def rates(self):
+        """Return the current (messages/sec, bytes/sec) rates"""
+        self._expire(self.clock())
+        return (self.msg_count / self.window, self.byte_count / self.window)
+
+    def check(self, msg_type, byte_count, msg=None):
+        """Account for an IOPub message of `byte_count` bytes
+
+        Returns whether the message may be sent. Refused messages are not
+        counted towards the rates. `msg` is only passed on to `on_exceeded`,
+        e.g. to find the parent of the error message, so it may be left
+        unparsed.
+        """
+        if msg_type in UNLIMITED_MSG_TYPES:
+            return True
+
+        now = self.clock()
+        self._expire(now)
+        self.msg_count += 1
+        self.byte_count += byte_count
+        msg_rate = self.msg_count / self.window
+        data_rate = self.byte_count / self.window
+
+        if self.msg_rate_limit > 0 and msg_rate > self.msg_rate_limit:
+            if not self.msgs_exceeded:
+                self.msgs_exceeded = True
+                self._exceeded('msg', self.msg_rate_limit, msg)
+        elif self.msgs_exceeded and msg_rate < (0.8 * self.msg_rate_limit):
+            # resume once we've got some headroom below the limit
+            self.msgs_exceeded = False
+            if not self.data_exceeded:
+                self._resumed()
+
+        if self.data_rate_limit > 0 and data_rate > self.data_rate_limit:
+            if not self.data_exceeded:
+                self.data_exceeded = True
+                self._exceeded('data', self.data_rate_limit, msg)
+        elif self.data_exceeded and data_rate < (0.8 * self.data_rate_limit):
+            self.data_exceeded = False
+            if not self.msgs_exceeded:
+                self._resumed()
+
+        if self.msgs_exceeded or self.data_exceeded:
+            # we didn't send it, remove the current message from the calculus
+            self.msg_count -= 1
+            self.byte_count -= byte_count
+            return False
+
+        self._queue.append((now + self.window, byte_count))
+        return True
+
+    def _exceeded(self, kind, limit, msg):
+        if self.on_exceeded is not None:
+            self.on_exceeded(_exceeded_messages[kind].format(limit=limit, window=self.window), msg)
+
+    def _resumed(self):
+        if self.log is not None:
+            self.log.warning("iopub messages resumed")
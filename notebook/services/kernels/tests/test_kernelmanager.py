@@ -0,0 +1,173 @@
+"""Tests for shutting down kernels together"""
+
+import asyncio
+import os
+import time
+from datetime import timedelta
+from types import SimpleNamespace
+from unittest import TestCase, skipIf
+
+import zmq
+from jupyter_client.session import Session
+
+from notebook._tz import utcnow
+from ..kernelmanager import AsyncMappingKernelManager, MappingKernelManager, psutil
+
+
+class DummyKernel(object):
+    kernel_name = 'dummy'
+
+    def __init__(self, delay):
+        self.delay = delay
+        self.killed = False
+        self.execution_state = 'idle'
+        self.last_activity = utcnow()
+
+    async def shutdown_kernel(self, now=False, restart=False):
+        self.killed = now
+
+
+class DummyAsyncMKM(AsyncMappingKernelManager):
+    """AsyncMappingKernelManager with kernels taking `delay` to shut down"""
+
+    def __init__(self, delays, **kwargs):
+        super().__init__(**kwargs)
+        self.in_flight = 0
+        self.max_in_flight = 0
+        for i, delay in enumerate(delays):
+            self._kernels[str(i)] = DummyKernel(delay)
+            self._kernel_connections[str(i)] = 0
+        self.dummy_kernels = dict(self._kernels)
+
+    async def shutdown_kernel(self, kernel_id, now=False, restart=False):
+        self._check_kernel_id(kernel_id)
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            if not now:
+                await asyncio.sleep(self._kernels[kernel_id].delay)
+            self.remove_kernel(kernel_id)
+        finally:
+            self.in_flight -= 1
+
+
+class DummyMKM(MappingKernelManager):
+    """MappingKernelManager with kernels taking `delay` to shut down"""
+
+    def __init__(self, delays, **kwargs):
+        super().__init__(**kwargs)
+        for i, delay in enumerate(delays):
+            self._kernels[str(i)] = DummyKernel(delay)
+            self._kernel_connections[str(i)] = 0
+        self.dummy_kernels = dict(self._kernels)
+
+    def shutdown_kernel(self, kernel_id, now=False, restart=False):
+        self._check_kernel_id(kernel_id)
+        if not now:
+            time.sleep(self._kernels[kernel_id].delay)
+        self._kernels[kernel_id].killed = now
+        self.remove_kernel(kernel_id)
+
+
+class TestShutdownKernels(TestCase):
+
+    def run_async(self, coro):
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        return loop.run_until_complete(coro)
+
+    def test_concurrency(self):
+        km = DummyAsyncMKM([0.01] * 10, shutdown_concurrency=3)
+        timings = self.run_async(km.shutdown_kernels(km.list_kernel_ids()))
+        self.assertEqual(km.list_kernel_ids(), [])
+        self.assertEqual(km.max_in_flight, 3)
+        self.assertEqual(set(timings), {'graceful', 'kill', 'total'})
+
+    def test_deadline(self):
+        km = DummyAsyncMKM([0, 10, 10, 10], shutdown_concurrency=2, shutdown_deadline=0.1)
+        timings = self.run_async(km.shutdown_kernels(km.list_kernel_ids()))
+        self.assertEqual(km.list_kernel_ids(), [])
+        self.assertLess(timings['total'], 5)
+        # the kernels shutting down at the deadline were killed,
+        # the last one was shut down with now=True
+        killed = [kernel_id for kernel_id, kernel in km.dummy_kernels.items() if kernel.killed]
+        self.assertEqual(sorted(killed), ['1', '2'])
+
+    def test_shutdown_all(self):
+        km = DummyAsyncMKM([0.01] * 3)
+        self.run_async(km.shutdown_all())
+        self.assertEqual(km.list_kernel_ids(), [])
+
+    def test_shutdown_all_sync(self):
+        km = DummyMKM([0.1, 0.1, 0.1], shutdown_deadline=0.15)
+        km.shutdown_all()
+        self.assertEqual(km.list_kernel_ids(), [])
+        # shut down with now=True after the deadline
+        killed = [kernel_id for kernel_id, kernel in km.dummy_kernels.items() if kernel.killed]
+        self.assertEqual(killed, ['2'])
+
+
+class TestCullKernels(TestCase):
+
+    def test_cull_at_deadlines(self):
+        async def cull():
+            km = DummyAsyncMKM([0] * 3, cull_idle_timeout=1, cull_interval=1)
+            km.dummy_kernels['1'].last_activity += timedelta(seconds=0.5)
+            km._kernel_connections['2'] = 1
+            km.initialize_culler()
+            self.assertIsNone(km._culler_callback)
+            self.assertEqual(len(km._idle_culler), 3)
+
+            await asyncio.sleep(1.2)
+            self.assertEqual(km.list_kernel_ids(), ['1', '2'])
+            await asyncio.sleep(0.5)
+            self.assertEqual(km.list_kernel_ids(), ['2'])
+            # checked again once disconnected
+            km.notify_disconnect('2')
+            await asyncio.sleep(0.1)
+            self.assertEqual(km.list_kernel_ids(), [])
+            km._idle_culler.stop()
+
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        loop.run_until_complete(cull())
+
+
+class TestParseActivity(TestCase):
+
+    def frames(self, session, msg_type, content):
+        msg = session.msg(msg_type, content)
+        return [zmq.Frame(part) for part in session.serialize(msg, ident=b'kernel')]
+
+    def test_parse_activity(self):
+        km = AsyncMappingKernelManager()
+        session = Session(key=b'secret')
+        self.assertEqual(
+            km._parse_activity(session, self.frames(session, 'status', {'execution_state': 'busy'})),
+            ('status', 'busy'),
+        )
+        self.assertEqual(
+            km._parse_activity(session, self.frames(session, 'stream', {'name': 'stdout', 'text': 'x'})),
+            ('stream', None),
+        )
+        frames = self.frames(Session(key=b'other'), 'status', {'execution_state': 'idle'})
+        with self.assertRaises(ValueError):
+            km._parse_activity(session, frames)
+
+
+@skipIf(psutil is None, "requires psutil")
+class TestKernelPoolMemory(TestCase):
+
+    def test_kernel_pid(self):
+        km = MappingKernelManager(kernel_pool_max_memory=1)
+        km._kernel_pool['dummy'] = [
+            ('0', SimpleNamespace(provisioner=SimpleNamespace(pid=None))),
+            ('1', SimpleNamespace(kernel=SimpleNamespace(pid=os.getpid()))),
+        ]
+        self.assertTrue(km._kernel_pool_full())
+
+    def test_no_pid(self):
+        km = MappingKernelManager(kernel_pool_max_memory=1)
+        km._kernel_pool['dummy'] = [('0', SimpleNamespace())]
+        with self.assertLogs(km.log, 'WARNING'):
+            self.assertFalse(km._kernel_pool_full())
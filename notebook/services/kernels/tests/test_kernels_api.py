@@ -1,6 +1,7 @@
 """Test the kernels service API."""
 
 import json
+import os
 import sys
 import time
 
@@ -12,7 +13,9 @@ from tornado.ioloop import IOLoop
 from tornado.websocket import websocket_connect
 from unittest import SkipTest
 
+from jupyter_client.jsonutil import date_default
 from jupyter_client.kernelspec import NATIVE_KERNEL_NAME
+from jupyter_client.session import Session
 
 from notebook.utils import url_path_join
 from notebook.tests.launchnotebook import NotebookTestBase, assert_http_error
@@ -284,3 +287,259 @@ class KernelCullingTest(NotebookTestBase):
             else:
                 time.sleep(frequency)
         return culled
+
+
+class StreamCoalescingTest(NotebookTestBase):
+    """Test coalescing of iopub stream messages"""
+
+    @classmethod
+    def get_argv(cls):
+        argv = super(StreamCoalescingTest, cls).get_argv()
+        argv.extend(['--NotebookApp.iopub_stream_coalesce_window=0.5'])
+        return argv
+
+    def setUp(self):
+        self.kern_api = KernelAPI(self.request,
+                                  base_url=self.base_url(),
+                                  headers=self.auth_headers(),
+                                  )
+
+    def tearDown(self):
+        for k in self.kern_api.list().json():
+            self.kern_api.shutdown(k['id'])
+
+    def test_coalesce_stream(self):
+        kid = self.kern_api.start().json()['id']
+        ws = self.kern_api.websocket(kid)
+        session = Session()
+        msg = session.msg('execute_request', {
+            'code': 'for i in range(20): print(i, flush=True)',
+            'silent': False,
+        })
+        msg['channel'] = 'shell'
+        ws.write_message(json.dumps(msg, default=date_default))
+        msg_id = msg['header']['msg_id']
+
+        streams = []
+        loop = IOLoop.current()
+        while True:
+            reply = json.loads(loop.run_sync(ws.read_message, timeout=30))
+            if reply['parent_header'].get('msg_id') != msg_id:
+                continue
+            if reply['msg_type'] == 'stream':
+                streams.append(reply['content']['text'])
+            elif reply['msg_type'] == 'status' and reply['content']['execution_state'] == 'idle':
+                break
+        ws.close()
+        self.assertEqual(''.join(streams), ''.join('%i\n' % i for i in range(20)))
+        self.assertLess(len(streams), 20)
+
+
+class KernelPoolTest(NotebookTestBase):
+    """Test handing out kernels of the pool"""
+
+    config = Config({
+        'MappingKernelManager': {
+            'kernel_pool': {NATIVE_KERNEL_NAME: 1},
+        }
+    })
+
+    def setUp(self):
+        self.kern_api = KernelAPI(self.request,
+                                  base_url=self.base_url(),
+                                  headers=self.auth_headers(),
+                                  )
+
+    def tearDown(self):
+        for k in self.kern_api.list().json():
+            self.kern_api.shutdown(k['id'])
+
+    def pooled_kernel_ids(self):
+        for _ in range(60):
+            pool = list(self.notebook.kernel_manager._kernel_pool[NATIVE_KERNEL_NAME])
+            if pool:
+                return [kernel_id for kernel_id, km in pool]
+            time.sleep(0.5)
+        self.fail("The kernel pool was not filled")
+
+    def test_pooled_kernel(self):
+        pooled = self.pooled_kernel_ids()
+        # not a running kernel
+        self.assertEqual(self.kern_api.list().json(), [])
+
+        os.mkdir(os.path.join(self.notebook_dir, 'sub'))
+        r = self.request('POST', 'api/sessions', data=json.dumps({
+            'path': 'sub/test.ipynb', 'type': 'notebook', 'kernel': {'name': NATIVE_KERNEL_NAME},
+        }))
+        self.assertEqual(r.status_code, 201)
+        kernel = r.json()['kernel']
+        self.assertEqual(kernel['id'], pooled[0])
+        self.assertEqual(kernel['execution_state'], 'idle')
+
+        # the kernel runs in the directory of the notebook
+        ws = self.kern_api.websocket(kernel['id'])
+        session = Session()
+        msg = session.msg('execute_request', {
+            'code': 'import os; print(os.getcwd(), end="")',
+            'silent': False,
+        })
+        msg['channel'] = 'shell'
+        ws.write_message(json.dumps(msg, default=date_default))
+        loop = IOLoop.current()
+        while True:
+            reply = json.loads(loop.run_sync(ws.read_message, timeout=30))
+            if (reply['parent_header'].get('msg_id') == msg['header']['msg_id']
+                    and reply['msg_type'] == 'stream'):
+                break
+        ws.close()
+        self.assertEqual(
+            os.path.realpath(reply['content']['text']),
+            os.path.realpath(os.path.join(self.notebook_dir, 'sub')),
+        )
+
+        # the pool is refilled
+        self.assertNotEqual(self.pooled_kernel_ids(), pooled)
+
+
+class AsyncKernelPoolTest(KernelPoolTest):
+    """Test the kernel pool of the AsyncMappingKernelManager"""
+
+    @classmethod
+    def setup_class(cls):
+        if not async_testing_enabled:
+            raise SkipTest("AsyncKernelPoolTest tests skipped due to down-level jupyter_client!")
+        super().setup_class()
+
+    @classmethod
+    def get_argv(cls):
+        argv = super().get_argv()
+        argv.extend(['--NotebookApp.kernel_manager_class='
+                     'notebook.services.kernels.kernelmanager.AsyncMappingKernelManager'])
+        return argv
+
+
+class ChannelHubTest(NotebookTestBase):
+    """Test websockets sharing the ZMQ streams of a kernel"""
+
+    def setUp(self):
+        self.kern_api = KernelAPI(self.request,
+                                  base_url=self.base_url(),
+                                  headers=self.auth_headers(),
+                                  )
+
+    def tearDown(self):
+        for k in self.kern_api.list().json():
+            self.kern_api.shutdown(k['id'])
+
+    def websockets(self, kid, n, session_id=None):
+        loop = IOLoop()
+        loop.make_current()
+        url = url_path_join(self.base_url().replace('http', 'ws', 1), 'api/kernels', kid, 'channels')
+        if session_id is not None:
+            url += '?session_id=' + session_id
+        return [
+            loop.run_sync(lambda: websocket_connect(HTTPRequest(url, headers=self.auth_headers())))
+            for i in range(n)
+        ]
+
+    def read_until(self, ws, msg_id, idle=True, reply=False):
+        """The types of the messages with parent msg_id
+
+        Read until the kernel is idle, if `idle`, and the execute_reply has
+        arrived, if `reply`, which may come before or after the idle status.
+        """
+        msg_types = []
+        loop = IOLoop.current()
+        deadline = loop.time() + 30
+        while True:
+            msg = json.loads(loop.run_sync(ws.read_message, timeout=deadline - loop.time()))
+            if msg['parent_header'].get('msg_id') != msg_id:
+                continue
+            msg_types.append(msg['msg_type'])
+            if msg['msg_type'] == 'status' and msg['content']['execution_state'] == 'idle':
+                idle = False
+            elif msg['msg_type'] == 'execute_reply':
+                reply = False
+            if not idle and not reply:
+                return msg_types
+
+    def test_shared_streams(self):
+        kid = self.kern_api.start().json()['id']
+        ws1, ws2 = self.websockets(kid, 2)
+        hub = self.notebook.kernel_manager._channel_hubs[kid]
+        self.assertEqual(len(hub.channels), 4)
+        for i in range(10):
+            if len(hub.handlers) == 2:
+                break
+            time.sleep(0.1)
+        self.assertEqual(len(hub.handlers), 2)
+
+        session = Session()
+        msg = session.msg('execute_request', {'code': 'print(1)', 'silent': False})
+        msg['channel'] = 'shell'
+        ws1.write_message(json.dumps(msg, default=date_default))
+        msg_id = msg['header']['msg_id']
+
+        # the output goes to both, the reply only to the sender
+        msg_types = self.read_until(ws1, msg_id, reply=True)
+        self.assertIn('stream', msg_types)
+        self.assertIn('execute_reply', msg_types)
+        msg_types = self.read_until(ws2, msg_id)
+        self.assertIn('stream', msg_types)
+        self.assertNotIn('execute_reply', msg_types)
+
+        ws1.close()
+        ws2.close()
+        for i in range(10):
+            if not hub.channels:
+                break
+            time.sleep(0.1)
+        # handed over for buffering with the last connection
+        self.assertEqual(hub.handlers, [])
+        self.assertEqual(hub.channels, {})
+
+    def test_buffered_reconnect(self):
+        kid = self.kern_api.start().json()['id']
+        session = Session()
+        ws, = self.websockets(kid, 1, session_id=session.session)
+        msg = session.msg('execute_request', {
+            'code': 'import time; time.sleep(1); print(1)', 'silent': False,
+        })
+        msg['channel'] = 'shell'
+        ws.write_message(json.dumps(msg, default=date_default))
+        ws.close()
+        time.sleep(2)
+
+        # the streams were buffered and are shared again
+        ws, = self.websockets(kid, 1, session_id=session.session)
+        msg_types = self.read_until(ws, msg['header']['msg_id'], reply=True)
+        self.assertIn('stream', msg_types)
+        self.assertIn('execute_reply', msg_types)
+        hub = self.notebook.kernel_manager._channel_hubs[kid]
+        self.assertEqual(len(hub.channels), 4)
+        ws.close()
+
+    def test_detached_replies(self):
+        kid = self.kern_api.start().json()['id']
+        session = Session()
+        ws1, = self.websockets(kid, 1, session_id=session.session)
+        ws2, = self.websockets(kid, 1)
+        hub = self.notebook.kernel_manager._channel_hubs[kid]
+        for i in range(10):
+            if len(hub.handlers) == 2:
+                break
+            time.sleep(0.1)
+        msg = session.msg('execute_request', {
+            'code': 'import time; time.sleep(1)', 'silent': False,
+        })
+        msg['channel'] = 'shell'
+        ws1.write_message(json.dumps(msg, default=date_default))
+        ws1.close()
+        # the reply comes while the other websocket is connected
+        self.read_until(ws2, msg['header']['msg_id'])
+
+        ws1, = self.websockets(kid, 1, session_id=session.session)
+        msg_types = self.read_until(ws1, msg['header']['msg_id'], idle=False, reply=True)
+        self.assertEqual(msg_types, ['execute_reply'])
+        ws1.close()
+        ws2.close()
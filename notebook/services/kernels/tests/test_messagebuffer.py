@@ -0,0 +1,117 @@
+"""Tests for the bounded offline message buffer."""
+
+from unittest import TestCase
+
+from jupyter_client.session import Session
+
+from ..messagebuffer import MessageBuffer
+
+
+class TestMessageBuffer(TestCase):
+
+    def setUp(self):
+        self.session = Session(key=b'secret')
+        self.parent = self.session.msg('execute_request')
+
+    def make_buffer(self, **kwargs):
+        buf = MessageBuffer('kernel-id', self.session, **kwargs)
+        self.addCleanup(buf.close)
+        return buf
+
+    def serialize(self, msg_type, content, parent=None):
+        msg = self.session.msg(msg_type, content, parent=parent or self.parent)
+        return self.session.serialize(msg, ident=[b'ident'])
+
+    def stream(self, text, name='stdout', parent=None):
+        return self.serialize('stream', {'name': name, 'text': text}, parent=parent)
+
+    def update_display(self, display_id, data):
+        return self.serialize('update_display_data', {
+            'data': {'text/plain': data},
+            'metadata': {},
+            'transient': {'display_id': display_id},
+        })
+
+    def replay(self, buf):
+        """Deserialize the buffered messages, checking their signatures"""
+        session = Session(key=b'secret')
+        msgs = []
+        for channel, msg_list in buf:
+            idents, msg_list = session.feed_identities(msg_list)
+            msgs.append((channel, session.deserialize(msg_list)))
+        return msgs
+
+    def test_unbounded(self):
+        buf = self.make_buffer()
+        for i in range(10):
+            buf.append('iopub', self.stream('%i\n' % i))
+        self.assertEqual(len(buf), 10)
+        texts = [msg['content']['text'] for _, msg in self.replay(buf)]
+        self.assertEqual(texts, ['%i\n' % i for i in range(10)])
+        self.assertEqual(buf.discarded, 0)
+
+    def test_coalesce_stream(self):
+        buf = self.make_buffer(max_messages=10, policies=['coalesce_stream'])
+        other = self.session.msg('execute_request')
+        for i in range(8):
+            buf.append('iopub', self.stream('%i\n' % i))
+        buf.append('shell', self.serialize('execute_reply', {'status': 'ok'}))
+        buf.append('iopub', self.stream('err\n', name='stderr'))
+        buf.append('iopub', self.stream('other\n', parent=other))
+        msgs = self.replay(buf)
+        self.assertEqual([channel for channel, _ in msgs], ['iopub', 'shell', 'iopub', 'iopub'])
+        self.assertEqual(msgs[0][1]['content'], {
+            'name': 'stdout',
+            'text': ''.join('%i\n' % i for i in range(8)),
+        })
+        self.assertEqual(msgs[2][1]['content']['name'], 'stderr')
+        self.assertEqual(msgs[3][1]['parent_header']['msg_id'], other['header']['msg_id'])
+        self.assertEqual(buf.nmessages, 4)
+
+    def test_latest_display(self):
+        buf = self.make_buffer(max_messages=5, policies=['latest_display'])
+        for i in range(6):
+            buf.append('iopub', self.update_display('a' if i % 2 else 'b', str(i)))
+        msgs = self.replay(buf)
+        self.assertEqual(
+            [msg['content']['data']['text/plain'] for _, msg in msgs],
+            ['4', '5'],
+        )
+
+    def test_drop_oldest(self):
+        buf = self.make_buffer(max_messages=10, policies=['drop_oldest'])
+        buf.append('shell', self.serialize('execute_reply', {'status': 'ok'}))
+        for i in range(20):
+            buf.append('iopub', self.stream('%i\n' % i))
+        self.assertLessEqual(len(buf), 10)
+        msgs = self.replay(buf)
+        # shell replies are kept over output
+        self.assertEqual(msgs[0][0], 'shell')
+        self.assertEqual(msgs[-1][1]['content']['text'], '19\n')
+        self.assertEqual(buf.discarded, 21 - len(buf))
+
+    def test_max_bytes(self):
+        buf = self.make_buffer(max_bytes=4096, policies=['drop_oldest'])
+        for i in range(100):
+            buf.append('iopub', self.stream('x' * 100))
+        self.assertLessEqual(buf.nbytes, 4096)
+        self.assertEqual(buf.nbytes, sum(
+            len(part) for _, msg_list in buf for part in msg_list
+        ))
+
+    def test_full(self):
+        buf = self.make_buffer(max_messages=3, policies=[])
+        for i in range(5):
+            buf.append('iopub', self.stream('%i\n' % i))
+        texts = [msg['content']['text'] for _, msg in self.replay(buf)]
+        self.assertEqual(texts, ['0\n', '1\n', '2\n'])
+        self.assertEqual(buf.discarded, 2)
+
+    def test_spill(self):
+        buf = self.make_buffer(spill_threshold=1024, max_bytes=8192)
+        for i in range(50):
+            buf.append('iopub', self.stream('%i' % i + 'x' * 100))
+        self.assertLessEqual(buf.memory_bytes, 1024)
+        self.assertLessEqual(buf.nbytes, 8192)
+        texts = [msg['content']['text'] for _, msg in self.replay(buf)]
+        self.assertTrue(texts[-1].endswith('49' + 'x' * 100))
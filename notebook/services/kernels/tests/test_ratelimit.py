@@ -0,0 +1,76 @@
+"""Tests for the iopub rate limiter."""
+
+from unittest import TestCase
+
+from prometheus_client import REGISTRY
+
+from ..ratelimit import IOPubRateLimiter
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestIOPubRateLimiter(TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.exceeded = []
+        self.exceeded_msgs = []
+
+    def on_exceeded(self, error_message, msg):
+        self.exceeded.append(error_message)
+        self.exceeded_msgs.append(msg)
+
+    def make_limiter(self, **kwargs):
+        limiter = IOPubRateLimiter('kernel-id', window=1.0, clock=self.clock,
+                                   on_exceeded=self.on_exceeded, **kwargs)
+        self.addCleanup(limiter.close)
+        return limiter
+
+    def test_msg_rate(self):
+        limiter = self.make_limiter(msg_rate_limit=10)
+        results = [limiter.check('stream', 1) for i in range(12)]
+        self.assertEqual(results, [True] * 10 + [False] * 2)
+        self.assertEqual(len(self.exceeded), 1)
+        self.assertIn('iopub_msg_rate_limit', self.exceeded[0])
+        # unlimited message types are always sent
+        self.assertTrue(limiter.check('status', 1))
+        # the window slides
+        self.clock.now = 1.0
+        self.assertTrue(limiter.check('stream', 1))
+        self.assertEqual(limiter.msg_count, 1)
+
+    def test_data_rate_all_output(self):
+        limiter = self.make_limiter(data_rate_limit=1000)
+        self.assertTrue(limiter.check('display_data', 600, 'first'))
+        self.assertFalse(limiter.check('display_data', 600, 'second'))
+        self.assertIn('iopub_data_rate_limit', self.exceeded[0])
+        # the refused message is passed on
+        self.assertEqual(self.exceeded_msgs, ['second'])
+        self.assertEqual(limiter.rates(), (1.0, 600.0))
+
+    def test_reset(self):
+        limiter = self.make_limiter(msg_rate_limit=1)
+        self.assertTrue(limiter.check('stream', 1))
+        self.assertFalse(limiter.check('stream', 1))
+        limiter.reset()
+        self.assertTrue(limiter.check('stream', 1))
+
+    def test_metrics(self):
+        a = self.make_limiter()
+        b = self.make_limiter()
+        for i in range(3):
+            a.check('stream', 1)
+        b.check('stream', 1)
+        labels = {'kernel_id': 'kernel-id'}
+        self.assertEqual(REGISTRY.get_sample_value('kernel_iopub_message_rate', labels), 4)
+        self.clock.now = 2.0
+        self.assertEqual(REGISTRY.get_sample_value('kernel_iopub_message_rate', labels), 0)
+        a.close()
+        b.close()
+        self.assertIsNone(REGISTRY.get_sample_value('kernel_iopub_message_rate', labels))
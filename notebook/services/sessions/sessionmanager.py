@@ -3,6 +3,7 @@
 # Copyright (c) Jupyter Development Team.
 # Distributed under the terms of the Modified BSD License.
 
+import os
 import uuid
 
 try:
@@ -11,11 +12,11 @@ except ImportError:
     # fallback on pysqlite2 if Python was build without sqlite
     from pysqlite2 import dbapi2 as sqlite3
 
-from tornado import gen, web
+from tornado import gen, locks, web
 
 from traitlets.config.configurable import LoggingConfigurable
 from ipython_genutils.py3compat import unicode_type
-from traitlets import Instance
+from traitlets import Instance, Integer, TraitError, Unicode, validate
 
 from notebook.utils import maybe_future
 from notebook.traittypes import InstanceFromClasses
@@ -35,33 +36,93 @@ class SessionManager(LoggingConfigurable):
         ]
     )
 
+    database_filepath = Unicode(':memory:', config=True,
+        help="""The filesystem path to the SQLite database in which sessions are stored.
+
+        By default, sessions are kept in memory, and lost when the server stops.
+        With a file, they are found again on restart if their kernels are still
+        running, which requires kernels outliving the server: GatewaySessionManager
+        adopts the kernels of the persisted sessions which are still running on
+        the gateway. The sessions of kernels which are gone are deleted.
+        The file is used in WAL mode.""")
+
+    kernel_model_concurrency = Integer(16, config=True,
+        help="""The maximum number of kernel models looked up at the same time
+        when listing sessions, e.g. from a remote kernel manager.""")
+
+    @validate('database_filepath')
+    def _validate_database_filepath(self, proposal):
+        value = proposal['value']
+        if value != ':memory:' and os.path.isdir(value):
+            raise TraitError(
+                "database_filepath is a directory, not a file: %r" % value)
+        return value
+
     # Session database initialized below
     _cursor = None
     _connection = None
     _columns = {'session_id', 'path', 'name', 'type', 'kernel_id'}
+    # the SQL of queries by the columns they match or set, so that the
+    # statements prepared by sqlite3 are found in its statement cache
+    _queries = None
 
     @property
     def cursor(self):
         """Start a cursor and create a database called 'session'"""
         if self._cursor is None:
             self._cursor = self.connection.cursor()
-            self._cursor.execute("""CREATE TABLE session
-                (session_id, path, name, type, kernel_id)""")
         return self._cursor
 
     @property
     def connection(self):
         """Start a database connection"""
         if self._connection is None:
-            self._connection = sqlite3.connect(':memory:')
-            self._connection.row_factory = sqlite3.Row
+            # autocommit, so that a database file is always up to date
+            connection = sqlite3.connect(
+                self.database_filepath, isolation_level=None, cached_statements=256,
+            )
+            connection.row_factory = sqlite3.Row
+            if self.database_filepath != ':memory:':
+                connection.execute("PRAGMA journal_mode=WAL")
+                connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute("""CREATE TABLE IF NOT EXISTS session
+                (session_id TEXT PRIMARY KEY, path TEXT, name TEXT, type TEXT, kernel_id TEXT)""")
+            connection.execute("CREATE INDEX IF NOT EXISTS session_path_index ON session (path)")
+            connection.execute("CREATE INDEX IF NOT EXISTS session_kernel_id_index ON session (kernel_id)")
+            self._connection = connection
+            self._queries = {}
         return self._connection
 
+    def _execute(self, kind, columns, parameters=()):
+        """Execute a query matching or setting columns
+
+        kind is 'select' or 'update'.
+        """
+        connection = self.connection
+        key = (kind, tuple(columns))
+        query = self._queries.get(key)
+        if query is None:
+            for column in columns:
+                if column not in self._columns:
+                    raise TypeError("No such column: %r" % column)
+            if kind == 'select':
+                query = "SELECT * FROM session WHERE %s" % (
+                    ' AND '.join("%s=?" % column for column in columns))
+            else:
+                query = "UPDATE session SET %s WHERE session_id=?" % (
+                    ', '.join("%s=?" % column for column in columns))
+            self._queries[key] = query
+        return connection.execute(query, parameters)
+
     def close(self):
         """Close the sqlite connection"""
         if self._cursor is not None:
             self._cursor.close()
             self._cursor = None
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+            self._queries = None
 
     def __del__(self):
         """Close connection once SessionManager closes"""
@@ -71,8 +132,7 @@ class SessionManager(LoggingConfigurable):
     def session_exists(self, path):
         """Check to see if the session of a given name exists"""
         exists = False
-        self.cursor.execute("SELECT * FROM session WHERE path=?", (path,))
-        row = self.cursor.fetchone()
+        row = self._execute('select', ('path',), (path,)).fetchone()
         if row is not None:
             # Note, although we found a row for the session, the associated kernel may have
             # been culled or died unexpectedly.  If that's the case, we should delete the
@@ -139,7 +199,8 @@ class SessionManager(LoggingConfigurable):
         model : dict
             a dictionary of the session model
         """
-        self.cursor.execute("INSERT INTO session VALUES (?,?,?,?,?)",
+        self.connection.execute(
+            "INSERT INTO session (session_id, path, name, type, kernel_id) VALUES (?,?,?,?,?)",
             (session_id, path, name, type, kernel_id)
         )
         result = yield maybe_future(self.get_session(session_id=session_id))
@@ -167,20 +228,7 @@ class SessionManager(LoggingConfigurable):
         if not kwargs:
             raise TypeError("must specify a column to query")
 
-        conditions = []
-        for column in kwargs.keys():
-            if column not in self._columns:
-                raise TypeError("No such column: %r", column)
-            conditions.append("%s=?" % column)
-
-        query = "SELECT * FROM session WHERE %s" % (' AND '.join(conditions))
-
-        self.cursor.execute(query, list(kwargs.values()))
-        try:
-            row = self.cursor.fetchone()
-        except KeyError:
-            # The kernel is missing, so the session just got deleted.
-            row = None
+        row = self._execute('select', kwargs.keys(), list(kwargs.values())).fetchone()
 
         if row is None:
             q = []
@@ -214,13 +262,7 @@ class SessionManager(LoggingConfigurable):
             # no changes
             return
 
-        sets = []
-        for column in kwargs.keys():
-            if column not in self._columns:
-                raise TypeError("No such column: %r" % column)
-            sets.append("%s=?" % column)
-        query = "UPDATE session SET %s WHERE session_id=?" % (', '.join(sets))
-        self.cursor.execute(query, list(kwargs.values()) + [session_id])
+        self._execute('update', kwargs.keys(), list(kwargs.values()) + [session_id])
 
     def kernel_culled(self, kernel_id):
         """Checks if the kernel is still considered alive and returns true if its not found. """
@@ -238,8 +280,8 @@ class SessionManager(LoggingConfigurable):
             # If caller wishes to tolerate culled kernels, log a warning
             # and return None.  Otherwise, raise KeyError with a similar
             # message.
-            self.cursor.execute("DELETE FROM session WHERE session_id=?",
-                                (row['session_id'],))
+            self.connection.execute("DELETE FROM session WHERE session_id=?",
+                                    (row['session_id'],))
             msg = "Kernel '{kernel_id}' appears to have been culled or died unexpectedly, " \
                   "invalidating session '{session_id}'. The session has been removed.".\
                 format(kernel_id=row['kernel_id'],session_id=row['session_id'])
@@ -249,6 +291,9 @@ class SessionManager(LoggingConfigurable):
             raise KeyError(msg)
 
         kernel_model = yield maybe_future(self.kernel_manager.kernel_model(row['kernel_id']))
+        raise gen.Return(self._session_model(row, kernel_model))
+
+    def _session_model(self, row, kernel_model):
         model = {
             'id': row['session_id'],
             'path': row['path'],
@@ -259,22 +304,79 @@ class SessionManager(LoggingConfigurable):
         if row['type'] == 'notebook':
             # Provide the deprecated API.
             model['notebook'] = {'path': row['path'], 'name': row['name']}
-        raise gen.Return(model)
+        return model
+
+    @gen.coroutine
+    def _gather(self, func, items):
+        """Call func on items concurrently, up to kernel_model_concurrency at a time
+
+        Returns the results in the order of items.
+        """
+        semaphore = locks.Semaphore(max(self.kernel_model_concurrency, 1))
+
+        @gen.coroutine
+        def call(item):
+            with (yield semaphore.acquire()):
+                result = yield maybe_future(func(item))
+            raise gen.Return(result)
+
+        results = yield gen.multi([call(item) for item in items])
+        raise gen.Return(results)
+
+    @gen.coroutine
+    def kernel_models(self, kernel_ids):
+        """Returns the models of kernels, by id
+
+        Kernels which were culled or died are left out. The kernels are
+        looked up concurrently.
+        """
+        @gen.coroutine
+        def kernel_model(kernel_id):
+            kernel_culled = yield maybe_future(self.kernel_culled(kernel_id))
+            if kernel_culled:
+                raise gen.Return(None)
+            model = yield maybe_future(self.kernel_manager.kernel_model(kernel_id))
+            raise gen.Return(model)
+
+        models = yield self._gather(kernel_model, kernel_ids)
+        raise gen.Return({
+            kernel_id: model
+            for kernel_id, model in zip(kernel_ids, models)
+            if model is not None
+        })
 
     @gen.coroutine
     def list_sessions(self):
         """Returns a list of dictionaries containing all the information from
         the session database"""
-        c = self.cursor.execute("SELECT * FROM session")
+        rows = self.connection.execute("SELECT * FROM session ORDER BY rowid").fetchall()
+        if type(self).row_to_model is not SessionManager.row_to_model:
+            # respect the models of subclasses
+            @gen.coroutine
+            def row_to_model(row):
+                try:
+                    model = yield maybe_future(self.row_to_model(row))
+                except KeyError:
+                    model = None
+                raise gen.Return(model)
+
+            models = yield self._gather(row_to_model, rows)
+            raise gen.Return([model for model in models if model is not None])
+
+        # each kernel is looked up once, and the sessions of culled kernels
+        # are deleted at once
+        kernel_ids = list(dict.fromkeys(row['kernel_id'] for row in rows))
+        kernel_models = yield maybe_future(self.kernel_models(kernel_ids))
         result = []
-        # We need to use fetchall() here, because row_to_model can delete rows,
-        # which messes up the cursor if we're iterating over rows.
-        for row in c.fetchall():
-            try:
-                model = yield maybe_future(self.row_to_model(row))
-                result.append(model)
-            except KeyError:
-                pass
+        culled = []
+        for row in rows:
+            kernel_model = kernel_models.get(row['kernel_id'])
+            if kernel_model is None:
+                culled.append((row['session_id'],))
+            else:
+                result.append(self._session_model(row, kernel_model))
+        if culled:
+            self.connection.executemany("DELETE FROM session WHERE session_id=?", culled)
         raise gen.Return(result)
 
     @gen.coroutine
@@ -282,4 +384,4 @@ class SessionManager(LoggingConfigurable):
         """Deletes the row in the session database with given session_id"""
         session = yield maybe_future(self.get_session(session_id=session_id))
         yield maybe_future(self.kernel_manager.shutdown_kernel(session['kernel']['id']))
-        self.cursor.execute("DELETE FROM session WHERE session_id=?", (session_id,))
+        self.connection.execute("DELETE FROM session WHERE session_id=?", (session_id,))
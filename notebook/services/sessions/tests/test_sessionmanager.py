@@ -1,10 +1,13 @@
 """Tests for the session manager."""
 
 from functools import partial
+import os
 from unittest import TestCase
 
+from ipython_genutils.tempdir import TemporaryDirectory
 from tornado import gen, web
 from tornado.ioloop import IOLoop
+from traitlets import TraitError
 
 from ..sessionmanager import SessionManager
 from notebook.services.kernels.kernelmanager import MappingKernelManager
@@ -254,3 +257,98 @@ class TestSessionManager(TestCase):
         with self.assertRaises(web.HTTPError):
             self.loop.run_sync(lambda : sm.delete_session(session_id='23424')) # nonexistent
 
+
+    def test_indexes(self):
+        sm = self.sm
+        self.create_session(path='/path/to/test.ipynb', kernel_name='python')
+        for column in ('session_id', 'path', 'kernel_id'):
+            plan = sm.connection.execute(
+                "EXPLAIN QUERY PLAN SELECT * FROM session WHERE %s=?" % column, ('x',)
+            ).fetchall()
+            self.assertIn('INDEX', ' '.join(str(row[-1]) for row in plan))
+
+    def test_list_sessions_kernel_models(self):
+        sm = self.sm
+        sessions = self.create_sessions(
+            dict(path='/path/to/1/test1.ipynb', kernel_name='python'),
+            dict(path='/path/to/2/test2.ipynb', kernel_name='python'),
+        )
+        self.create_session(path='/path/to/3', type='console', kernel_id='A')
+        requested = []
+        kernel_model = sm.kernel_manager.kernel_model
+        def counted_kernel_model(kernel_id):
+            requested.append(kernel_id)
+            return kernel_model(kernel_id)
+        sm.kernel_manager.kernel_model = counted_kernel_model
+        sm.kernel_manager.shutdown_kernel(sessions[1]['kernel']['id'])
+
+        listed = self.loop.run_sync(lambda: sm.list_sessions())
+        self.assertEqual([s['kernel']['id'] for s in listed], ['A', 'A'])
+        self.assertEqual(requested, ['A'])
+        # the session of the dead kernel was deleted
+        rows = sm.connection.execute("SELECT * FROM session").fetchall()
+        self.assertEqual(len(rows), 2)
+
+    def test_list_sessions_concurrency(self):
+        sm = self.sm
+        sm.kernel_model_concurrency = 2
+        self.create_sessions(*[
+            dict(path='/path/to/%i/test.ipynb' % i, kernel_name='python') for i in range(5)
+        ])
+        in_flight = []
+        kernel_model = sm.kernel_manager.kernel_model
+        @gen.coroutine
+        def slow_kernel_model(kernel_id):
+            in_flight.append(kernel_id)
+            yield gen.sleep(0.01)
+            model = kernel_model(kernel_id)
+            in_flight.remove(kernel_id)
+            raise gen.Return(model)
+
+        max_in_flight = []
+        @gen.coroutine
+        def kernel_culled(kernel_id):
+            max_in_flight.append(len(in_flight))
+            raise gen.Return(kernel_id not in sm.kernel_manager)
+
+        sm.kernel_manager.kernel_model = slow_kernel_model
+        sm.kernel_culled = kernel_culled
+        listed = self.loop.run_sync(lambda: sm.list_sessions())
+        self.assertEqual([s['kernel']['id'] for s in listed], list('ABCDE'))
+        self.assertEqual(max(max_in_flight), 1)
+
+
+class TestSessionManagerDatabaseFile(TestCase):
+
+    def setUp(self):
+        td = TemporaryDirectory()
+        self.td = td.__enter__()
+        self.addCleanup(td.__exit__, None, None, None)
+        self.loop = IOLoop()
+        self.addCleanup(partial(self.loop.close, all_fds=True))
+        self.kernel_manager = DummyMKM()
+
+    def session_manager(self):
+        sm = SessionManager(
+            kernel_manager=self.kernel_manager,
+            contents_manager=ContentsManager(),
+            database_filepath=os.path.join(self.td, 'sessions.db'),
+        )
+        self.addCleanup(sm.close)
+        return sm
+
+    def test_persistence(self):
+        sm = self.session_manager()
+        session = self.loop.run_sync(lambda: sm.create_session(
+            path='/path/to/test.ipynb', type='notebook', kernel_name='python'))
+        self.assertEqual(
+            sm.connection.execute("PRAGMA journal_mode").fetchone()[0], 'wal')
+        sm.close()
+
+        sm = self.session_manager()
+        model = self.loop.run_sync(lambda: sm.get_session(session_id=session['id']))
+        self.assertEqual(model, session)
+
+    def test_directory(self):
+        with self.assertRaises(TraitError):
+            SessionManager(database_filepath=self.td)
@@ -6,13 +6,14 @@
 # Copyright (c) Jupyter Development Team.
 # Distributed under the terms of the Modified BSD License.
 
+import asyncio
 import warnings
 
 from datetime import timedelta
 from notebook._tz import utcnow, isoformat
+from notebook.culler import IdleCuller
 from terminado import NamedTermManager
 from tornado import web
-from tornado.ioloop import IOLoop, PeriodicCallback
 from traitlets import Integer, validate
 from traitlets.config import LoggingConfigurable
 from ..prometheus.metrics import TERMINAL_CURRENTLY_RUNNING_TOTAL
@@ -32,7 +33,8 @@ class TerminalManager(LoggingConfigurable, NamedTermManager):
 
     cull_interval_default = 300  # 5 minutes
     cull_interval = Integer(cull_interval_default, config=True,
-        help="""The interval (in seconds) on which to check for terminals exceeding the inactive timeout value."""
+        help="""The interval (in seconds) on which to check again for inactive terminals which failed to be
+        culled. Terminals are otherwise culled as soon as they have been inactive for the timeout value."""
                             )
 
     # -------------------------------------------------------------------------
@@ -63,6 +65,8 @@ class TerminalManager(LoggingConfigurable, NamedTermManager):
         TERMINAL_CURRENTLY_RUNNING_TOTAL.inc()
         # Ensure culler is initialized
         self._initialize_culler()
+        if self._culler_callback is not None:
+            self._culler_callback.add(name, self._terminal_cull_time(name))
         return model
 
     def get(self, name):
@@ -118,44 +122,38 @@ class TerminalManager(LoggingConfigurable, NamedTermManager):
         """
         if not self._initialized_culler and self.cull_inactive_timeout > 0:
             if self._culler_callback is None:
-                loop = IOLoop.current()
                 if self.cull_interval <= 0:  # handle case where user set invalid value
                     self.log.warning("Invalid value for 'cull_interval' detected (%s) - using default value (%s).",
                                      self.cull_interval, self.cull_interval_default)
                     self.cull_interval = self.cull_interval_default
-                self._culler_callback = PeriodicCallback(
-                    self._cull_terminals, 1000 * self.cull_interval)
-                self.log.info("Culling terminals with inactivity > %s seconds at %s second intervals ...",
-                              self.cull_inactive_timeout, self.cull_interval)
-                self._culler_callback.start()
+                self._culler_callback = IdleCuller(
+                    self._terminal_cull_time, self._cull_terminals, self.cull_interval, log=self.log,
+                )
+                self.log.info("Culling terminals with inactivity > %s seconds ...", self.cull_inactive_timeout)
 
         self._initialized_culler = True
 
-    async def _cull_terminals(self):
-        self.log.debug("Polling every %s seconds for terminals inactive for > %s seconds...",
-                       self.cull_interval, self.cull_inactive_timeout)
-        # Create a separate list of terminals to avoid conflicting updates while iterating
-        for name in list(self.terminals):
+    def _terminal_cull_time(self, name):
+        """The time from which terminal 'name' may be culled, or None if it is gone"""
+        term = self.terminals.get(name)
+        if term is None:
+            return None
+        self.log.debug("name=%s, last_activity=%s", name, term.last_activity)
+        return max(term.last_activity + timedelta(seconds=self.cull_inactive_timeout), utcnow())
+
+    async def _cull_terminals(self, names):
+        async def cull(name):
+            term = self.terminals.get(name)
+            if term is None:
+                return  # already terminated
+            inactivity = int((utcnow() - term.last_activity).total_seconds())
+            self.log.warning("Culling terminal '%s' due to %s seconds of inactivity.", name, inactivity)
             try:
-                await self._cull_inactive_terminal(name)
+                await self.terminate(name, force=True)
+            except web.HTTPError:
+                pass  # already terminated
             except Exception as e:
-                self.log.exception("The following exception was encountered while checking the "
-                                   "activity of terminal {}: {}".format(name, e))
-
-    async def _cull_inactive_terminal(self, name):
-        try:
-            term = self.terminals[name]
-        except KeyError:
-            return  # KeyErrors are somewhat expected since the terminal can be terminated as the culling check is made.
+                self.log.exception("The following exception was encountered while culling "
+                                   "terminal {}: {}".format(name, e))
 
-        self.log.debug("name=%s, last_activity=%s", name, term.last_activity)
-        if hasattr(term, 'last_activity'):
-            dt_now = utcnow()
-            dt_inactive = dt_now - term.last_activity
-            # Compute idle properties
-            is_time = dt_inactive > timedelta(seconds=self.cull_inactive_timeout)
-            # Cull the kernel if all three criteria are met
-            if (is_time):
-                inactivity = int(dt_inactive.total_seconds())
-                self.log.warning("Culling terminal '%s' due to %s seconds of inactivity.", name, inactivity)
-                await self.terminate(name, force=True)
+        await asyncio.gather(*[cull(name) for name in names])
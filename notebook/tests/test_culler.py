@@ -0,0 +1,88 @@
+"""Tests for the deadline culler"""
+
+import asyncio
+from datetime import timedelta
+
+from tornado.testing import AsyncTestCase, gen_test
+
+from notebook._tz import utcnow
+from notebook.culler import IdleCuller
+
+
+class TestIdleCuller(AsyncTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.timeout = timedelta(seconds=0.2)
+        self.last_activity = {}
+        self.culled = []
+        self.culler = IdleCuller(self.cull_time, self.cull, retry_interval=0.1)
+        self.addCleanup(self.culler.stop)
+
+    def cull_time(self, key):
+        if key not in self.last_activity:
+            return None
+        return self.last_activity[key] + self.timeout
+
+    async def cull(self, keys):
+        self.culled.append(sorted(keys))
+        for key in keys:
+            del self.last_activity[key]
+
+    def start(self, key):
+        self.last_activity[key] = utcnow()
+        self.culler.add(key, self.cull_time(key))
+
+    @gen_test
+    async def test_cull(self):
+        self.start('a')
+        self.start('b')
+        await asyncio.sleep(0.1)
+        self.start('c')
+        self.assertEqual(len(self.culler), 3)
+        # one timer, for the earliest deadline
+        self.assertEqual(self.culler._timer_deadline, self.cull_time('a'))
+
+        # activity is noticed when the deadline comes
+        self.last_activity['b'] = utcnow()
+        await asyncio.sleep(0.15)
+        self.assertEqual(self.culled, [['a']])
+        await asyncio.sleep(0.15)
+        self.assertEqual(self.culled, [['a'], ['b', 'c']])
+        # forgotten when checked again
+        await asyncio.sleep(0.15)
+        self.assertEqual(len(self.culler), 0)
+        self.assertIsNone(self.culler._timer)
+
+    @gen_test
+    async def test_add_discard(self):
+        self.start('a')
+        self.culler.add('a', utcnow() + timedelta(seconds=10))
+        self.assertEqual(self.culler._timer_deadline, self.cull_time('a'))
+        self.culler.discard('a')
+        await asyncio.sleep(0.3)
+        self.assertEqual(self.culled, [])
+
+        # sooner deadlines replace later ones
+        self.culler.add('a', utcnow() + timedelta(seconds=10))
+        self.culler.add('a', utcnow())
+        await asyncio.sleep(0.05)
+        self.assertEqual(self.culled, [['a']])
+
+    @gen_test
+    async def test_retry(self):
+        async def cull(keys):
+            self.culled.append(sorted(keys))
+            if len(self.culled) == 1:
+                raise RuntimeError('failed')
+            for key in keys:
+                del self.last_activity[key]
+        self.culler.cull = cull
+        self.start('a')
+        await asyncio.sleep(0.25)
+        self.assertEqual(self.culled, [['a']])
+        self.assertIn('a', self.culler)
+        await asyncio.sleep(0.1)
+        self.assertEqual(self.culled, [['a'], ['a']])
+        await asyncio.sleep(0.1)
+        self.assertNotIn('a', self.culler)
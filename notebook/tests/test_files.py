@@ -14,6 +14,10 @@ from nbformat.v4 import (new_notebook,
                               new_markdown_cell, new_code_cell,
                               new_output)
 
+from traitlets.config import Config
+
+from notebook.files.handlers import FilesHandler
+from notebook.services.contents.filemanager import AsyncFileContentsManager
 from notebook.utils import url_path_join
 from .launchnotebook import NotebookTestBase
 from ipython_genutils import py3compat
@@ -174,3 +178,56 @@ class FilesTest(NotebookTestBase):
             r = self.request('GET', url)
             self.assertEqual(r.status_code, 200)
             self.assertEqual(r.text, prefix + '/f3')
+
+
+class ContentsFilesTest(FilesTest):
+    """Run the tests from FilesTest with FilesHandler, streaming from the ContentsManager."""
+    config = Config()
+    config.FileContentsManager.files_handler_class = FilesHandler
+    config.FileContentsManager.files_handler_params = {}
+    config.FileContentsManager.stream_chunk_size = 7
+
+    def test_stream_chunks(self):
+        data = bytes(range(256)) * 4
+        with open(pjoin(self.notebook_dir, 'stream.bin'), 'wb') as f:
+            f.write(data)
+
+        r = self.request('GET', 'files/stream.bin')
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r.headers['content-type'], 'application/octet-stream')
+        self.assertEqual(r.headers['accept-ranges'], 'bytes')
+        self.assertEqual(r.content, data)
+
+    def test_range(self):
+        data = bytes(range(256)) * 4
+        with open(pjoin(self.notebook_dir, 'range.bin'), 'wb') as f:
+            f.write(data)
+
+        for byte_range, start, end in [
+            ('bytes=10-29', 10, 30),
+            ('bytes=1000-', 1000, 1024),
+            ('bytes=-5', 1019, 1024),
+            ('bytes=1000-2000', 1000, 1024),
+        ]:
+            r = self.request('GET', 'files/range.bin', headers={'Range': byte_range})
+            self.assertEqual(r.status_code, 206)
+            self.assertEqual(r.headers['content-range'], 'bytes %i-%i/1024' % (start, end - 1))
+            self.assertEqual(r.content, data[start:end])
+
+        for byte_range in ['bytes=0-', 'bytes=0-1,5-6', 'lines=1-2']:
+            r = self.request('GET', 'files/range.bin', headers={'Range': byte_range})
+            self.assertEqual(r.status_code, 200)
+            self.assertEqual(r.content, data)
+
+        r = self.request('GET', 'files/range.bin', headers={'Range': 'bytes=2000-'})
+        self.assertEqual(r.status_code, 416)
+        self.assertEqual(r.headers['content-range'], 'bytes */1024')
+
+
+class AsyncContentsFilesTest(ContentsFilesTest):
+    """Run the tests from ContentsFilesTest with AsyncFileContentsManager."""
+    config = Config(ContentsFilesTest.config)
+    config.NotebookApp.contents_manager_class = AsyncFileContentsManager
+
+    def test_config_did_something(self):
+        self.assertIsInstance(self.notebook.contents_manager, AsyncFileContentsManager)
@@ -1,4 +1,5 @@
 """Test GatewayClient"""
+import asyncio
 import os
 import json
 import uuid
@@ -10,7 +11,14 @@ from tornado import gen
 from tornado.web import HTTPError
 from tornado.httpclient import HTTPRequest, HTTPResponse
 
-from notebook.gateway.managers import GatewayClient
+from ipython_genutils.tempdir import TemporaryDirectory
+
+from jupyter_client.jsonutil import date_default
+from jupyter_client.session import Session
+
+from notebook.base.zmqhandlers import serialize_binary_message
+from notebook.gateway.handlers import _peek_message
+from notebook.gateway.managers import GatewayClient, GatewaySessionManager
 from notebook.utils import maybe_future
 from .launchnotebook import NotebookTestBase
 
@@ -125,6 +133,19 @@ async def mock_gateway_request(url, **kwargs):
             raise HTTPError(404, message='Kernel does not exist: %s' % requested_kernel_id)
 
 
+def test_peek_message():
+    msg = Session().msg('display_data', {'data': {'channel': 'shell', 'text/plain': '"channel": "shell"}'}})
+    msg['channel'] = 'iopub'
+    channel, header = _peek_message(json.dumps(msg, default=date_default))
+    assert (channel, header['msg_type']) == ('iopub', 'display_data')
+    # messages in another order are fully decoded
+    reordered = {'channel': 'iopub', 'header': msg['header'], 'content': msg['content']}
+    assert _peek_message(json.dumps(reordered, default=date_default))[0] == 'iopub'
+    msg['buffers'] = [b'data']
+    channel, header = _peek_message(serialize_binary_message(msg))
+    assert (channel, header['msg_type']) == ('iopub', 'display_data')
+
+
 mocked_gateway = patch('notebook.gateway.managers.gateway_request', mock_gateway_request)
 
 
@@ -222,6 +243,112 @@ class TestGateway(NotebookTestBase):
         self.delete_session(session_id)
         self.assertFalse(self.is_kernel_running(kernel_id))
 
+    def test_gateway_list_sessions(self):
+        # sessions are listed with one request to the gateway
+        session_id, kernel_id = self.create_session('kspec_foo')
+        requests = []
+        async def counted_gateway_request(url, **kwargs):
+            requests.append((kwargs['method'], url))
+            return await mock_gateway_request(url, **kwargs)
+
+        with patch('notebook.gateway.managers.gateway_request', counted_gateway_request):
+            response = self.request('GET', '/api/sessions')
+            self.assertEqual(response.status_code, 200)
+            sessions = json.loads(response.content.decode('utf-8'))
+        self.assertEqual([s['id'] for s in sessions], [session_id])
+        self.assertEqual(sessions[0]['kernel']['id'], kernel_id)
+        self.assertEqual(requests, [('GET', self.mock_gateway_url + '/api/kernels')])
+
+        self.delete_session(session_id)
+
+    def test_gateway_persisted_sessions(self):
+        # the kernels of the sessions of a database file are adopted on restart
+        kernel_id = self.create_kernel('kspec_foo')
+        km = self.notebook.kernel_manager
+        km.remove_kernel(kernel_id)
+        self.assertNotIn(kernel_id, km)
+
+        async def list_sessions(database_filepath):
+            # sqlite objects are used on the thread which created them
+            sm = GatewaySessionManager(
+                kernel_manager=km, contents_manager=self.notebook.contents_manager,
+                database_filepath=database_filepath,
+            )
+            try:
+                for session_id, kid in [('s1', kernel_id), ('s2', 'gone')]:
+                    sm.connection.execute(
+                        "INSERT INTO session (session_id, path, name, type, kernel_id) VALUES (?,?,?,?,?)",
+                        (session_id, session_id + '.ipynb', '', 'notebook', kid),
+                    )
+                return await sm.list_sessions()
+            finally:
+                sm.close()
+
+        try:
+            with TemporaryDirectory() as td, mocked_gateway:
+                sessions = asyncio.run_coroutine_threadsafe(
+                    list_sessions(os.path.join(td, 'sessions.db')),
+                    self.notebook.io_loop.asyncio_loop,
+                ).result(10)
+            self.assertEqual([s['id'] for s in sessions], ['s1'])
+            self.assertEqual(sessions[0]['kernel']['id'], kernel_id)
+            self.assertIn(kernel_id, km)
+        finally:
+            km._kernels.setdefault(kernel_id, running_kernels[kernel_id])
+            self.delete_kernel(kernel_id)
+
+    def test_gateway_request_timeouts(self):
+        gateway_config = self.notebook.gateway_config
+        requests = []
+        async def recorded_gateway_request(url, **kwargs):
+            requests.append(kwargs)
+            return await mock_gateway_request(url, **kwargs)
+
+        gateway_config.request_timeouts = {'list': 5}
+        try:
+            with patch('notebook.gateway.managers.gateway_request', recorded_gateway_request):
+                response = self.request('GET', '/api/kernels')
+                self.assertEqual(response.status_code, 200)
+        finally:
+            gateway_config.request_timeouts = {}
+        self.assertEqual(requests[0]['request_timeout'], 5)
+        self.assertEqual(gateway_config.request_timeout_for('start'), 96.0)
+        args = gateway_config.load_connection_args(request_timeout=5)
+        self.assertEqual(args['request_timeout'], 5)
+        self.assertEqual(args['connect_timeout'], 44.4)
+
+    def test_gateway_shutdown_all(self):
+        kernel_ids = [self.create_kernel('kspec_bar') for i in range(4)]
+        timed_out_id = kernel_ids.pop()
+        in_flight = []
+        max_in_flight = []
+        async def slow_gateway_request(url, **kwargs):
+            in_flight.append(url)
+            max_in_flight.append(len(in_flight))
+            await asyncio.sleep(0.05)
+            in_flight.remove(url)
+            if url.endswith(timed_out_id):
+                raise HTTPError(599, "Timeout in request queue")
+            return await mock_gateway_request(url, **kwargs)
+
+        km = self.notebook.kernel_manager
+        gateway_config = self.notebook.gateway_config
+        gateway_config.max_connections = 2
+        try:
+            with patch('notebook.gateway.managers.gateway_request', slow_gateway_request):
+                asyncio.run_coroutine_threadsafe(
+                    km.shutdown_all(), self.notebook.io_loop.asyncio_loop
+                ).result(10)
+        finally:
+            gateway_config.max_connections = 10
+        self.assertEqual(max(max_in_flight), 2)
+        for kernel_id in kernel_ids:
+            self.assertNotIn(kernel_id, km)
+            self.assertNotIn(kernel_id, running_kernels)
+        # The kernel whose shutdown timed out is still tracked
+        self.assertIn(timed_out_id, km)
+        self.delete_kernel(timed_out_id)
+
     def test_gateway_kernel_lifecycle(self):
         # Validate kernel lifecycle functions; create, interrupt, restart and delete.
 
@@ -1,11 +1,17 @@
 """Test serialize/deserialize messages with buffers"""
 
+import json
 import os
+from types import SimpleNamespace
 
+import pytest
+from jupyter_client.jsonutil import extract_dates
 from jupyter_client.session import Session
 from ..base.zmqhandlers import (
     serialize_binary_message,
     deserialize_binary_message,
+    serialize_msg_frames,
+    ZMQStreamHandler,
 )
 
 def test_serialize_binary():
@@ -22,3 +28,66 @@ def test_deserialize_binary():
     bmsg = serialize_binary_message(msg)
     msg2 = deserialize_binary_message(bmsg)
     assert msg2 == msg
+
+def test_serialize_msg_frames():
+    s = Session()
+    msg = s.msg('display_data', content={'data': {'text/plain': 'hi'}, 'metadata': {}})
+    idents, msg_list = s.feed_identities(s.serialize(msg))
+    smsg = serialize_msg_frames(msg_list, msg['header'], channel='iopub')
+    assert isinstance(smsg, str)
+    msg2 = json.loads(smsg)
+    msg2['header'] = extract_dates(msg2['header'])
+    expected = s.deserialize(msg_list)
+    expected['channel'] = 'iopub'
+    assert msg2 == expected
+
+def test_serialize_msg_frames_binary():
+    s = Session()
+    msg = s.msg('data_pub', content={'a': 'b'})
+    buffers = [os.urandom(2) for i in range(3)]
+    idents, msg_list = s.feed_identities(s.serialize(msg) + buffers)
+    bmsg = serialize_msg_frames(msg_list, msg['header'])
+    assert isinstance(bmsg, bytes)
+    msg2 = deserialize_binary_message(bmsg)
+    assert msg2['content'] == {'a': 'b'}
+    assert msg2['header'] == msg['header']
+    assert msg2['buffers'] == buffers
+
+def test_serialize_msg_frames_invalid_utf8():
+    s = Session()
+    msg = s.msg('stream', content={'name': 'stdout', 'text': '@'})
+    idents, msg_list = s.feed_identities(s.serialize(msg))
+    msg_list[4] = msg_list[4].replace(b'@', b'\xff')
+    msg2 = json.loads(serialize_msg_frames(msg_list, msg['header']))
+    assert msg2['content']['text'] == '�'
+
+def reserialize(handler, msg_list):
+    header = handler.session.unpack(msg_list[1])
+    return ZMQStreamHandler._reserialize_reply(handler, msg_list, channel='iopub', header=header)
+
+def test_check_signature():
+    s = Session(key=b'secret', digest_history_size=10)
+    handler = SimpleNamespace(session=s)
+    for i in range(12):
+        msg = s.msg('stream', content={'name': 'stdout', 'text': str(i)})
+        idents, msg_list = s.feed_identities(s.serialize(msg))
+        reserialize(handler, msg_list)
+    assert len(s.digest_history) <= 10
+    assert msg_list[0] in s.digest_history
+    with pytest.raises(ValueError, match='Duplicate'):
+        reserialize(handler, msg_list)
+    msg_list[0] = b'0' * len(msg_list[0])
+    with pytest.raises(ValueError, match='Invalid'):
+        reserialize(handler, msg_list)
+    assert msg_list[0] not in s.digest_history
+
+def test_reserialize_reply_unpacked_header():
+    s = Session(key=b'secret')
+    handler = SimpleNamespace(session=s)
+    def unpack_header(msg_list):
+        pytest.fail("the header was already unpacked")
+    handler._unpack_header = unpack_header
+    msg = s.msg('display_data', content={'data': {'text/plain': 'hi'}, 'metadata': {}})
+    idents, msg_list = s.feed_identities(s.serialize(msg))
+    smsg = ZMQStreamHandler._reserialize_reply(handler, msg_list, channel='iopub', header=msg['header'])
+    assert smsg == serialize_msg_frames(msg_list, msg['header'], channel='iopub')
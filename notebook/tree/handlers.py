@@ -3,10 +3,10 @@
 # Copyright (c) Jupyter Development Team.
 # Distributed under the terms of the Modified BSD License.
 
-from tornado import web
+from tornado import web, gen
 import os
 from ..base.handlers import IPythonHandler, path_regex
-from ..utils import url_path_join, url_escape
+from ..utils import maybe_future, url_path_join, url_escape
 
 
 class TreeHandler(IPythonHandler):
@@ -35,6 +35,7 @@ class TreeHandler(IPythonHandler):
             return 'Home Page - Select or create a notebook'
 
     @web.authenticated
+    @gen.coroutine
     def get(self, path=''):
         path = path.strip('/')
         cm = self.contents_manager
@@ -55,7 +56,7 @@ class TreeHandler(IPythonHandler):
             ))
         elif cm.file_exists(path):
             # it's not a directory, we have redirecting to do
-            model = cm.get(path, content=False)
+            model = yield maybe_future(cm.get(path, content=False))
             # redirect to /api/notebooks if it's a notebook, otherwise /api/files
             service = 'notebooks' if model['type'] == 'notebook' else 'files'
             url = url_path_join(
@@ -120,6 +120,7 @@ for more information.
         'jupyter_core>=4.6.1',
         'jupyter_client>=5.3.4',
         'nbformat',
+        'python-dateutil>=2.7',
         'nbconvert',
         'ipykernel', # bless IPython kernel for now
         'Send2Trash>=1.5.0',
@@ -132,7 +133,8 @@ for more information.
         'docs': ['sphinx', 'nbsphinx', 'sphinxcontrib_github_alt',
                  'sphinx_rtd_theme', 'myst-parser'],
         'test:sys_platform != "win32"': ['requests-unixsocket'],
-        'json-logging': ['json-logging']
+        'json-logging': ['json-logging'],
+        'gateway': ['pycurl'],
     },
     python_requires = '>=3.6',
     entry_points = {